@@ -0,0 +1,349 @@
+# analytics_export.py
+"""Point-in-time analytics snapshot in a SQLite file.
+
+Head-office analysis runs against this file instead of production. One
+REPEATABLE READ, READ ONLY transaction copies every table, so the tables
+agree with each other as of a single moment. Rows are streamed out with
+COPY and inserted into SQLite as they arrive, so memory use does not
+grow with table size.
+
+The branch, product and batch tables are small and are copied in full
+each time. Transactions are refreshed incrementally from the change log
+(see sync.py): only sales written since the last snapshot are copied
+again, and cancelled ones are removed. A full copy is made for a new
+file, on request, or when the change log has been pruned past the last
+snapshot.
+
+A refresh writes a copy of the file and renames it into place, so readers
+never see a half-written snapshot. Timestamps are stored as WIB text.
+
+Refreshes requested over HTTP run on a background thread of the worker
+(see ExportJob); the nightly one runs from maintenance.py.
+"""
+import fcntl
+import io
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import psycopg2
+
+logger = logging.getLogger('analytics_export')
+
+SCHEMA = """
+CREATE TABLE snapshot_info (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE cabang (id_cabang INTEGER PRIMARY KEY, kode TEXT, nama TEXT);
+CREATE TABLE produk (
+    id_cabang INTEGER, sku TEXT, nama_item TEXT, kategori TEXT, stok_minimum INTEGER,
+    harga REAL, waktu_pembaruan TEXT, PRIMARY KEY (id_cabang, sku)
+);
+CREATE TABLE inventory (
+    id_cabang INTEGER, sku TEXT, batch_number TEXT, id_batch INTEGER, stok_tersedia INTEGER,
+    waktu_pembaruan TEXT, PRIMARY KEY (id_cabang, sku, batch_number)
+);
+CREATE TABLE transaksi (
+    id_transaksi INTEGER PRIMARY KEY, id_cabang INTEGER, total_amount REAL, waktu_transaksi TEXT
+);
+CREATE TABLE transaksi_detail (
+    id INTEGER PRIMARY KEY, id_transaksi INTEGER, waktu_transaksi TEXT, id_cabang INTEGER,
+    id_batch INTEGER, sku TEXT, batch_number TEXT, jumlah INTEGER, harga_satuan REAL, subtotal REAL
+);
+"""
+
+# Built after a full load, which is faster than maintaining them row by row
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_transaksi_waktu ON transaksi (waktu_transaksi);
+CREATE INDEX IF NOT EXISTS idx_transaksi_detail_transaksi ON transaksi_detail (id_transaksi);
+CREATE INDEX IF NOT EXISTS idx_transaksi_detail_sku ON transaksi_detail (id_cabang, sku);
+"""
+
+# Copied in full on every run
+SMALL_TABLES = {
+    'cabang': 'SELECT id_cabang, kode, nama FROM cabang',
+    'produk': 'SELECT id_cabang, sku, nama_item, kategori, stok_minimum, harga, waktu_pembaruan FROM produk',
+    'inventory': 'SELECT id_cabang, sku, batch_number, id_batch, stok_tersedia, waktu_pembaruan FROM inventory',
+}
+
+TRANSACTIONS = 'SELECT id_transaksi, id_cabang, total_amount, waktu_transaksi FROM transaksi t'
+# Sale lines carry the batch's natural key, so analysts need no join for it
+DETAILS = """
+    SELECT d.id, d.id_transaksi, d.waktu_transaksi, d.id_cabang, d.id_batch, i.sku, i.batch_number,
+           d.jumlah, d.harga_satuan, d.subtotal
+    FROM transaksi_detail d
+    JOIN inventory i ON i.id_batch = d.id_batch
+"""
+
+_ESCAPE = re.compile(r'\\(.)')
+_ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v'}
+
+
+class ExportRunning(Exception):
+    """Another process is writing the snapshot"""
+
+
+def _field(value):
+    """One column of COPY text format"""
+    if value == '\\N':
+        return None
+    if '\\' not in value:
+        return value
+    return _ESCAPE.sub(lambda match: _ESCAPES.get(match.group(1), match.group(1)), value)
+
+
+class _RowSink(io.TextIOBase):
+    """Target of COPY ... TO STDOUT that inserts rows into SQLite in batches.
+
+    Text format puts one row per line, with newlines inside values escaped.
+    Column affinity turns numeric text back into numbers.
+    """
+
+    def __init__(self, target, table, batch_size=5000):
+        self.target = target
+        self.table = table
+        self.batch_size = batch_size
+        self.pending = ''
+        self.rows = []
+        self.count = 0
+
+    def write(self, data):
+        lines = (self.pending + data).split('\n')
+        self.pending = lines.pop()
+        self.rows.extend([_field(value) for value in line.split('\t')] for line in lines)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.rows:
+            placeholders = ', '.join('?' * len(self.rows[0]))
+            self.target.executemany(f'INSERT INTO {self.table} VALUES ({placeholders})', self.rows)
+            self.count += len(self.rows)
+            self.rows = []
+
+
+def _copy(cursor, query, lite, table):
+    """Stream the rows of `query` into the SQLite table; the number copied"""
+    sink = _RowSink(lite, table)
+    cursor.copy_expert(f'COPY ({query}) TO STDOUT', sink)
+    sink.flush()
+    return sink.count
+
+
+@contextmanager
+def _exclusive(lock_path):
+    with open(lock_path, 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise ExportRunning()
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def export_running(path):
+    """Whether any process is writing the snapshot at `path`"""
+    try:
+        with _exclusive(path + '.lock'):
+            return False
+    except ExportRunning:
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def read_info(path):
+    """snapshot_info of an existing file as a dict, None if there is none"""
+    if not os.path.exists(path):
+        return None
+    lite = sqlite3.connect(path)
+    try:
+        return dict(lite.execute('SELECT key, value FROM snapshot_info'))
+    except sqlite3.DatabaseError:
+        return None
+    finally:
+        lite.close()
+
+
+def _changed_transactions(cursor, info):
+    """Ids of transactions written after the snapshot described by `info`.
+
+    None if the change log no longer reaches back that far.
+    """
+    xid, seq = int(info['cursor_xid']), int(info['cursor_seq'])
+    cursor.execute('SELECT xid::text, seq FROM change_log_horizon')
+    horizon = cursor.fetchone()
+    if horizon and (xid, seq) < (int(horizon[0]), horizon[1]):
+        return None
+    # Everything visible to the snapshot is copied. The next cursor is the
+    # snapshot's xmin, so changes of transactions still running now (which
+    # may commit with a lower seq) are copied again next time, which is
+    # harmless.
+    cursor.execute("""
+        SELECT DISTINCT id_transaksi
+        FROM change_log
+        WHERE entity = 'transaksi' AND (xid, seq) > (CAST(%s AS text)::xid8, %s)
+    """, (str(xid), seq))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def export_snapshot(conn, path, full=False):
+    """Write or refresh the snapshot at `path` from psycopg2 connection `conn`.
+
+    Returns a summary of what was copied. Raises ExportRunning when another
+    export holds the file.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with _exclusive(path + '.lock'):
+        info = None if full else read_info(path)
+        work = path + '.tmp'
+        if os.path.exists(work):
+            os.remove(work)
+
+        previous_autocommit = conn.autocommit
+        conn.set_session(isolation_level='REPEATABLE READ', readonly=True, autocommit=False)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SET LOCAL TimeZone = 'Asia/Jakarta'")
+                cursor.execute('SELECT pg_snapshot_xmin(pg_current_snapshot())::text, now()::text')
+                xmin, generated_at = cursor.fetchone()
+
+                changed = _changed_transactions(cursor, info) if info else None
+                if changed is None:
+                    summary = _write_full(cursor, work)
+                else:
+                    shutil.copyfile(path, work)
+                    summary = _write_incremental(cursor, work, changed)
+        finally:
+            conn.rollback()
+            conn.set_session(isolation_level='DEFAULT', readonly='DEFAULT', autocommit=previous_autocommit)
+
+        lite = sqlite3.connect(work)
+        try:
+            lite.executemany('INSERT OR REPLACE INTO snapshot_info VALUES (?, ?)', [
+                ('cursor_xid', xmin),
+                ('cursor_seq', '0'),
+                ('generated_at', generated_at),
+                ('mode', summary['mode']),
+            ] + ([('full_at', generated_at)] if summary['mode'] == 'full' else []))
+            lite.commit()
+        finally:
+            lite.close()
+        os.replace(work, path)
+
+    summary['generated_at'] = generated_at
+    logger.info("Analytics snapshot (%s) at %s: %d transaction(s) copied",
+                summary['mode'], generated_at, summary['transaksi'])
+    return summary
+
+
+def _open(work):
+    lite = sqlite3.connect(work)
+    # The work file is discarded on failure, so it needs no journal
+    lite.execute('PRAGMA journal_mode = OFF')
+    lite.execute('PRAGMA synchronous = OFF')
+    return lite
+
+
+def _copy_small_tables(cursor, lite, summary):
+    for table, query in SMALL_TABLES.items():
+        lite.execute(f'DELETE FROM {table}')
+        summary[table] = _copy(cursor, query, lite, table)
+
+
+def _write_full(cursor, work):
+    lite = _open(work)
+    try:
+        lite.executescript(SCHEMA)
+        summary = {'mode': 'full'}
+        _copy_small_tables(cursor, lite, summary)
+        summary['transaksi'] = _copy(cursor, TRANSACTIONS, lite, 'transaksi')
+        summary['transaksi_detail'] = _copy(cursor, DETAILS, lite, 'transaksi_detail')
+        lite.executescript(INDEXES)
+        lite.execute('ANALYZE')
+        lite.commit()
+        return summary
+    finally:
+        lite.close()
+
+
+def _write_incremental(cursor, work, changed):
+    lite = _open(work)
+    try:
+        summary = {'mode': 'incremental', 'removed': 0}
+        _copy_small_tables(cursor, lite, summary)
+        summary['transaksi'] = summary['transaksi_detail'] = 0
+        if changed:
+            # Rewritten sales are replaced, cancelled ones stay removed
+            lite.execute('CREATE TEMP TABLE changed (id_transaksi INTEGER PRIMARY KEY)')
+            lite.executemany('INSERT INTO changed VALUES (?)', ((id_transaksi,) for id_transaksi in changed))
+            lite.execute('DELETE FROM transaksi_detail WHERE id_transaksi IN (SELECT id_transaksi FROM changed)')
+            lite.execute('DELETE FROM transaksi WHERE id_transaksi IN (SELECT id_transaksi FROM changed)')
+
+            ids = cursor.mogrify('%s', (changed,)).decode()
+            summary['transaksi'] = _copy(cursor, f'{TRANSACTIONS} WHERE t.id_transaksi = ANY({ids})', lite, 'transaksi')
+            summary['transaksi_detail'] = _copy(cursor, f'{DETAILS} WHERE d.id_transaksi = ANY({ids})', lite, 'transaksi_detail')
+            summary['removed'] = len(changed) - summary['transaksi']
+        lite.commit()
+        return summary
+    finally:
+        lite.close()
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class ExportJob:
+    """Refreshes started over HTTP, run by a background thread per worker.
+
+    The request only starts the thread; status() reports this worker's last
+    run, whether any process is exporting, and the snapshot on disk.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self.last_run = None
+
+    def start(self, database_url, path, full=False):
+        """Start a refresh; raises ExportRunning if one is already running"""
+        with self._lock:
+            if (self._thread is not None and self._thread.is_alive()) or export_running(path):
+                raise ExportRunning()
+            self.last_run = {'state': 'running', 'full': full, 'started_at': _now()}
+            self._thread = threading.Thread(target=self._run, args=(database_url, path, full),
+                                            name='analytics-export', daemon=True)
+            self._thread.start()
+            return dict(self.last_run)
+
+    def _run(self, database_url, path, full):
+        try:
+            conn = psycopg2.connect(database_url)
+            try:
+                result = {'state': 'done', 'summary': export_snapshot(conn, path, full)}
+            finally:
+                conn.close()
+        except ExportRunning:
+            # Another worker or the nightly job got the file first
+            result = {'state': 'failed', 'error': 'Another export was running'}
+        except Exception as e:
+            logger.exception("Analytics export failed")
+            result = {'state': 'failed', 'error': str(e)}
+        self.last_run = dict(self.last_run, finished_at=_now(), **result)
+
+    def status(self, path):
+        return {'running': export_running(path), 'last_run': self.last_run, 'snapshot': read_info(path)}
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+export_job = ExportJob()
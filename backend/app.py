@@ -1,12 +1,16 @@
 # /backend/app.py
-from flask import Flask
+from flask import Flask, jsonify
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import TimeoutError as PoolTimeout
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 from config import Config
+from logging_config import configure_logging
+from compression import init_compression
+from ratelimit import init_rate_limiting
+from budget import SheddingQueuePool, init_budgets
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 # Initialize extensions
@@ -15,22 +19,43 @@ db = SQLAlchemy()
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(app.config['SQLALCHEMY_ENGINE_OPTIONS'], poolclass=SheddingQueuePool)
+    configure_logging(app)
+    if app.config['TRUSTED_PROXIES']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
     
     # Initialize extensions
     db.init_app(app)
     CORS(app)
+    init_compression(app)
+    init_rate_limiting(app)
+    init_budgets(app)
     
     # Import and register blueprints
     from routes import main as main_blueprint
+    from profiling import init_profiling
+    init_profiling(app)
+    from slowlog import init_slowlog
+    init_slowlog(app)
     app.register_blueprint(main_blueprint)
     
-    # Create database tables within application context
-    with app.app_context():
-        try:
-            db.create_all()
-            logger.info("Database tables created successfully")
-        except Exception as e:
-            logger.error(f"Error creating database tables: {str(e)}")
+    # One LISTEN connection per worker feeds every event stream
+    from events import broker
+    broker.init_app(app)
+    
+    # Audit entries are written behind the request by a background thread
+    from audit import audit_writer
+    audit_writer.init_app(app)
+    
+    # Pool timeouts are PoolExhausted, which routes let through (see
+    # budget.Overloaded), so an overloaded worker sheds the request quickly
+    # instead of reporting a generic failure
+    @app.errorhandler(PoolTimeout)
+    def handle_pool_timeout(e):
+        logger.warning("Database pool exhausted: %s", e)
+        response = jsonify({'message': 'Server is busy, please retry shortly'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
     
     return app
 
@@ -0,0 +1,206 @@
+# audit.py
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import g, has_request_context
+from sqlalchemy import event, insert
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm import Session
+
+import metrics
+from app import db
+from models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+metrics.describe('audit_entries_written_total', 'Audit entries flushed to audit_log')
+metrics.describe('audit_entries_dropped_total', 'Audit entries lost to a full buffer or a failing database')
+
+# Session.info key for entries waiting on their transaction
+PENDING = 'audit_pending'
+
+
+def diff(before, after):
+    """{field: [old, new]} of the fields whose value changed"""
+    before, after = before or {}, after or {}
+    return {
+        field: [before.get(field), after.get(field)]
+        for field in sorted(set(before) | set(after))
+        if before.get(field) != after.get(field)
+    }
+
+
+def inventory_state(item):
+    """Audited fields of an inventory batch"""
+    return {
+        'nama_item': item.nama_item,
+        'kategori': item.kategori,
+        'stok_tersedia': item.stok_tersedia,
+        'stok_minimum': item.stok_minimum,
+        'harga': item.harga
+    }
+
+
+def transaction_state(total_amount, details):
+    """Audited fields of a sale; `details` are TransaksiDetail rows or dicts"""
+    items = []
+    for detail in details:
+        get = detail.get if isinstance(detail, dict) else lambda field: getattr(detail, field)
+        items.append({
+            'sku': get('sku'),
+            'batch_number': get('batch_number'),
+            'jumlah': get('jumlah'),
+            'harga_satuan': get('harga_satuan')
+        })
+    return {'total_amount': total_amount, 'items': items}
+
+
+def record(entity, action, key, before=None, after=None, id_cabang=None):
+    """Stage an audit entry on the current transaction.
+
+    It is only queued for writing once the session commits; a rollback (or
+    a replay by retry_transaction) discards it.
+    """
+    changes = diff(before, after)
+    if action == 'updated' and not changes:
+        return
+    entry = {
+        'waktu': datetime.now(timezone.utc),
+        'user_id': getattr(g, 'user_id', None) if has_request_context() else None,
+        'id_cabang': id_cabang,
+        'entity': entity,
+        'action': action,
+        'entity_key': key,
+        'perubahan': changes,
+        'request_id': getattr(g, 'request_id', None) if has_request_context() else None
+    }
+    db.session.info.setdefault(PENDING, []).append(entry)
+
+
+class AuditWriter:
+    """Write-behind buffer between request threads and the audit_log table.
+
+    Committed entries go on a bounded in-process queue; one background
+    thread per worker drains it and inserts them in batches, so a mutation
+    only pays for a queue put. Whatever is buffered is flushed at exit.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._queue = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def init_app(self, app):
+        self.app = app
+        self._queue = queue.Queue(maxsize=app.config['AUDIT_BUFFER_SIZE'])
+        atexit.register(self.stop)
+
+    def enqueue(self, entries):
+        self._ensure_thread()
+        timeout = self.app.config['AUDIT_ENQUEUE_TIMEOUT_MS'] / 1000
+        for entry in entries:
+            try:
+                # A short wait lets the writer catch up on a burst; beyond
+                # that the request must not be held up
+                self._queue.put(entry, timeout=timeout)
+            except queue.Full:
+                metrics.increment('audit_entries_dropped_total', reason='buffer_full')
+                logger.error("Audit buffer full, dropping %s %s entry", entry['entity'], entry['action'])
+
+    def stop(self, timeout=10):
+        """Flush what is buffered and stop the writer; safe to call twice"""
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        # Entries queued after the writer exited, or if it never started
+        if self._queue is not None and not self._queue.empty():
+            self._flush(self._drain(self._queue.qsize()))
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if (self._thread is None or not self._thread.is_alive()) and not self._stopping.is_set():
+                    self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                    self._thread.start()
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        batch_size = self.app.config['AUDIT_BATCH_SIZE']
+        interval = self.app.config['AUDIT_FLUSH_INTERVAL_MS'] / 1000
+        while not self._stopping.is_set() or not self._queue.empty():
+            try:
+                first = self._queue.get(timeout=interval)
+            except queue.Empty:
+                continue
+            # Give a burst a moment to accumulate into one INSERT
+            deadline = time.monotonic() + interval
+            batch = [first]
+            while len(batch) < batch_size and time.monotonic() < deadline and not self._stopping.is_set():
+                batch.extend(self._drain(batch_size - len(batch)))
+                if len(batch) < batch_size:
+                    time.sleep(min(0.01, interval))
+            self._flush(batch)
+
+    def _flush(self, batch, attempts=3):
+        if not batch or self._insert(batch, attempts):
+            return
+        if len(batch) > 1:
+            # One bad entry must not take the other users' entries with it
+            logger.warning("Writing %d audit entries one at a time", len(batch))
+            for entry in batch:
+                self._insert([entry], 1)
+
+    def _insert(self, rows, attempts):
+        """Insert the rows in one statement; whether that succeeded.
+
+        A single row that cannot be written is counted as dropped.
+        """
+        for attempt in range(1, attempts + 1):
+            try:
+                with self.app.app_context():
+                    with db.engine.begin() as conn:
+                        conn.execute(insert(AuditLog.__table__), rows)
+                metrics.increment('audit_entries_written_total', len(rows))
+                return True
+            except (DataError, IntegrityError) as e:
+                # Rejected rows fail the same way again
+                logger.error("Audit insert of %d entries rejected: %s", len(rows), e)
+                break
+            except Exception as e:
+                logger.error("Audit insert of %d entries failed (attempt %d): %s", len(rows), attempt, e)
+                if attempt < attempts:
+                    time.sleep(0.5 * attempt)
+        if len(rows) == 1:
+            metrics.increment('audit_entries_dropped_total', reason='write_failed')
+        return False
+
+
+audit_writer = AuditWriter()
+
+
+@event.listens_for(Session, 'after_commit')
+def _queue_committed(session):
+    entries = session.info.pop(PENDING, None)
+    if entries and audit_writer.app is not None:
+        audit_writer.enqueue(entries)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_rolled_back(session):
+    session.info.pop(PENDING, None)
@@ -0,0 +1,166 @@
+# budget.py
+"""Per-request latency budgets.
+
+Every request has a budget in milliseconds: the route's @latency_budget,
+else the one of its rate-limit class (LATENCY_BUDGETS_MS). Each database
+transaction the request begins gets what is left of it as statement_timeout,
+and lock_timeout is capped by it, so Postgres cancels a runaway query and
+the worker and connection are freed instead of waiting for the proxy to
+give up.
+
+A statement cancelled this way surfaces as BudgetExceeded and the request
+is answered with a 504. It and PoolExhausted share the base Overloaded:
+routes let it through their own error handling with `except Overloaded:
+raise` and the app's error handlers answer it.
+
+The timeouts are set once per transaction, so a transaction of many
+statements can still run past the budget; those requests are counted as
+overruns.
+"""
+import logging
+import time
+
+from flask import current_app, g, has_request_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+
+import metrics
+from ratelimit import request_rate_class
+
+logger = logging.getLogger(__name__)
+
+metrics.describe('latency_budget_exceeded_total', 'Requests whose statement was cancelled at the end of their latency budget')
+metrics.describe('latency_budget_overrun_total', 'Requests that finished after their latency budget without being cancelled')
+
+# SQLSTATEs of the timeouts a budget sets
+TIMEOUT_SQLSTATES = {
+    '57014': 'statement_timeout',
+    '55P03': 'lock_timeout',
+}
+
+
+class Overloaded(Exception):
+    """The request is shed; only the app's error handlers answer it"""
+
+
+class PoolExhausted(Overloaded, PoolTimeout):
+    """No database connection became free within pool_timeout"""
+
+
+class SheddingQueuePool(QueuePool):
+    """QueuePool whose checkout timeout is a PoolExhausted"""
+
+    def _do_get(self):
+        try:
+            return super()._do_get()
+        except PoolExhausted:
+            raise
+        except PoolTimeout as e:
+            raise PoolExhausted(str(e)) from e
+
+
+class BudgetExceeded(Overloaded):
+    """A statement was cancelled because its request ran out of time"""
+
+    def __init__(self, reason):
+        super().__init__(f'Latency budget exceeded ({reason})')
+        self.reason = reason
+
+
+def latency_budget(ms):
+    """Set the latency budget of a route in milliseconds.
+
+    None exempts the route; a function returning either is evaluated per
+    request. Routes without it get the budget of their rate-limit class.
+    """
+    def decorator(f):
+        f.latency_budget = ms
+        return f
+    return decorator
+
+
+def _route_budget():
+    view = current_app.view_functions.get(request.endpoint)
+    if view is None:
+        return None
+    if hasattr(view, 'latency_budget'):
+        ms = view.latency_budget
+        return ms() if callable(ms) else ms
+    budgets = current_app.config['LATENCY_BUDGETS_MS']
+    default = 'read' if request.method in ('GET', 'HEAD') else 'write'
+    return budgets.get(request_rate_class(), budgets[default])
+
+
+def remaining_ms():
+    """Milliseconds left of the current request's budget, None without one"""
+    if not has_request_context():
+        return None
+    deadline = g.get('budget_deadline')
+    if deadline is None:
+        return None
+    return (deadline - time.monotonic()) * 1000
+
+
+@event.listens_for(Engine, 'begin')
+def _set_timeouts(conn):
+    remaining = remaining_ms()
+    if remaining is None:
+        return
+    # 0 would switch the timeouts off; 1ms cancels the first statement
+    statement_timeout = max(int(remaining), 1)
+    lock_timeout = min(statement_timeout, current_app.config['DB_LOCK_TIMEOUT_MS'])
+    # Straight on the DBAPI connection, which opens the transaction the
+    # settings are local to
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute("SELECT set_config('statement_timeout', %s, true), set_config('lock_timeout', %s, true)",
+                       (str(statement_timeout), str(lock_timeout)))
+    finally:
+        cursor.close()
+
+
+@event.listens_for(Engine, 'handle_error')
+def _budget_error(exception_context):
+    remaining = remaining_ms()
+    if remaining is None or not isinstance(exception_context.sqlalchemy_exception, DBAPIError):
+        return None
+    reason = TIMEOUT_SQLSTATES.get(getattr(exception_context.original_exception, 'pgcode', None))
+    # A lock wait cut short by the budget rather than by DB_LOCK_TIMEOUT_MS;
+    # an ordinary lock timeout stays a retryable conflict
+    if reason == 'lock_timeout' and remaining >= 1:
+        return None
+    if reason:
+        # Returned rather than raised so the other handle_error listeners run
+        return BudgetExceeded(reason)
+    return None
+
+
+def init_budgets(app):
+    @app.before_request
+    def start_budget():
+        if not app.config['LATENCY_BUDGET_ENABLED']:
+            return
+        budget = _route_budget()
+        if budget:
+            g.budget_ms = budget
+            g.budget_start = time.monotonic()
+            g.budget_deadline = g.budget_start + budget / 1000
+
+    @app.errorhandler(BudgetExceeded)
+    def handle_budget_exceeded(e):
+        g.budget_exceeded = True
+        metrics.increment('latency_budget_exceeded_total', endpoint=request.endpoint, reason=e.reason)
+        logger.warning("%s cancelled after its %dms budget (%s)", request.endpoint, g.get('budget_ms', 0), e.reason,
+                       extra={'budget_ms': g.get('budget_ms'), 'budget_reason': e.reason})
+        return jsonify({'message': 'Request took too long and was cancelled', 'code': 'latency_budget_exceeded'}), 504
+
+    @app.teardown_request
+    def record_overrun(exc):
+        start = g.get('budget_start')
+        if start is None or g.get('budget_exceeded'):
+            return
+        if (time.monotonic() - start) * 1000 > g.budget_ms:
+            metrics.increment('latency_budget_overrun_total', endpoint=request.endpoint)
@@ -0,0 +1,130 @@
+# compression.py
+import zlib
+
+from flask import current_app, request
+
+# Optional encoders, used only when the packages are installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/csv', 'text/plain', 'text/html'}
+
+
+def available_encodings():
+    """Encodings this process can produce, in server preference order"""
+    encodings = []
+    if brotli is not None:
+        encodings.append('br')
+    if zstandard is not None:
+        encodings.append('zstd')
+    encodings.append('gzip')
+    return encodings
+
+
+def compress(enabled=True, **levels):
+    """Tune response compression for one route.
+
+    Usage: @compress(gzip=4, br=5) or @compress(enabled=False). Levels not
+    given fall back to COMPRESS_LEVELS.
+    """
+    def decorator(f):
+        f.compression = {'enabled': enabled, 'levels': levels}
+        return f
+    return decorator
+
+
+class _Compressor:
+    """Incremental compressor that can flush after every chunk"""
+
+    def __init__(self, encoding, level):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=level)
+        elif encoding == 'zstd':
+            self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        else:
+            # wbits=31 produces a gzip container
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def chunk(self, data):
+        """Compress and flush so the client can decode this chunk right away"""
+        if self.encoding == 'br':
+            return self.compress(data) + self._compressor.flush()
+        if self.encoding == 'zstd':
+            return self.compress(data) + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return self.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def _stream(iterable, compressor):
+    try:
+        for data in iterable:
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            if data:
+                yield compressor.chunk(data)
+        yield compressor.finish()
+    finally:
+        if hasattr(iterable, 'close'):
+            iterable.close()
+
+
+def _route_settings():
+    view = current_app.view_functions.get(request.endpoint)
+    return getattr(view, 'compression', {'enabled': True, 'levels': {}})
+
+
+def compress_response(response):
+    """after_request hook: compress the body according to Accept-Encoding"""
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    settings = _route_settings()
+    if not settings['enabled']:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(available_encodings())
+    if encoding is None:
+        return response
+
+    level = settings['levels'].get(encoding, current_app.config['COMPRESS_LEVELS'][encoding])
+    compressor = _Compressor(encoding, level)
+
+    if response.is_streamed or response.direct_passthrough:
+        # Exports are streamed, so compress chunk by chunk instead of buffering
+        response.direct_passthrough = False
+        response.response = _stream(response.response, compressor)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(compressor.compress(data) + compressor.finish())
+
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_compression(app):
+    app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+    app.config.setdefault('COMPRESS_LEVELS', {'gzip': 6, 'br': 5, 'zstd': 3})
+    app.after_request(compress_response)
@@ -1,5 +1,6 @@
 # backend/config.py
 import os
+import tempfile
 from datetime import timedelta
 from dotenv import load_dotenv
 
@@ -7,6 +8,9 @@ load_dotenv()
 
 def get_database_url():
     """Determine the correct database URL based on environment"""
+    if os.getenv('DATABASE_URL'):
+        return os.getenv('DATABASE_URL')
+    
     is_docker = os.environ.get('DOCKER_ENV', '').lower() == 'true'
     
     db_user = os.getenv('DB_USER', 'apotek_user')
@@ -18,16 +22,196 @@ def get_database_url():
     
     return f'postgresql://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}'
 
+def get_stream_cap():
+    """Event streams one worker serves at once (see gunicorn.conf.py).
+
+    Under gthread every open stream holds a thread, so streams may only
+    take two thirds of them and the rest keep serving the API.
+    """
+    if os.getenv('SSE_MAX_STREAMS_PER_WORKER'):
+        return int(os.getenv('SSE_MAX_STREAMS_PER_WORKER'))
+    if os.getenv('GUNICORN_WORKER_CLASS', 'gthread') == 'gevent':
+        # Leave room for API requests within worker_connections
+        return int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '200')) * 3 // 4
+    return int(os.getenv('GUNICORN_THREADS', '24')) * 2 // 3
+
+def get_pool_size():
+    """Size the per-worker pool so every API request thread can hold a connection"""
+    if os.getenv('DB_POOL_SIZE'):
+        return int(os.getenv('DB_POOL_SIZE'))
+    worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+    if worker_class == 'gevent':
+        # Greenlets are cheap but connections are not, cap them explicitly
+        return 10
+    # Threads held by event streams never touch the pool
+    return max(1, int(os.getenv('GUNICORN_THREADS', '24')) - get_stream_cap())
+
+def get_rate_limit(route_class, per_minute, burst):
+    """Token bucket of a route class from RATE_LIMIT_<CLASS>="<per minute>,<burst>"""
+    value = os.getenv(f'RATE_LIMIT_{route_class.upper()}')
+    if value:
+        per_minute, burst = value.split(',')
+    return {'per_second': float(per_minute) / 60, 'burst': int(burst)}
+
+def get_rate_limit_store():
+    """SQLite file shared by every worker on the host, on tmpfs when available"""
+    if os.getenv('RATE_LIMIT_STORE'):
+        return os.getenv('RATE_LIMIT_STORE')
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, 'apotek-ratelimit.sqlite')
+
 class Config:
     SQLALCHEMY_DATABASE_URI = get_database_url()
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # A FOR UPDATE that waits longer than lock_timeout is aborted and
+    # replayed by retry_transaction instead of holding a worker
+    DB_LOCK_TIMEOUT_MS = int(os.getenv('DB_LOCK_TIMEOUT_MS', '2000'))
+
+    # Each gunicorn worker has its own pool, so Postgres sees up to
+    # workers x (pool_size + max_overflow) connections in total
     SQLALCHEMY_ENGINE_OPTIONS = {
         "connect_args": {
-            "options": "-c search_path=public"
-        }
+            "options": f"-c search_path=public -c lock_timeout={DB_LOCK_TIMEOUT_MS}"
+        },
+        "pool_size": get_pool_size(),
+        "max_overflow": int(os.getenv('DB_MAX_OVERFLOW', '2')),
+        # Fail fast when the pool is exhausted, the app answers with a 503
+        "pool_timeout": float(os.getenv('DB_POOL_TIMEOUT', '3')),
+        "pool_pre_ping": True,
+        "pool_recycle": int(os.getenv('DB_POOL_RECYCLE', '1800'))
     }
 
     SECRET_KEY = os.getenv('SECRET_KEY', 'your-dev-secret-key-change-in-production')
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'your-jwt-secret-key-change-in-production')
-    JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
\ No newline at end of file
+    JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
+
+    # Server-Sent Events
+    SSE_HEARTBEAT_SECONDS = int(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+    SSE_MAX_STREAM_SECONDS = int(os.getenv('SSE_MAX_STREAM_SECONDS', '300'))
+    SSE_CLIENT_QUEUE_SIZE = int(os.getenv('SSE_CLIENT_QUEUE_SIZE', '256'))
+    # Streams beyond this per worker are refused with a 503
+    SSE_MAX_STREAMS_PER_WORKER = get_stream_cap()
+    # Lifetime of the URL token that opens a stream (POST /events/token)
+    SSE_TOKEN_SECONDS = int(os.getenv('SSE_TOKEN_SECONDS', '60'))
+
+    # Logging
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    # Per-logger overrides, e.g. "sqlalchemy.engine=INFO,routes=DEBUG"
+    LOG_LEVELS = os.getenv('LOG_LEVELS', 'sqlalchemy.engine=WARNING,werkzeug=WARNING')
+    LOG_SUCCESS_SAMPLE_RATE = float(os.getenv('LOG_SUCCESS_SAMPLE_RATE', '0.05'))
+    LOG_SLOW_REQUEST_MS = float(os.getenv('LOG_SLOW_REQUEST_MS', '1000'))
+
+    # Bearer secret of the Prometheus scraper; GET /metrics is off without it
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+    # Response compression (gzip, plus br/zstd when brotli/zstandard are installed)
+    COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+    COMPRESS_LEVELS = {'gzip': 6, 'br': 5, 'zstd': 3}
+
+    # Transaction partitioning and archival (see maintenance.py)
+    PARTITION_MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', '3'))
+    ARCHIVE_TABLESPACE = os.getenv('ARCHIVE_TABLESPACE')
+
+    # Stock ledger snapshots (see maintenance.py snapshot)
+    STOCK_SNAPSHOT_SETTLE_MINUTES = int(os.getenv('STOCK_SNAPSHOT_SETTLE_MINUTES', '10'))
+
+    # Replaying transactions aborted by deadlocks, serialization failures
+    # and lock timeouts (see retry.py)
+    DB_RETRY_MAX_ATTEMPTS = int(os.getenv('DB_RETRY_MAX_ATTEMPTS', '4'))
+    DB_RETRY_BASE_DELAY_MS = float(os.getenv('DB_RETRY_BASE_DELAY_MS', '20'))
+    DB_RETRY_MAX_DELAY_MS = float(os.getenv('DB_RETRY_MAX_DELAY_MS', '500'))
+
+    # Outlet used for writes by head-office users that do not name one;
+    # empty to require an explicit id_cabang
+    DEFAULT_BRANCH_ID = int(os.getenv('DEFAULT_BRANCH_ID', '1') or 0) or None
+
+    # Delta sync (GET /sync/changes); change log entries older than the
+    # retention are pruned by maintenance.py and their cursors expire
+    SYNC_PAGE_SIZE = int(os.getenv('SYNC_PAGE_SIZE', '500'))
+    SYNC_MAX_PAGE_SIZE = int(os.getenv('SYNC_MAX_PAGE_SIZE', '2000'))
+    CHANGE_LOG_RETENTION_DAYS = int(os.getenv('CHANGE_LOG_RETENTION_DAYS', '30'))
+
+    # Admission control (see ratelimit.py): token buckets per user (or
+    # client address before login) and route class, shared by all workers
+    RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    RATE_LIMIT_STORE = get_rate_limit_store()
+    RATE_LIMITS = {
+        'login': get_rate_limit('login', 10, 5),
+        'read': get_rate_limit('read', 600, 60),
+        'write': get_rate_limit('write', 120, 30),
+        # Full-history transaction fetches
+        'export': get_rate_limit('export', 6, 3)
+    }
+    # Host-wide cap on requests of a class in flight at once
+    RATE_LIMIT_CONCURRENCY = {
+        'export': int(os.getenv('RATE_LIMIT_EXPORT_CONCURRENCY', '2'))
+    }
+    RATE_LIMIT_LEASE_SECONDS = int(os.getenv('RATE_LIMIT_LEASE_SECONDS', '120'))
+    # Reverse proxies in front of the app (nginx); the client address is
+    # the X-Forwarded-For entry the outermost of them appended, earlier
+    # entries are whatever the client sent. 0 when clients connect directly.
+    TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', '1'))
+
+    # Latency budgets (see budget.py) per rate-limit class; a request's
+    # transactions get the time left as statement_timeout and it is
+    # answered with a 504 when a statement is cancelled
+    LATENCY_BUDGET_ENABLED = os.getenv('LATENCY_BUDGET_ENABLED', 'true').lower() == 'true'
+    LATENCY_BUDGETS_MS = {
+        'login': int(os.getenv('LATENCY_BUDGET_LOGIN_MS', '5000')),
+        'read': int(os.getenv('LATENCY_BUDGET_READ_MS', '5000')),
+        'write': int(os.getenv('LATENCY_BUDGET_WRITE_MS', '10000')),
+        # Below nginx's 60s proxy_read_timeout, so the app answers first
+        'export': int(os.getenv('LATENCY_BUDGET_EXPORT_MS', '55000'))
+    }
+
+    # Reorder point forecast (see forecast.py); z of 1.65 covers demand in
+    # about 95% of lead times
+    FORECAST_HISTORY_DAYS = int(os.getenv('FORECAST_HISTORY_DAYS', '28'))
+    FORECAST_LEAD_TIME_DAYS = float(os.getenv('FORECAST_LEAD_TIME_DAYS', '7'))
+    FORECAST_SERVICE_Z = float(os.getenv('FORECAST_SERVICE_Z', '1.65'))
+
+    # Cart stock holds (see reservations.py); each touch of a cart extends
+    # its holds by the TTL, maintenance.py sweep-reservations removes expired ones
+    RESERVATION_TTL_SECONDS = int(os.getenv('RESERVATION_TTL_SECONDS', '900'))
+
+    # Category facets (see facets.py); entries are dropped on inventory and
+    # sale events, the TTL only bounds staleness if an event is missed
+    FACETS_CACHE_SECONDS = int(os.getenv('FACETS_CACHE_SECONDS', '300'))
+
+    # Stock takes (see stock_take.py); counts are posted in requests of at
+    # most this many lines
+    STOCK_TAKE_MAX_ITEMS = int(os.getenv('STOCK_TAKE_MAX_ITEMS', '5000'))
+
+    # Analytics snapshot file (see analytics_export.py), refreshed by
+    # maintenance.py analytics-export or POST /admin/analytics-export. The
+    # source is a read replica if one is set, else the primary; a full copy
+    # holds back the primary's xmin for its whole run, so the API only
+    # starts one against a replica.
+    ANALYTICS_EXPORT_PATH = os.getenv('ANALYTICS_EXPORT_PATH', os.path.join(tempfile.gettempdir(), 'apotek-analytics.sqlite'))
+    ANALYTICS_DATABASE_URL = os.getenv('ANALYTICS_DATABASE_URL')
+
+    # Write-behind audit trail (see audit.py): entries are buffered per
+    # worker and inserted in batches; a full buffer drops entries rather
+    # than stalling requests
+    AUDIT_BUFFER_SIZE = int(os.getenv('AUDIT_BUFFER_SIZE', '10000'))
+    AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', '500'))
+    AUDIT_FLUSH_INTERVAL_MS = float(os.getenv('AUDIT_FLUSH_INTERVAL_MS', '200'))
+    AUDIT_ENQUEUE_TIMEOUT_MS = float(os.getenv('AUDIT_ENQUEUE_TIMEOUT_MS', '5'))
+
+    # On-demand request profiling (see profiling.py)
+    PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'apotek-profiles'))
+    # Share of all requests profiled without being asked, 0 to disable
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+    PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+    PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '200'))
+
+    # Statement statistics and slow query capture (see slowlog.py)
+    SLOW_QUERY_ENABLED = os.getenv('SLOW_QUERY_ENABLED', 'true').lower() == 'true'
+    SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+    # A slow fingerprint gets a fresh EXPLAIN at most once per window
+    SLOW_QUERY_EXPLAIN_WINDOW_MINUTES = int(os.getenv('SLOW_QUERY_EXPLAIN_WINDOW_MINUTES', '60'))
+    SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.getenv('SLOW_QUERY_EXPLAIN_TIMEOUT_MS', '5000'))
+    SLOW_QUERY_FLUSH_SECONDS = float(os.getenv('SLOW_QUERY_FLUSH_SECONDS', '10'))
+    SLOW_QUERY_BUFFER_SIZE = int(os.getenv('SLOW_QUERY_BUFFER_SIZE', '1000'))
+    SLOW_QUERY_LOG_RETENTION_DAYS = int(os.getenv('SLOW_QUERY_LOG_RETENTION_DAYS', '14'))
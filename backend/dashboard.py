@@ -0,0 +1,96 @@
+# dashboard.py
+from datetime import datetime
+
+from sqlalchemy import func, text
+
+from app import db
+from models import Inventory, PenjualanHarian, Produk, WIB
+from singleflight import SingleFlight
+from utils import low_stock_query, month_bounds, reorder_query, reorder_to_dict
+
+summary_flight = SingleFlight()
+
+
+def _months_back(year, month, count):
+    """(year, month) pairs of the last `count` months, oldest first"""
+    months = []
+    for _ in range(count):
+        months.append((year, month))
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+    return months[::-1]
+
+
+def build_summary(months, branch=None):
+    """All dashboard aggregates of one outlet (None: every outlet), read
+    from one REPEATABLE READ snapshot.
+
+    Sales figures come from the per-outlet daily aggregate, never from
+    transaksi itself.
+    """
+    now = datetime.now(WIB)
+    series_months = _months_back(now.year, now.month, months)
+    series_start = month_bounds(*series_months[0])[0].date()
+
+    # Must be the first statement of the transaction to take effect
+    db.session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+    db.session.execute(text('SET TRANSACTION READ ONLY'))
+    try:
+        daily = PenjualanHarian.query
+        stock = db.session.query(
+            Produk.kategori,
+            func.count(func.distinct(Inventory.sku)).label('sku_count'),
+            func.sum(Inventory.stok_tersedia).label('total_stock')
+        ).select_from(Inventory).join(Inventory.produk)
+        if branch:
+            daily = daily.filter(PenjualanHarian.id_cabang == branch)
+            stock = stock.filter(Inventory.id_cabang == branch)
+
+        sales_month = func.date_trunc('month', PenjualanHarian.tanggal)
+        sales_rows = daily.with_entities(
+            sales_month.label('month'),
+            func.sum(PenjualanHarian.total_amount).label('total_sales')
+        ).filter(
+            PenjualanHarian.tanggal >= series_start
+        ).group_by(sales_month).all()
+
+        low_stock = low_stock_query(branch).all()
+        reorder = reorder_query(branch).all()
+
+        categories = stock.group_by(
+            Produk.kategori
+        ).order_by(
+            Produk.kategori
+        ).all()
+
+        transactions_today = daily.with_entities(
+            func.sum(PenjualanHarian.jumlah_transaksi)
+        ).filter(
+            PenjualanHarian.tanggal == now.date()
+        ).scalar() or 0
+    finally:
+        db.session.rollback()
+
+    sales = {(row.month.year, row.month.month): row.total_sales for row in sales_rows}
+    return {
+        'generated_at': now.isoformat(),
+        'id_cabang': branch,
+        'sales': [{
+            'year': year,
+            'month': month,
+            'total_sales': sales.get((year, month), 0)
+        } for year, month in series_months],
+        'low_stock': [{
+            'id_cabang': item.id_cabang,
+            'sku': item.sku,
+            'nama_item': item.nama_item,
+            'stok_tersedia': item.total_stock,
+            'stok_minimum': item.stok_minimum
+        } for item in low_stock],
+        'reorder': [reorder_to_dict(row) for row in reorder],
+        'categories': [{
+            'kategori': row.kategori,
+            'sku_count': row.sku_count,
+            'total_stock': row.total_stock or 0
+        } for row in categories],
+        'transactions_today': transactions_today
+    }
@@ -0,0 +1,240 @@
+# events.py
+import json
+import logging
+import queue
+import select
+import threading
+import time
+
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from sqlalchemy import and_, func, text
+
+import metrics
+from app import db
+from models import Inventory, Produk
+
+logger = logging.getLogger(__name__)
+
+# Postgres channel shared by every worker
+CHANNEL = 'apotek_events'
+
+# NOTIFY payloads are capped at 8000 bytes, keep a safety margin
+MAX_ITEMS_PER_NOTIFY = 50
+
+metrics.describe('sse_streams_refused_total', 'Event streams refused because the worker was at its stream cap')
+
+
+def publish(kind, data):
+    """Queue an event on the current transaction.
+
+    Postgres only delivers NOTIFY messages once the surrounding transaction
+    commits, so listeners never see changes that were rolled back.
+    """
+    payload = json.dumps({'kind': kind, 'data': data}, default=str)
+    db.session.execute(
+        text('SELECT pg_notify(:channel, :payload)'),
+        {'channel': CHANNEL, 'payload': payload}
+    )
+
+
+def track_stock_change(changes, inventory, delta):
+    """Accumulate the net stock change of one batch within a unit of work"""
+    key = (inventory.id_cabang, inventory.sku, inventory.batch_number)
+    previous_delta = changes.get(key, (None, 0))[1]
+    changes[key] = (inventory.stok_tersedia, previous_delta + delta)
+
+
+def publish_stock_changes(changes):
+    """Publish stock levels and low-stock crossings for the changed batches"""
+    if not changes:
+        return
+
+    items = [{
+        'id_cabang': id_cabang,
+        'sku': sku,
+        'batch_number': batch_number,
+        'stok_tersedia': stok_tersedia,
+        'delta': delta
+    } for (id_cabang, sku, batch_number), (stok_tersedia, delta) in changes.items()]
+
+    # One outlet per unit of work, so each event can be routed by id_cabang
+    id_cabang = items[0]['id_cabang']
+    for start in range(0, len(items), MAX_ITEMS_PER_NOTIFY):
+        publish('stock', {'id_cabang': id_cabang, 'items': items[start:start + MAX_ITEMS_PER_NOTIFY]})
+
+    # Compare per-SKU totals of the outlet before and after the change to
+    # detect crossings
+    sku_deltas = {}
+    for (_, sku, _), (_, delta) in changes.items():
+        sku_deltas[sku] = sku_deltas.get(sku, 0) + delta
+
+    totals = db.session.query(
+        Produk.sku,
+        Produk.nama_item,
+        Produk.stok_minimum,
+        func.sum(Inventory.stok_tersedia).label('total_stock')
+    ).join(
+        Inventory, and_(Inventory.id_cabang == Produk.id_cabang, Inventory.sku == Produk.sku)
+    ).filter(
+        Produk.id_cabang == id_cabang,
+        Produk.sku.in_(list(sku_deltas))
+    ).group_by(
+        Produk.id_cabang,
+        Produk.sku
+    ).all()
+
+    for row in totals:
+        after = row.total_stock or 0
+        before = after - sku_deltas[row.sku]
+        if before >= row.stok_minimum > after:
+            status = 'low'
+        elif after >= row.stok_minimum > before:
+            status = 'recovered'
+        else:
+            continue
+        publish('low_stock', {
+            'id_cabang': id_cabang,
+            'sku': row.sku,
+            'nama_item': row.nama_item,
+            'stok_tersedia': after,
+            'stok_minimum': row.stok_minimum,
+            'status': status
+        })
+
+
+class StreamLimitReached(Exception):
+    """The worker serves as many event streams as it may"""
+
+
+class EventBroker:
+    """Fans out Postgres notifications to the SSE streams of one worker.
+
+    A single background thread holds the only LISTEN connection of the
+    process; it is started lazily when the first client subscribes or the
+    first in-process listener (e.g. a cache) registers.
+    """
+
+    def __init__(self):
+        self.app = None
+        self._subscribers = set()
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+
+    def subscribe(self):
+        """Queue of events for one stream; raises StreamLimitReached when
+        the worker already serves SSE_MAX_STREAMS_PER_WORKER streams"""
+        subscriber = queue.Queue(maxsize=self.app.config['SSE_CLIENT_QUEUE_SIZE'])
+        with self._lock:
+            if len(self._subscribers) >= self.app.config['SSE_MAX_STREAMS_PER_WORKER']:
+                metrics.increment('sse_streams_refused_total')
+                raise StreamLimitReached()
+            self._subscribers.add(subscriber)
+            self._ensure_thread()
+        return subscriber
+
+    def add_listener(self, callback):
+        """Call callback(message) on the listener thread for every event,
+        including 'resync' after a reconnect; it must not block"""
+        with self._lock:
+            self._listeners.append(callback)
+            self._ensure_thread()
+
+    def _ensure_thread(self):
+        # Called with self._lock held
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._listen_forever,
+                name='event-listener',
+                daemon=True
+            )
+            self._thread.start()
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def _dispatch(self, message):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            listeners = list(self._listeners)
+        for callback in listeners:
+            try:
+                callback(message)
+            except Exception as e:
+                logger.error("Event listener callback failed: %s", e)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # A client that cannot keep up is disconnected; EventSource
+                # reconnects and the client resyncs from the REST endpoints
+                self.unsubscribe(subscriber)
+                try:
+                    subscriber.get_nowait()
+                    subscriber.put_nowait(None)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def _connect(self):
+        with self.app.app_context():
+            raw = db.engine.raw_connection()
+        # The listener lives for the whole process, keep it out of the pool;
+        # detaching clears the proxy's reference, take the connection first
+        conn = raw.driver_connection
+        raw.detach()
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN {CHANNEL}')
+        return conn
+
+    def _listen_forever(self):
+        backoff = 1
+        reconnecting = False
+        while True:
+            conn = None
+            try:
+                conn = self._connect()
+                logger.info("Event listener connected")
+                if reconnecting:
+                    # Anything published while we were disconnected is lost
+                    self._dispatch({'kind': 'resync', 'data': {}})
+                reconnecting = True
+                backoff = 1
+                while True:
+                    if select.select([conn], [], [], 30) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        try:
+                            self._dispatch(json.loads(notify.payload))
+                        except ValueError:
+                            logger.warning("Ignoring malformed event payload")
+            except Exception as e:
+                logger.error("Event listener error: %s", e)
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+
+broker = EventBroker()
+
+
+def visible_to(message, branch):
+    """Whether a stream scoped to `branch` (None: all outlets) gets message"""
+    if branch is None:
+        return True
+    return message['data'].get('id_cabang', branch) == branch
+
+
+def format_sse(message):
+    """Serialize a broker message as a Server-Sent Events frame"""
+    return f"event: {message['kind']}\ndata: {json.dumps(message['data'], default=str)}\n\n"
@@ -0,0 +1,106 @@
+# facets.py
+"""Category facets of the inventory, cached per outlet.
+
+Filter UIs need the category list with counts, not the catalog itself.
+The counts come from one grouped query and are cached per outlet scope
+in each worker. Every inventory write and sale publishes an event (see
+events.py), and the broker hands those to this cache, so an outlet's
+entry and the all-outlets entry are dropped as soon as any worker
+commits a change; FACETS_CACHE_SECONDS only bounds how long a missed
+event could leave an entry stale.
+"""
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import func
+
+import metrics
+from app import db
+from events import broker
+from models import Inventory, Produk, WIB
+from singleflight import SingleFlight
+
+metrics.describe('inventory_facets_cache_total', 'Category facet lookups by cache result')
+
+# Events after which the stock totals or categories may have changed
+INVALIDATING_EVENTS = ('inventory', 'stock', 'sale')
+
+
+def build_facets(branch=None):
+    """Categories with batch counts, SKU counts and stock totals"""
+    query = db.session.query(
+        Produk.kategori,
+        func.count().label('batch_count'),
+        func.count(func.distinct(Inventory.sku)).label('sku_count'),
+        func.sum(Inventory.stok_tersedia).label('total_stock')
+    ).select_from(Inventory).join(Inventory.produk)
+    if branch:
+        query = query.filter(Inventory.id_cabang == branch)
+    rows = query.group_by(Produk.kategori).order_by(Produk.kategori).all()
+    return {
+        'generated_at': datetime.now(WIB).isoformat(),
+        'id_cabang': branch,
+        'categories': [{
+            'kategori': row.kategori,
+            'batch_count': row.batch_count,
+            'sku_count': row.sku_count,
+            'total_stock': int(row.total_stock or 0)
+        } for row in rows]
+    }
+
+
+class FacetCache:
+    """Per-worker cache of build_facets results keyed by outlet scope"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._generation = 0
+        self._flight = SingleFlight()
+        self._listening = False
+
+    def get(self, branch, ttl, build=build_facets):
+        """Return (facets, hit)"""
+        self._listen()
+        with self._lock:
+            entry = self._entries.get(branch)
+            generation = self._generation
+        if entry is not None and entry[0] > time.monotonic():
+            metrics.increment('inventory_facets_cache_total', result='hit')
+            return entry[1], True
+        metrics.increment('inventory_facets_cache_total', result='miss')
+
+        facets, _ = self._flight.do(branch, lambda: build(branch))
+        with self._lock:
+            # An invalidation while building means the result may be stale
+            if self._generation == generation:
+                self._entries[branch] = (time.monotonic() + ttl, facets)
+        return facets, False
+
+    def invalidate(self, branch=None):
+        """Drop an outlet's entry and the all-outlets one; None drops all"""
+        with self._lock:
+            self._generation += 1
+            if branch is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(branch, None)
+                self._entries.pop(None, None)
+
+    def on_event(self, message):
+        if message['kind'] == 'resync':
+            # Events were lost while the listener reconnected
+            self.invalidate()
+        elif message['kind'] in INVALIDATING_EVENTS:
+            self.invalidate(message['data'].get('id_cabang'))
+
+    def _listen(self):
+        if not self._listening:
+            with self._lock:
+                if not self._listening:
+                    broker.add_listener(self.on_event)
+                    self._listening = True
+
+
+facet_cache = FacetCache()
@@ -0,0 +1,138 @@
+# forecast.py
+"""Reorder points from recent sales, computed for every SKU at once.
+
+Daily sales per outlet and SKU are read in one COPY into a dense
+(SKU x day) NumPy matrix; averages, deviations and reorder points are then
+column-wise array operations, so the cost barely depends on catalog size.
+"""
+import io
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def reorder_points(demand, lead_time_days, service_z):
+    """Reorder point per row of a (SKU x day) demand matrix, oldest day first.
+
+    Returns a dict of arrays: rata_harian_7, rata_harian, deviasi_harian,
+    permintaan_lead_time, stok_pengaman and titik_pemesanan.
+    """
+    days = demand.shape[1]
+    average = demand.mean(axis=1)
+    recent = demand[:, -min(7, days):].mean(axis=1)
+    deviation = demand.std(axis=1, ddof=1) if days > 1 else np.zeros(len(demand))
+
+    # A rising trend is only trusted upwards: last week's rate can raise
+    # the expected demand but never lower it below the window average
+    daily = np.maximum(average, recent)
+    lead_time_demand = daily * lead_time_days
+    safety_stock = service_z * deviation * np.sqrt(lead_time_days)
+
+    return {
+        'rata_harian_7': recent,
+        'rata_harian': average,
+        'deviasi_harian': deviation,
+        'permintaan_lead_time': lead_time_demand,
+        'stok_pengaman': safety_stock,
+        'titik_pemesanan': np.ceil(lead_time_demand + safety_stock).astype(np.int64)
+    }
+
+
+def load_demand(cursor, days):
+    """(SKU x day) units sold per outlet SKU over the last `days` full WIB days.
+
+    Rows of `demand` follow the idx column of the forecast_keys temp table,
+    which the caller joins back to (id_cabang, sku) when writing results.
+    """
+    cursor.execute("""
+        CREATE TEMP TABLE forecast_keys ON COMMIT DROP AS
+        SELECT (row_number() OVER (ORDER BY id_cabang, sku) - 1)::int AS idx,
+               id_cabang, sku, sum(stok_tersedia)::int AS stok
+        FROM inventory
+        GROUP BY id_cabang, sku
+    """)
+    cursor.execute('CREATE UNIQUE INDEX ON forecast_keys (id_cabang, sku)')
+    cursor.execute('SELECT count(*) FROM forecast_keys')
+    count = cursor.fetchone()[0]
+
+    demand = np.zeros((count, days))
+    if count == 0:
+        return demand
+
+    # Day 0 is the oldest day; the current, partial WIB day is left out.
+    # The range on waktu_transaksi keeps the scan to the recent partitions.
+    buffer = io.StringIO()
+    cursor.copy_expert(f"""
+        COPY (
+            WITH bounds AS (
+                SELECT (now() AT TIME ZONE 'Asia/Jakarta')::date AS today
+            )
+            SELECT k.idx,
+                   {int(days)} - (b.today - (d.waktu_transaksi AT TIME ZONE 'Asia/Jakarta')::date) AS day,
+                   sum(d.jumlah)
+            FROM bounds b
+            JOIN transaksi_detail d
+              ON d.waktu_transaksi >= (b.today - {int(days)})::timestamp AT TIME ZONE 'Asia/Jakarta'
+             AND d.waktu_transaksi < b.today::timestamp AT TIME ZONE 'Asia/Jakarta'
+            JOIN inventory i ON i.id_batch = d.id_batch
+            JOIN forecast_keys k ON k.id_cabang = i.id_cabang AND k.sku = i.sku
+            GROUP BY 1, 2
+        ) TO STDOUT WITH CSV
+    """, buffer)
+    if buffer.tell():
+        rows = np.loadtxt(io.StringIO(buffer.getvalue()), delimiter=',', ndmin=2)
+        demand[rows[:, 0].astype(np.int64), rows[:, 1].astype(np.int64)] = rows[:, 2]
+    return demand
+
+
+def refresh_suggestions(conn, days, lead_time_days, service_z):
+    """Recompute saran_pemesanan for every outlet and SKU in one transaction"""
+    with conn.cursor() as cursor:
+        # Explicit transaction: the temp tables live until COMMIT
+        cursor.execute('BEGIN')
+        try:
+            written = _refresh(cursor, days, lead_time_days, service_z)
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+    logger.info("Reorder suggestions computed for %d SKU(s)", written)
+    return written
+
+
+def _refresh(cursor, days, lead_time_days, service_z):
+    """Forecast into temp tables, then swap the results in with one INSERT"""
+    demand = load_demand(cursor, days)
+    result = reorder_points(demand, lead_time_days, service_z)
+
+    columns = ['rata_harian_7', 'rata_harian', 'deviasi_harian',
+               'permintaan_lead_time', 'stok_pengaman', 'titik_pemesanan']
+    table = np.column_stack([np.arange(len(demand))] + [result[name] for name in columns])
+    buffer = io.StringIO()
+    np.savetxt(buffer, table, delimiter=',', fmt=['%d'] + ['%.4f'] * 5 + ['%d'])
+    buffer.seek(0)
+
+    cursor.execute("""
+        CREATE TEMP TABLE forecast_result (
+            idx INTEGER PRIMARY KEY,
+            rata_harian_7 DOUBLE PRECISION, rata_harian DOUBLE PRECISION,
+            deviasi_harian DOUBLE PRECISION, permintaan_lead_time DOUBLE PRECISION,
+            stok_pengaman DOUBLE PRECISION, titik_pemesanan INTEGER
+        ) ON COMMIT DROP
+    """)
+    cursor.copy_expert('COPY forecast_result FROM STDIN WITH CSV', buffer)
+
+    cursor.execute('DELETE FROM saran_pemesanan')
+    cursor.execute("""
+        INSERT INTO saran_pemesanan (
+            id_cabang, sku, rata_harian_7, rata_harian, deviasi_harian,
+            permintaan_lead_time, stok_pengaman, titik_pemesanan, stok_tersedia
+        )
+        SELECT k.id_cabang, k.sku, r.rata_harian_7, r.rata_harian, r.deviasi_harian,
+               r.permintaan_lead_time, r.stok_pengaman, r.titik_pemesanan, k.stok
+        FROM forecast_result r
+        JOIN forecast_keys k USING (idx)
+    """)
+    return cursor.rowcount
@@ -0,0 +1,42 @@
+# gunicorn.conf.py
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# gthread (default) or gevent; both let a worker keep serving while other
+# requests wait on Postgres, scrypt or an open event stream.
+#
+# Sizing: under gthread each open event stream holds a thread for up to
+# SSE_MAX_STREAM_SECONDS. A worker serves at most SSE_MAX_STREAMS_PER_WORKER
+# streams (default two thirds of its threads) and refuses more with a 503,
+# so the remaining threads, each with a pooled connection, keep answering
+# the API. Dashboards served = workers x streams per worker: the defaults
+# give 3 x 16 = 48 streams beside 3 x 8 API threads. For more dashboards
+# raise GUNICORN_THREADS or switch to gevent, where a stream costs a
+# greenlet and the cap is three quarters of worker_connections.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('GUNICORN_WORKERS', '3'))
+threads = int(os.getenv('GUNICORN_THREADS', '24'))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '200'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+keepalive = 5
+
+# The app writes its own sampled, structured access log
+accesslog = None
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        # psycopg2 blocks the whole process unless it yields to the hub
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+
+def worker_exit(server, worker):
+    # Flush buffered audit entries and query stats before the worker goes away
+    from audit import audit_writer
+    from slowlog import query_stats
+    audit_writer.stop()
+    query_stats.stop()
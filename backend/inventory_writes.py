@@ -0,0 +1,181 @@
+# inventory_writes.py
+"""Inventory mutations as single statements.
+
+Each write is one data-modifying statement: the inventory change, its
+stock ledger movement and the values the response and audit trail need
+come back together from RETURNING, with no lookups before or after.
+Only delete_batch locks the product in a statement of its own first.
+"""
+from flask import g, has_request_context
+from sqlalchemy import text
+
+from app import db
+
+# Held once per outlet and SKU in produk, shared by its batches
+SKU_FIELDS = ('nama_item', 'kategori', 'stok_minimum', 'harga')
+BATCH_FIELDS = ('stok_tersedia',)
+
+_COLUMNS = 'id_cabang, sku, batch_number, stok_tersedia, waktu_pembaruan'
+_PRODUCT_COLUMNS = 'nama_item, kategori, stok_minimum, harga, waktu_pembaruan'
+
+
+def _user_id():
+    return getattr(g, 'user_id', None) if has_request_context() else None
+
+
+def previous_state(row):
+    """Audited fields of an update_batch row before the update"""
+    return {field: getattr(row, f'old_{field}') for field in SKU_FIELDS + BATCH_FIELDS}
+
+
+def insert_batch(branch, data):
+    """Insert a batch; None if it already exists.
+
+    The first batch of a SKU creates the outlet's product from `data`; a
+    new batch of a SKU the outlet already stocks takes over the product's
+    name, category, minimum and price.
+    """
+    return db.session.execute(text(f"""
+        WITH prod AS (
+            INSERT INTO produk ({_PRODUCT_COLUMNS}, id_cabang, sku)
+            VALUES (:nama_item, :kategori, :stok_minimum, :harga, CURRENT_TIMESTAMP, :id_cabang, :sku)
+            -- The no-op update locks and returns an existing product
+            ON CONFLICT (id_cabang, sku) DO UPDATE SET sku = produk.sku
+            RETURNING {_PRODUCT_COLUMNS}
+        ), ins AS (
+            INSERT INTO inventory ({_COLUMNS})
+            VALUES (:id_cabang, :sku, :batch_number, :stok_tersedia, CURRENT_TIMESTAMP)
+            ON CONFLICT (id_cabang, sku, batch_number) DO NOTHING
+            RETURNING {_COLUMNS}
+        ), movement AS (
+            INSERT INTO mutasi_stok (id_cabang, sku, batch_number, jumlah, stok_setelah, jenis, user_id)
+            SELECT id_cabang, sku, batch_number, stok_tersedia, stok_tersedia, 'receipt', :user_id
+            FROM ins
+        )
+        SELECT ins.id_cabang, ins.sku, ins.batch_number, ins.stok_tersedia,
+               prod.nama_item, prod.kategori, prod.stok_minimum, prod.harga,
+               GREATEST(ins.waktu_pembaruan, prod.waktu_pembaruan) AS last_updated
+        FROM ins, prod
+    """), {
+        'id_cabang': branch,
+        'sku': data['sku'],
+        'batch_number': data['batch_number'],
+        'nama_item': data['nama_item'],
+        'kategori': data.get('kategori'),
+        'stok_tersedia': data.get('stok_tersedia') or 0,
+        'stok_minimum': data.get('stok_minimum', 10),
+        'harga': data['harga'],
+        'user_id': _user_id()
+    }).first()
+
+
+def update_batch(branch, sku, batch_number, data):
+    """Apply SKU-wide and batch fields from `data`; None if the batch is missing.
+
+    SKU fields are written once, to the outlet's product, and batch fields
+    to this batch only. Returns the updated batch with its previous values
+    as old_<column>. An adjustment movement is recorded when stok_tersedia
+    changes.
+    """
+    sku_updates = [field for field in SKU_FIELDS if field in data]
+    batch_updates = [field for field in BATCH_FIELDS if field in data]
+
+    params = {field: data[field] for field in sku_updates + batch_updates}
+    params.update({'id_cabang': branch, 'sku': sku, 'batch_number': batch_number, 'user_id': _user_id()})
+
+    ctes = [f"""old AS (
+            SELECT i.id_cabang, i.sku, i.batch_number, i.stok_tersedia, i.waktu_pembaruan AS batch_updated,
+                   p.nama_item, p.kategori, p.stok_minimum, p.harga, p.waktu_pembaruan AS product_updated
+            FROM inventory i
+            JOIN produk p ON p.id_cabang = i.id_cabang AND p.sku = i.sku
+            WHERE i.id_cabang = :id_cabang AND i.sku = :sku AND i.batch_number = :batch_number
+            -- Stock adjustments leave the product, and other batches' sales, unlocked
+            FOR NO KEY UPDATE OF i{', p' if sku_updates else ''}
+        )"""]
+    product = 'old'
+    if sku_updates:
+        product = 'prod'
+        ctes.append(f"""prod AS (
+            UPDATE produk
+            SET {', '.join(f'{field} = :{field}' for field in sku_updates)}, waktu_pembaruan = CURRENT_TIMESTAMP
+            WHERE id_cabang = :id_cabang AND sku = :sku AND EXISTS (SELECT 1 FROM old)
+            RETURNING nama_item, kategori, stok_minimum, harga, waktu_pembaruan AS product_updated
+        )""")
+    batch = 'old'
+    if batch_updates:
+        batch = 'upd'
+        ctes.append(f"""upd AS (
+            UPDATE inventory
+            SET {', '.join(f'{field} = :{field}' for field in batch_updates)}, waktu_pembaruan = CURRENT_TIMESTAMP
+            WHERE id_cabang = :id_cabang AND sku = :sku AND batch_number = :batch_number AND EXISTS (SELECT 1 FROM old)
+            RETURNING stok_tersedia, waktu_pembaruan AS batch_updated
+        )""")
+        ctes.append("""movement AS (
+            INSERT INTO mutasi_stok (id_cabang, sku, batch_number, jumlah, stok_setelah, jenis, user_id)
+            SELECT old.id_cabang, old.sku, old.batch_number, upd.stok_tersedia - old.stok_tersedia, upd.stok_tersedia, 'adjustment', :user_id
+            FROM upd, old
+            WHERE upd.stok_tersedia <> old.stok_tersedia
+        )""")
+
+    old_columns = ', '.join(f'old.{column} AS old_{column}' for column in SKU_FIELDS + BATCH_FIELDS)
+    sources = ['old'] + (['prod'] if sku_updates else []) + (['upd'] if batch_updates else [])
+    return db.session.execute(text(f"""
+        WITH {', '.join(ctes)}
+        SELECT old.id_cabang, old.sku, old.batch_number, {batch}.stok_tersedia,
+               {', '.join(f'{product}.{field}' for field in SKU_FIELDS)},
+               GREATEST({batch}.batch_updated, {product}.product_updated) AS last_updated,
+               {old_columns}
+        FROM {', '.join(sources)}
+    """), params).first()
+
+
+def delete_batch(branch, sku, batch_number):
+    """Delete a batch that no sale refers to.
+
+    Returns (found, deleted_row): found is False for a missing batch, and
+    deleted_row is None when the batch exists but has sales.
+    """
+    params = {'id_cabang': branch, 'sku': sku, 'batch_number': batch_number, 'user_id': _user_id()}
+    # Deletes of the SKU's batches queue here. The delete below then takes
+    # its snapshot after any earlier one committed, so the last batch's
+    # NOT EXISTS check sees its sibling gone and the product goes too.
+    db.session.execute(text("""
+        SELECT 1 FROM produk WHERE id_cabang = :id_cabang AND sku = :sku FOR UPDATE
+    """), params)
+    row = db.session.execute(text(f"""
+        WITH del AS (
+            DELETE FROM inventory i
+            WHERE i.id_cabang = :id_cabang AND i.sku = :sku AND i.batch_number = :batch_number
+              AND NOT EXISTS (
+                  SELECT 1 FROM transaksi_detail d WHERE d.id_batch = i.id_batch
+              )
+            RETURNING {_COLUMNS}
+        ), prod AS (
+            -- The product goes with the outlet's last batch of it
+            DELETE FROM produk p
+            USING del
+            WHERE p.id_cabang = del.id_cabang AND p.sku = del.sku
+              AND NOT EXISTS (
+                  SELECT 1 FROM inventory o
+                  WHERE o.id_cabang = del.id_cabang AND o.sku = del.sku AND o.batch_number <> del.batch_number
+              )
+        ), movement AS (
+            -- The ledger keeps the batch history, closing it at zero
+            INSERT INTO mutasi_stok (id_cabang, sku, batch_number, jumlah, stok_setelah, jenis, user_id)
+            SELECT id_cabang, sku, batch_number, -stok_tersedia, 0, 'delete', :user_id
+            FROM del
+            WHERE stok_tersedia <> 0
+        )
+        SELECT found.found, del.id_cabang, del.sku, del.batch_number, del.stok_tersedia,
+               p.nama_item, p.kategori, p.stok_minimum, p.harga
+        FROM (
+            SELECT EXISTS (
+                SELECT 1 FROM inventory
+                WHERE id_cabang = :id_cabang AND sku = :sku AND batch_number = :batch_number
+            ) AS found
+        ) found
+        LEFT JOIN del ON TRUE
+        -- The statement's snapshot still sees a product deleted above
+        LEFT JOIN produk p ON p.id_cabang = del.id_cabang AND p.sku = del.sku
+    """), params).first()
+    return row.found, (row if row.sku is not None else None)
@@ -0,0 +1,86 @@
+# ledger.py
+from flask import g, has_request_context
+from sqlalchemy import func, select, union_all
+
+from app import db
+from models import MutasiStok, SnapshotStok
+
+
+def record_movement(inventory, delta, jenis, id_transaksi=None):
+    """Append a stock movement for a batch whose stok_tersedia was just changed.
+
+    Call it after adjusting the inventory row, in the same transaction.
+    """
+    movement = MutasiStok(
+        id_cabang=inventory.id_cabang,
+        sku=inventory.sku,
+        batch_number=inventory.batch_number,
+        jumlah=delta,
+        stok_setelah=inventory.stok_tersedia or 0,
+        jenis=jenis,
+        id_transaksi=id_transaksi,
+        user_id=getattr(g, 'user_id', None) if has_request_context() else None
+    )
+    db.session.add(movement)
+    return movement
+
+
+def latest_snapshot(at):
+    """Time of the newest snapshot taken at or before `at`, or None"""
+    return db.session.query(
+        func.max(SnapshotStok.waktu_snapshot)
+    ).filter(
+        SnapshotStok.waktu_snapshot <= at
+    ).scalar()
+
+
+def stock_at(at, sku=None, batch_number=None, branch=None):
+    """Stock per batch at `at`: the latest snapshot plus the movements after it"""
+    snapshot_time = latest_snapshot(at)
+
+    movements = select(
+        MutasiStok.id_cabang, MutasiStok.sku, MutasiStok.batch_number, MutasiStok.jumlah.label('stok')
+    ).where(MutasiStok.waktu <= at)
+    if snapshot_time is not None:
+        movements = movements.where(MutasiStok.waktu > snapshot_time)
+    if branch:
+        movements = movements.where(MutasiStok.id_cabang == branch)
+    if sku:
+        movements = movements.where(MutasiStok.sku == sku)
+    if batch_number:
+        movements = movements.where(MutasiStok.batch_number == batch_number)
+    parts = [movements]
+
+    if snapshot_time is not None:
+        snapshot = select(
+            SnapshotStok.id_cabang, SnapshotStok.sku, SnapshotStok.batch_number, SnapshotStok.stok
+        ).where(SnapshotStok.waktu_snapshot == snapshot_time)
+        if branch:
+            snapshot = snapshot.where(SnapshotStok.id_cabang == branch)
+        if sku:
+            snapshot = snapshot.where(SnapshotStok.sku == sku)
+        if batch_number:
+            snapshot = snapshot.where(SnapshotStok.batch_number == batch_number)
+        parts.append(snapshot)
+
+    balance = union_all(*parts).subquery()
+    return db.session.query(
+        balance.c.id_cabang,
+        balance.c.sku,
+        balance.c.batch_number,
+        func.sum(balance.c.stok).label('stok')
+    ).group_by(
+        balance.c.id_cabang, balance.c.sku, balance.c.batch_number
+    ).order_by(
+        balance.c.id_cabang, balance.c.sku, balance.c.batch_number
+    ).all()
+
+
+def movement_history(branch, sku, batch_number, start=None, end=None, limit=200):
+    """Movements of one batch within an optional [start, end) range, oldest first"""
+    query = MutasiStok.query.filter_by(id_cabang=branch, sku=sku, batch_number=batch_number)
+    if start:
+        query = query.filter(MutasiStok.waktu >= start)
+    if end:
+        query = query.filter(MutasiStok.waktu < end)
+    return query.order_by(MutasiStok.waktu, MutasiStok.id).limit(limit).all()
@@ -0,0 +1,126 @@
+# logging_config.py
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+from flask import g, has_request_context, request
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+_listener = None
+
+# A client's X-Request-ID is kept when it looks like an id and fits the
+# request_id columns (VARCHAR(64)); anything else gets a fresh one
+_REQUEST_ID = re.compile(r'[A-Za-z0-9._:-]{1,64}')
+
+
+class RequestContextFilter(logging.Filter):
+    """Attach the request id and user of the current request to each record.
+
+    Runs on the thread that logs, before the record is handed to the queue.
+    """
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = getattr(g, 'request_id', None)
+            record.user_id = getattr(g, 'user_id', None)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def parse_levels(spec):
+    """Parse 'sqlalchemy.engine=WARNING,routes=DEBUG' into a dict"""
+    levels = {}
+    for part in (spec or '').split(','):
+        if '=' in part:
+            name, level = part.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(app):
+    """Route all logging through a queue drained by a background thread.
+
+    Request threads only enqueue records; JSON encoding and the write to
+    stdout happen on the listener thread.
+    """
+    global _listener
+
+    if _listener is None:
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(RequestContextFilter())
+
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(JsonFormatter())
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+    logging.getLogger().setLevel(app.config['LOG_LEVEL'])
+    for name, level in parse_levels(app.config['LOG_LEVELS']).items():
+        logging.getLogger(name).setLevel(level)
+
+    access_logger = logging.getLogger('access')
+
+    @app.before_request
+    def start_request_timer():
+        request_id = request.headers.get('X-Request-ID', '')
+        g.request_id = request_id if _REQUEST_ID.fullmatch(request_id) else uuid.uuid4().hex
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def log_request(response):
+        if 'request_start' not in g:
+            return response
+        duration_ms = (time.perf_counter() - g.request_start) * 1000
+        response.headers['X-Request-ID'] = g.request_id
+
+        # Errors and slow requests are always logged, successes are sampled
+        if response.status_code >= 400 or duration_ms >= app.config['LOG_SLOW_REQUEST_MS']:
+            level = logging.ERROR if response.status_code >= 500 else logging.WARNING
+        elif random.random() < app.config['LOG_SUCCESS_SAMPLE_RATE']:
+            level = logging.INFO
+        else:
+            return response
+
+        access_logger.log(level, "%s %s %s", request.method, request.path, response.status_code, extra={
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'duration_ms': round(duration_ms, 2)
+        })
+        return response
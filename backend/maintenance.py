@@ -0,0 +1,258 @@
+# maintenance.py
+"""Database housekeeping commands, meant for deploys and cron.
+
+    python maintenance.py partitions                 # create upcoming monthly partitions
+    python maintenance.py --every 3600 partitions    # ... and keep topping them up (docker-compose maintenance service)
+    python maintenance.py archive --before 2024-01   # detach closed months into the archive schema
+    python maintenance.py snapshot                   # stock snapshot at the last WIB midnight (daily cron)
+    python maintenance.py prune-changes              # drop change log entries past the retention (daily cron)
+    python maintenance.py forecast                   # recompute reorder point suggestions (daily cron)
+    python maintenance.py prune-slow-queries         # drop slow query samples past the retention (daily cron)
+    python maintenance.py sweep-reservations         # delete expired cart stock holds (cron, every few minutes)
+    python maintenance.py analytics-export [--full]  # refresh the analytics snapshot file (nightly cron)
+"""
+import argparse
+import logging
+import re
+import sys
+import time
+from datetime import date, timedelta
+
+import psycopg2
+from psycopg2 import sql
+
+from analytics_export import export_snapshot
+from config import Config
+from forecast import refresh_suggestions
+
+logger = logging.getLogger('maintenance')
+
+PARTITION_NAME = re.compile(r'^transaksi_y(\d{4})m(\d{2})$')
+
+
+def connect():
+    conn = psycopg2.connect(Config.SQLALCHEMY_DATABASE_URI)
+    conn.autocommit = True
+    return conn
+
+
+def ensure_partitions(conn, months_ahead):
+    """Create the monthly transaksi/transaksi_detail partitions up to months_ahead"""
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT ensure_transaksi_partitions(%s)', (months_ahead,))
+        created = cursor.fetchone()[0]
+    logger.info("%d partition month(s) created", created)
+    return created
+
+
+def attached_months(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT child.relname
+            FROM pg_inherits i
+            JOIN pg_class child ON child.oid = i.inhrelid
+            JOIN pg_class parent ON parent.oid = i.inhparent
+            WHERE parent.relname = 'transaksi'
+            ORDER BY child.relname
+        """)
+        names = [row[0] for row in cursor.fetchall()]
+
+    months = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return months
+
+
+def current_month(conn):
+    """First day of the current WIB month, by the database clock"""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT date_trunc('month', now() AT TIME ZONE 'Asia/Jakarta')::date")
+        return cursor.fetchone()[0]
+
+
+def archive_month(conn, month, tablespace=None):
+    """Detach one closed month and move it to the archive schema.
+
+    DETACH ... CONCURRENTLY only takes a SHARE UPDATE EXCLUSIVE lock on the
+    parent, so checkouts keep running while a month is archived. It cannot
+    run inside a transaction block, hence the autocommit connection.
+    """
+    if month >= current_month(conn):
+        raise ValueError("Only closed months can be archived")
+    suffix = month.strftime('y%Ym%m')
+    detail = sql.Identifier(f'transaksi_detail_{suffix}')
+    header = sql.Identifier(f'transaksi_{suffix}')
+
+    statements = [
+        # Details first: the header partition cannot be detached while
+        # attached rows still reference it
+        sql.SQL('ALTER TABLE transaksi_detail DETACH PARTITION {} CONCURRENTLY').format(detail),
+        sql.SQL('ALTER TABLE {} DROP CONSTRAINT IF EXISTS fk_transaksi_detail_transaksi').format(detail),
+        sql.SQL('ALTER TABLE transaksi DETACH PARTITION {} CONCURRENTLY').format(header),
+        sql.SQL('ALTER TABLE {} SET SCHEMA archive').format(detail),
+        sql.SQL('ALTER TABLE {} SET SCHEMA archive').format(header),
+    ]
+    if tablespace:
+        # Detached tables are no longer read by the app, the rewrite is harmless
+        for table in (detail, header):
+            statements.append(sql.SQL('ALTER TABLE archive.{} SET TABLESPACE {}').format(
+                table, sql.Identifier(tablespace)
+            ))
+
+    with conn.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+    logger.info("Archived transactions of %s", month.strftime('%Y-%m'))
+
+
+def archive_before(conn, cutoff, tablespace=None):
+    """Archive every attached month strictly before cutoff"""
+    if cutoff > current_month(conn):
+        raise ValueError("Only closed months can be archived")
+    archived = 0
+    for month in attached_months(conn):
+        if month < cutoff:
+            archive_month(conn, month, tablespace)
+            archived += 1
+    return archived
+
+
+def take_snapshot(conn, at=None, settle_minutes=Config.STOCK_SNAPSHOT_SETTLE_MINUTES):
+    """Snapshot stock per batch at `at` (ISO string), default the last WIB midnight.
+
+    Movements are timestamped when written but only visible once committed,
+    so a snapshot must lie far enough in the past that every transaction
+    stamped before it has finished.
+    """
+    with conn.cursor() as cursor:
+        if at:
+            cursor.execute('SELECT %s::timestamptz, now()', (at,))
+        else:
+            cursor.execute("""
+                SELECT date_trunc('day', now() AT TIME ZONE 'Asia/Jakarta') AT TIME ZONE 'Asia/Jakarta', now()
+            """)
+        snapshot_time, now = cursor.fetchone()
+        if snapshot_time > now - timedelta(minutes=settle_minutes):
+            raise ValueError(f"Snapshot time must be at least {settle_minutes} minutes in the past")
+        cursor.execute('SELECT take_stock_snapshot(%s)', (snapshot_time,))
+        written = cursor.fetchone()[0]
+    logger.info("Stock snapshot at %s: %d batch(es)", snapshot_time.isoformat(), written)
+    return written
+
+
+def prune_changes(conn, days):
+    """Remove change log entries older than `days`; older sync cursors get 410"""
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT prune_change_log(make_interval(days => %s))', (days,))
+        removed = cursor.fetchone()[0]
+    logger.info("%d change log entries pruned", removed)
+    return removed
+
+
+def prune_slow_queries(conn, days):
+    """Remove slow query samples older than `days`; the aggregates stay"""
+    with conn.cursor() as cursor:
+        cursor.execute('DELETE FROM slow_query_log WHERE waktu < CURRENT_TIMESTAMP - make_interval(days => %s)', (days,))
+        removed = cursor.rowcount
+    logger.info("%d slow query samples pruned", removed)
+    return removed
+
+
+def sweep_reservations(conn, batch_size=5000):
+    """Delete expired cart stock holds in batches; reads already ignore them"""
+    removed = 0
+    with conn.cursor() as cursor:
+        while True:
+            cursor.execute("""
+                DELETE FROM reservasi_stok
+                WHERE id IN (
+                    SELECT id FROM reservasi_stok
+                    WHERE kedaluwarsa <= CURRENT_TIMESTAMP
+                    LIMIT %s
+                )
+            """, (batch_size,))
+            removed += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                break
+    logger.info("%d expired stock holds removed", removed)
+    return removed
+
+
+def run(args):
+    """Run one maintenance command on a fresh connection"""
+    conn = connect()
+    try:
+        if args.command == 'partitions':
+            ensure_partitions(conn, args.months_ahead)
+        elif args.command == 'archive':
+            year, month = (int(part) for part in args.before.split('-'))
+            archive_before(conn, date(year, month, 1), args.tablespace)
+        elif args.command == 'snapshot':
+            take_snapshot(conn, args.at)
+        elif args.command == 'prune-changes':
+            prune_changes(conn, args.days)
+        elif args.command == 'forecast':
+            refresh_suggestions(conn, args.days, args.lead_time, Config.FORECAST_SERVICE_Z)
+        elif args.command == 'prune-slow-queries':
+            prune_slow_queries(conn, args.days)
+        elif args.command == 'sweep-reservations':
+            sweep_reservations(conn)
+        elif args.command == 'analytics-export':
+            source = psycopg2.connect(Config.ANALYTICS_DATABASE_URL or Config.SQLALCHEMY_DATABASE_URI)
+            try:
+                export_snapshot(source, args.path, args.full)
+            finally:
+                source.close()
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    parser = argparse.ArgumentParser(description='Database maintenance')
+    parser.add_argument('--every', type=int, metavar='SECONDS', help='keep running the command at this interval')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    partitions_parser = commands.add_parser('partitions', help='create upcoming monthly partitions')
+    partitions_parser.add_argument('--months-ahead', type=int, default=Config.PARTITION_MONTHS_AHEAD)
+
+    archive_parser = commands.add_parser('archive', help='move closed months to the archive schema')
+    archive_parser.add_argument('--before', required=True, help='first month to keep, YYYY-MM')
+    archive_parser.add_argument('--tablespace', default=Config.ARCHIVE_TABLESPACE)
+
+    snapshot_parser = commands.add_parser('snapshot', help='snapshot stock per batch from the ledger')
+    snapshot_parser.add_argument('--at', help='snapshot time (ISO datetime), default the last WIB midnight')
+
+    prune_parser = commands.add_parser('prune-changes', help='drop change log entries past the retention')
+    prune_parser.add_argument('--days', type=int, default=Config.CHANGE_LOG_RETENTION_DAYS)
+
+    forecast_parser = commands.add_parser('forecast', help='recompute reorder point suggestions from recent sales')
+    forecast_parser.add_argument('--days', type=int, default=Config.FORECAST_HISTORY_DAYS)
+    forecast_parser.add_argument('--lead-time', type=float, default=Config.FORECAST_LEAD_TIME_DAYS)
+
+    slow_parser = commands.add_parser('prune-slow-queries', help='drop slow query samples past the retention')
+    slow_parser.add_argument('--days', type=int, default=Config.SLOW_QUERY_LOG_RETENTION_DAYS)
+
+    commands.add_parser('sweep-reservations', help='delete expired cart stock holds')
+
+    export_parser = commands.add_parser('analytics-export', help='refresh the analytics snapshot file')
+    export_parser.add_argument('--path', default=Config.ANALYTICS_EXPORT_PATH)
+    export_parser.add_argument('--full', action='store_true', help='rebuild instead of copying new transactions only')
+
+    args = parser.parse_args()
+    if args.every:
+        # Long-running scheduler mode (see docker-compose.yml): a failed run
+        # is logged and retried on the next tick instead of ending the loop
+        while True:
+            try:
+                run(args)
+            except Exception as e:
+                logger.error("%s failed: %s", args.command, e)
+            time.sleep(args.every)
+    try:
+        run(args)
+    except Exception as e:
+        logger.error("%s failed: %s", args.command, e)
+        sys.exit(1)
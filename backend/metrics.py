@@ -0,0 +1,46 @@
+# metrics.py
+import os
+import threading
+from collections import defaultdict
+
+# Counters of this worker process, keyed by (name, sorted label items)
+_counters = defaultdict(int)
+_help = {}
+_lock = threading.Lock()
+
+
+def describe(name, text):
+    """Register the HELP line of a counter"""
+    _help[name] = text
+
+
+def increment(name, amount=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] += amount
+
+
+def snapshot():
+    """Current counter values as {(name, labels): value}"""
+    with _lock:
+        return dict(_counters)
+
+
+def _format_labels(labels):
+    # Workers keep separate counters, the pid tells their series apart
+    labels = labels + (('pid', str(os.getpid())),)
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+def render_prometheus():
+    """Counters in the Prometheus text exposition format"""
+    lines = []
+    seen = set()
+    for (name, labels), value in sorted(snapshot().items()):
+        if name not in seen:
+            seen.add(name)
+            if name in _help:
+                lines.append(f'# HELP {name} {_help[name]}')
+            lines.append(f'# TYPE {name} counter')
+        lines.append(f'{name}{_format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
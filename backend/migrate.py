@@ -0,0 +1,199 @@
+# migrate.py
+"""Apply versioned schema migrations.
+
+Runs once per deploy, before the gunicorn workers start:
+
+    python migrate.py            # apply pending migrations
+    python migrate.py --status   # list applied and pending migrations
+
+Migrations are plain SQL files in migrations/ named NNNN_description.sql.
+Each file runs in its own transaction unless its first line is
+``-- migrate:no-transaction`` (needed for CREATE INDEX CONCURRENTLY), in
+which case its statements run one by one in autocommit mode. Such a file
+must be safe to rerun after a failure: its statements use IF NOT EXISTS,
+and any INVALID index a failed CREATE INDEX CONCURRENTLY left behind is
+dropped before the rerun.
+
+An applied file must never change; a checksum mismatch aborts the run.
+"""
+import argparse
+import hashlib
+import logging
+import os
+import re
+import sys
+
+import psycopg2
+from psycopg2 import sql as pgsql
+
+from config import Config
+
+logger = logging.getLogger('migrate')
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRATION_FILE = re.compile(r'^(\d{4})_(\w+)\.sql$')
+NO_TRANSACTION = '-- migrate:no-transaction'
+CONCURRENT_INDEX = re.compile(
+    r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)', re.IGNORECASE
+)
+
+# Arbitrary key for pg_advisory_lock so concurrent deploys run one at a time
+LOCK_KEY = 80120318
+
+
+class ChecksumMismatch(Exception):
+    """An applied migration file was edited afterwards"""
+
+
+def load_migrations():
+    """Return (version, name, sql, checksum) for every migration file, in order"""
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = MIGRATION_FILE.match(filename)
+        if not match:
+            continue
+        with open(os.path.join(MIGRATIONS_DIR, filename), encoding='utf-8') as f:
+            sql = f.read()
+        checksum = hashlib.sha256(sql.encode('utf-8')).hexdigest()
+        migrations.append((int(match.group(1)), match.group(2), sql, checksum))
+    return migrations
+
+
+def split_statements(sql):
+    """Split a script on top-level semicolons, keeping $$ bodies intact"""
+    statements, current, in_dollar = [], [], False
+    for line in sql.splitlines():
+        if line.strip().startswith('--') and not in_dollar:
+            continue
+        current.append(line)
+        if line.count('$$') % 2:
+            in_dollar = not in_dollar
+        if not in_dollar and line.rstrip().endswith(';'):
+            statement = '\n'.join(current).strip()
+            if statement.rstrip(';').strip():
+                statements.append(statement)
+            current = []
+    if '\n'.join(current).strip():
+        statements.append('\n'.join(current).strip())
+    return statements
+
+
+def ensure_migrations_table(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name VARCHAR(200) NOT NULL,
+                checksum VARCHAR(64) NOT NULL,
+                applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+
+def applied_migrations(conn):
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT version, checksum FROM schema_migrations')
+        return dict(cursor.fetchall())
+
+
+def drop_invalid_indexes(cursor, sql):
+    """Drop the INVALID indexes an earlier, failed run of `sql` left behind.
+
+    A failed CREATE INDEX CONCURRENTLY keeps its index, marked invalid; IF
+    NOT EXISTS would then skip it and the rerun would "succeed" without it.
+    """
+    names = CONCURRENT_INDEX.findall(sql)
+    if not names:
+        return []
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE NOT i.indisvalid AND c.relname = ANY(%s) AND pg_table_is_visible(c.oid)
+    """, ([name.lower() for name in names],))
+    invalid = [row[0] for row in cursor.fetchall()]
+    for name in invalid:
+        logger.warning("Dropping invalid index %s left by an earlier run", name)
+        cursor.execute(pgsql.SQL('DROP INDEX CONCURRENTLY IF EXISTS {}').format(pgsql.Identifier(name)))
+    return invalid
+
+
+def apply_migration(conn, version, name, sql, checksum):
+    logger.info("Applying migration %04d_%s", version, name)
+    if sql.lstrip().startswith(NO_TRANSACTION):
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                drop_invalid_indexes(cursor, sql)
+                for statement in split_statements(sql):
+                    cursor.execute(statement)
+        finally:
+            conn.autocommit = False
+        with conn.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)',
+                (version, name, checksum)
+            )
+        conn.commit()
+        return
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql)
+            cursor.execute(
+                'INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)',
+                (version, name, checksum)
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def migrate(database_url=None, status_only=False):
+    """Apply every pending migration; returns the number applied"""
+    conn = psycopg2.connect(database_url or Config.SQLALCHEMY_DATABASE_URI)
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_lock(%s)', (LOCK_KEY,))
+        conn.autocommit = False
+
+        ensure_migrations_table(conn)
+        conn.commit()
+        applied = applied_migrations(conn)
+        conn.commit()
+
+        count = 0
+        for version, name, sql, checksum in load_migrations():
+            if version in applied:
+                if applied[version] != checksum:
+                    if not status_only:
+                        raise ChecksumMismatch(f"Migration {version:04d}_{name} was modified after it was applied")
+                    print(f"modified {version:04d}_{name}")
+                elif status_only:
+                    print(f"applied  {version:04d}_{name}")
+                continue
+            if status_only:
+                print(f"pending  {version:04d}_{name}")
+                continue
+            apply_migration(conn, version, name, sql, checksum)
+            count += 1
+        return count
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    parser = argparse.ArgumentParser(description='Apply versioned schema migrations')
+    parser.add_argument('--status', action='store_true', help='list migrations without applying them')
+    args = parser.parse_args()
+
+    try:
+        applied_count = migrate(status_only=args.status)
+    except Exception as e:
+        logger.error("Migration failed: %s", e)
+        sys.exit(1)
+    if not args.status:
+        logger.info("%d migration(s) applied", applied_count)
@@ -0,0 +1,42 @@
+-- Baseline schema. Uses IF NOT EXISTS so databases that were initialised
+-- from the old schema.sql are adopted without changes.
+
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    username VARCHAR(80) UNIQUE NOT NULL,
+    password_hash VARCHAR(200) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS inventory (
+    sku VARCHAR(100),
+    batch_number VARCHAR(50),
+    nama_item VARCHAR(100) NOT NULL,
+    kategori VARCHAR(50),
+    stok_tersedia INTEGER DEFAULT 0,
+    stok_minimum INTEGER DEFAULT 10,
+    harga FLOAT NOT NULL,
+    waktu_pembaruan TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (sku, batch_number)
+);
+
+CREATE TABLE IF NOT EXISTS transaksi (
+    id_transaksi SERIAL PRIMARY KEY,
+    total_amount FLOAT NOT NULL,
+    waktu_transaksi TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS transaksi_detail (
+    id SERIAL PRIMARY KEY,
+    id_transaksi INTEGER NOT NULL,
+    sku VARCHAR(100) NOT NULL,
+    batch_number VARCHAR(50) NOT NULL,
+    jumlah INTEGER NOT NULL,
+    harga_satuan FLOAT NOT NULL,
+    subtotal FLOAT NOT NULL,
+    FOREIGN KEY (id_transaksi) REFERENCES transaksi(id_transaksi)
+        ON DELETE CASCADE,
+    FOREIGN KEY (sku, batch_number) REFERENCES inventory(sku, batch_number)
+);
+
+CREATE INDEX IF NOT EXISTS idx_transaksi_detail_id_transaksi ON transaksi_detail(id_transaksi);
+CREATE INDEX IF NOT EXISTS idx_transaksi_detail_sku_batch ON transaksi_detail(sku, batch_number);
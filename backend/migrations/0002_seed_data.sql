@@ -0,0 +1,10 @@
+-- Initial admin user (password: admin123) and sample inventory
+
+INSERT INTO users (username, password_hash) VALUES
+('admin', 'scrypt:32768:8:1$A1ixQGNLpDiJN156$73b17a18cf1f5513f5fdbbd457f7ac0afb952607daf530931917e59c814a158d08d0d9d12c42282e22df08a4fe3cea73ab7a3b72674a986e24912db42a967fbb')
+ON CONFLICT (username) DO NOTHING;
+
+INSERT INTO inventory (sku, batch_number, nama_item, kategori, stok_tersedia, stok_minimum, harga) VALUES
+('PARA001', 'B001', 'Paracetamol 500mg', 'Obat Bebas', 100, 20, 10000),
+('VITC001', 'B002', 'Vitamin C 500mg', 'Suplemen', 50, 10, 25000)
+ON CONFLICT (sku, batch_number) DO NOTHING;
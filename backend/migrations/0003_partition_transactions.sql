@@ -0,0 +1,117 @@
+-- Range-partition transaksi and transaksi_detail by month of waktu_transaksi
+-- (months are WIB calendar months). Postgres requires the partition key in
+-- every unique constraint, so both primary keys become composite and
+-- transaksi_detail carries a copy of waktu_transaksi.
+--
+-- There is deliberately no DEFAULT partition: it would block
+-- DETACH PARTITION ... CONCURRENTLY when archiving closed months. Future
+-- partitions are created ahead of time by ensure_transaksi_partitions(),
+-- which `python maintenance.py partitions` runs on every deploy.
+
+CREATE SCHEMA IF NOT EXISTS archive;
+
+CREATE OR REPLACE FUNCTION create_transaksi_partitions(from_month DATE, to_month DATE)
+RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE := date_trunc('month', from_month)::date;
+    suffix TEXT;
+    lower_bound TIMESTAMP WITH TIME ZONE;
+    upper_bound TIMESTAMP WITH TIME ZONE;
+    created INTEGER := 0;
+BEGIN
+    WHILE month_start <= to_month LOOP
+        suffix := to_char(month_start, '"y"YYYY"m"MM');
+        lower_bound := month_start::timestamp AT TIME ZONE 'Asia/Jakarta';
+        upper_bound := (month_start + INTERVAL '1 month')::timestamp AT TIME ZONE 'Asia/Jakarta';
+
+        IF to_regclass('public.transaksi_' || suffix) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE public.%I PARTITION OF transaksi FOR VALUES FROM (%L) TO (%L)',
+                'transaksi_' || suffix, lower_bound, upper_bound
+            );
+            created := created + 1;
+        END IF;
+
+        IF to_regclass('public.transaksi_detail_' || suffix) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE public.%I PARTITION OF transaksi_detail FOR VALUES FROM (%L) TO (%L)',
+                'transaksi_detail_' || suffix, lower_bound, upper_bound
+            );
+        END IF;
+
+        month_start := (month_start + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION ensure_transaksi_partitions(months_ahead INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    current_month DATE := date_trunc('month', now() AT TIME ZONE 'Asia/Jakarta')::date;
+BEGIN
+    RETURN create_transaksi_partitions(
+        current_month,
+        (current_month + make_interval(months => months_ahead))::date
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Move the existing heaps out of the way
+ALTER TABLE transaksi_detail RENAME TO transaksi_detail_old;
+ALTER TABLE transaksi RENAME TO transaksi_old;
+ALTER INDEX transaksi_pkey RENAME TO transaksi_old_pkey;
+ALTER INDEX transaksi_detail_pkey RENAME TO transaksi_detail_old_pkey;
+ALTER INDEX IF EXISTS idx_transaksi_detail_id_transaksi RENAME TO idx_transaksi_detail_old_id_transaksi;
+ALTER INDEX IF EXISTS idx_transaksi_detail_sku_batch RENAME TO idx_transaksi_detail_old_sku_batch;
+
+CREATE TABLE transaksi (
+    id_transaksi INTEGER NOT NULL DEFAULT nextval('transaksi_id_transaksi_seq'),
+    total_amount FLOAT NOT NULL,
+    waktu_transaksi TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id_transaksi, waktu_transaksi)
+) PARTITION BY RANGE (waktu_transaksi);
+
+CREATE TABLE transaksi_detail (
+    id INTEGER NOT NULL DEFAULT nextval('transaksi_detail_id_seq'),
+    id_transaksi INTEGER NOT NULL,
+    waktu_transaksi TIMESTAMP WITH TIME ZONE NOT NULL,
+    sku VARCHAR(100) NOT NULL,
+    batch_number VARCHAR(50) NOT NULL,
+    jumlah INTEGER NOT NULL,
+    harga_satuan FLOAT NOT NULL,
+    subtotal FLOAT NOT NULL,
+    PRIMARY KEY (id, waktu_transaksi),
+    CONSTRAINT fk_transaksi_detail_transaksi FOREIGN KEY (id_transaksi, waktu_transaksi)
+        REFERENCES transaksi (id_transaksi, waktu_transaksi) ON DELETE CASCADE,
+    CONSTRAINT fk_transaksi_detail_inventory FOREIGN KEY (sku, batch_number)
+        REFERENCES inventory (sku, batch_number)
+) PARTITION BY RANGE (waktu_transaksi);
+
+-- Keep the sequences when the old tables are dropped
+ALTER SEQUENCE transaksi_id_transaksi_seq OWNED BY transaksi.id_transaksi;
+ALTER SEQUENCE transaksi_detail_id_seq OWNED BY transaksi_detail.id;
+
+CREATE INDEX idx_transaksi_detail_id_transaksi ON transaksi_detail (id_transaksi);
+CREATE INDEX idx_transaksi_detail_sku_batch ON transaksi_detail (sku, batch_number);
+
+-- Cover the existing history plus a year ahead
+SELECT create_transaksi_partitions(
+    COALESCE(
+        (SELECT min(waktu_transaksi) AT TIME ZONE 'Asia/Jakarta' FROM transaksi_old)::date,
+        (now() AT TIME ZONE 'Asia/Jakarta')::date
+    ),
+    ((now() AT TIME ZONE 'Asia/Jakarta') + INTERVAL '12 months')::date
+);
+
+INSERT INTO transaksi (id_transaksi, total_amount, waktu_transaksi)
+SELECT id_transaksi, total_amount, COALESCE(waktu_transaksi, CURRENT_TIMESTAMP)
+FROM transaksi_old;
+
+INSERT INTO transaksi_detail (id, id_transaksi, waktu_transaksi, sku, batch_number, jumlah, harga_satuan, subtotal)
+SELECT d.id, d.id_transaksi, t.waktu_transaksi, d.sku, d.batch_number, d.jumlah, d.harga_satuan, d.subtotal
+FROM transaksi_detail_old d
+JOIN transaksi t ON t.id_transaksi = d.id_transaksi;
+
+DROP TABLE transaksi_detail_old;
+DROP TABLE transaksi_old;
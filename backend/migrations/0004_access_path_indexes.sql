@@ -0,0 +1,15 @@
+-- migrate:no-transaction
+-- Indexes for the filters the routes actually issue. Plain tables get
+-- CONCURRENTLY so they can be added to a live database; Postgres does not
+-- support it on partitioned tables, where the index is built per partition.
+
+-- ILIKE '%term%' search on nama_item / sku (GET /inventory?search=)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_inventory_nama_item_trgm ON inventory USING gin (nama_item gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_inventory_sku_trgm ON inventory USING gin (sku gin_trgm_ops);
+
+-- GET /inventory?category=
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_inventory_kategori ON inventory (kategori);
+
+-- Date-range filters on transactions within a monthly partition
+CREATE INDEX IF NOT EXISTS idx_transaksi_waktu ON transaksi (waktu_transaksi);
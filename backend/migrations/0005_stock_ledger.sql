@@ -0,0 +1,66 @@
+-- Append-only stock ledger. Every change to inventory.stok_tersedia is
+-- recorded in mutasi_stok; snapshot_stok holds per-batch stock at fixed
+-- points in time so point-in-time queries replay only a short tail.
+--
+-- There is no foreign key to inventory: the history of a deleted batch is
+-- kept.
+
+CREATE TABLE mutasi_stok (
+    id BIGSERIAL PRIMARY KEY,
+    sku VARCHAR(100) NOT NULL,
+    batch_number VARCHAR(50) NOT NULL,
+    jumlah INTEGER NOT NULL,
+    stok_setelah INTEGER NOT NULL,
+    jenis VARCHAR(20) NOT NULL CHECK (jenis IN (
+        'opening', 'receipt', 'sale', 'sale_edit', 'cancel', 'adjustment', 'delete', 'import'
+    )),
+    id_transaksi INTEGER,
+    user_id INTEGER,
+    waktu TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_mutasi_stok_waktu ON mutasi_stok (waktu);
+CREATE INDEX idx_mutasi_stok_sku_batch_waktu ON mutasi_stok (sku, batch_number, waktu);
+
+CREATE TABLE snapshot_stok (
+    waktu_snapshot TIMESTAMP WITH TIME ZONE NOT NULL,
+    sku VARCHAR(100) NOT NULL,
+    batch_number VARCHAR(50) NOT NULL,
+    stok INTEGER NOT NULL,
+    PRIMARY KEY (waktu_snapshot, sku, batch_number)
+);
+
+-- Current stock becomes the opening balance of the ledger
+INSERT INTO mutasi_stok (sku, batch_number, jumlah, stok_setelah, jenis)
+SELECT sku, batch_number, COALESCE(stok_tersedia, 0), COALESCE(stok_tersedia, 0), 'opening'
+FROM inventory;
+
+-- Stock per batch at `at`, computed from the previous snapshot plus the
+-- movements in between, so a snapshot never depends on when it was taken.
+-- Returns the number of batches written, 0 if the snapshot already exists.
+CREATE OR REPLACE FUNCTION take_stock_snapshot(at TIMESTAMP WITH TIME ZONE)
+RETURNS INTEGER AS $$
+DECLARE
+    previous TIMESTAMP WITH TIME ZONE;
+    written INTEGER;
+BEGIN
+    IF EXISTS (SELECT 1 FROM snapshot_stok WHERE waktu_snapshot = at) THEN
+        RETURN 0;
+    END IF;
+
+    SELECT max(waktu_snapshot) INTO previous FROM snapshot_stok WHERE waktu_snapshot < at;
+
+    INSERT INTO snapshot_stok (waktu_snapshot, sku, batch_number, stok)
+    SELECT at, sku, batch_number, sum(stok)
+    FROM (
+        SELECT sku, batch_number, stok FROM snapshot_stok WHERE waktu_snapshot = previous
+        UNION ALL
+        SELECT sku, batch_number, jumlah FROM mutasi_stok
+        WHERE waktu > COALESCE(previous, '-infinity') AND waktu <= at
+    ) AS balance
+    GROUP BY sku, batch_number;
+
+    GET DIAGNOSTICS written = ROW_COUNT;
+    RETURN written;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,120 @@
+-- Outlets (cabang). Inventory, transactions and the stock ledger get an
+-- id_cabang that leads their keys and indexes, so an outlet's queries read
+-- only its own slice. Existing data belongs to outlet 1.
+--
+-- Users with a NULL id_cabang are head office and see every outlet.
+-- Head-office roll-ups read penjualan_harian, a per-outlet daily sales
+-- aggregate kept current by a trigger on transaksi.
+
+CREATE TABLE cabang (
+    id_cabang SERIAL PRIMARY KEY,
+    kode VARCHAR(20) UNIQUE NOT NULL,
+    nama VARCHAR(100) NOT NULL
+);
+
+INSERT INTO cabang (id_cabang, kode, nama) VALUES (1, 'UTAMA', 'Outlet Utama');
+SELECT setval('cabang_id_cabang_seq', (SELECT max(id_cabang) FROM cabang));
+
+ALTER TABLE users ADD COLUMN id_cabang INTEGER REFERENCES cabang (id_cabang);
+
+-- Inventory: the same SKU/batch can be stocked by several outlets
+ALTER TABLE transaksi_detail DROP CONSTRAINT fk_transaksi_detail_inventory;
+ALTER TABLE inventory ADD COLUMN id_cabang INTEGER NOT NULL DEFAULT 1 REFERENCES cabang (id_cabang);
+ALTER TABLE inventory ALTER COLUMN id_cabang DROP DEFAULT;
+ALTER TABLE inventory DROP CONSTRAINT inventory_pkey;
+ALTER TABLE inventory ADD PRIMARY KEY (id_cabang, sku, batch_number);
+CREATE INDEX idx_inventory_cabang_kategori ON inventory (id_cabang, kategori);
+
+-- Transactions stay partitioned by month; within a partition an outlet
+-- reads its rows through (id_cabang, waktu_transaksi)
+ALTER TABLE transaksi ADD COLUMN id_cabang INTEGER NOT NULL DEFAULT 1 REFERENCES cabang (id_cabang);
+ALTER TABLE transaksi ALTER COLUMN id_cabang DROP DEFAULT;
+CREATE INDEX idx_transaksi_cabang_waktu ON transaksi (id_cabang, waktu_transaksi);
+
+ALTER TABLE transaksi_detail ADD COLUMN id_cabang INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE transaksi_detail ALTER COLUMN id_cabang DROP DEFAULT;
+ALTER TABLE transaksi_detail ADD CONSTRAINT fk_transaksi_detail_inventory
+    FOREIGN KEY (id_cabang, sku, batch_number) REFERENCES inventory (id_cabang, sku, batch_number);
+DROP INDEX idx_transaksi_detail_sku_batch;
+CREATE INDEX idx_transaksi_detail_cabang_sku_batch ON transaksi_detail (id_cabang, sku, batch_number);
+
+-- Stock ledger
+ALTER TABLE mutasi_stok ADD COLUMN id_cabang INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE mutasi_stok ALTER COLUMN id_cabang DROP DEFAULT;
+DROP INDEX idx_mutasi_stok_sku_batch_waktu;
+CREATE INDEX idx_mutasi_stok_cabang_sku_batch_waktu ON mutasi_stok (id_cabang, sku, batch_number, waktu);
+
+ALTER TABLE snapshot_stok ADD COLUMN id_cabang INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE snapshot_stok ALTER COLUMN id_cabang DROP DEFAULT;
+ALTER TABLE snapshot_stok DROP CONSTRAINT snapshot_stok_pkey;
+ALTER TABLE snapshot_stok ADD PRIMARY KEY (waktu_snapshot, id_cabang, sku, batch_number);
+
+CREATE OR REPLACE FUNCTION take_stock_snapshot(at TIMESTAMP WITH TIME ZONE)
+RETURNS INTEGER AS $$
+DECLARE
+    previous TIMESTAMP WITH TIME ZONE;
+    written INTEGER;
+BEGIN
+    IF EXISTS (SELECT 1 FROM snapshot_stok WHERE waktu_snapshot = at) THEN
+        RETURN 0;
+    END IF;
+
+    SELECT max(waktu_snapshot) INTO previous FROM snapshot_stok WHERE waktu_snapshot < at;
+
+    INSERT INTO snapshot_stok (waktu_snapshot, id_cabang, sku, batch_number, stok)
+    SELECT at, id_cabang, sku, batch_number, sum(stok)
+    FROM (
+        SELECT id_cabang, sku, batch_number, stok FROM snapshot_stok WHERE waktu_snapshot = previous
+        UNION ALL
+        SELECT id_cabang, sku, batch_number, jumlah FROM mutasi_stok
+        WHERE waktu > COALESCE(previous, '-infinity') AND waktu <= at
+    ) AS balance
+    GROUP BY id_cabang, sku, batch_number;
+
+    GET DIAGNOSTICS written = ROW_COUNT;
+    RETURN written;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Daily sales per outlet (WIB days)
+CREATE TABLE penjualan_harian (
+    id_cabang INTEGER NOT NULL REFERENCES cabang (id_cabang),
+    tanggal DATE NOT NULL,
+    total_amount FLOAT NOT NULL DEFAULT 0,
+    jumlah_transaksi INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (id_cabang, tanggal)
+);
+
+CREATE INDEX idx_penjualan_harian_tanggal ON penjualan_harian (tanggal);
+
+CREATE OR REPLACE FUNCTION apply_penjualan_harian()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE penjualan_harian
+        SET total_amount = total_amount - OLD.total_amount,
+            jumlah_transaksi = jumlah_transaksi - 1
+        WHERE id_cabang = OLD.id_cabang
+          AND tanggal = (OLD.waktu_transaksi AT TIME ZONE 'Asia/Jakarta')::date;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO penjualan_harian (id_cabang, tanggal, total_amount, jumlah_transaksi)
+        VALUES (NEW.id_cabang, (NEW.waktu_transaksi AT TIME ZONE 'Asia/Jakarta')::date, NEW.total_amount, 1)
+        ON CONFLICT (id_cabang, tanggal) DO UPDATE
+        SET total_amount = penjualan_harian.total_amount + EXCLUDED.total_amount,
+            jumlah_transaksi = penjualan_harian.jumlah_transaksi + 1;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+INSERT INTO penjualan_harian (id_cabang, tanggal, total_amount, jumlah_transaksi)
+SELECT id_cabang, (waktu_transaksi AT TIME ZONE 'Asia/Jakarta')::date, sum(total_amount), count(*)
+FROM transaksi
+GROUP BY 1, 2;
+
+CREATE TRIGGER trg_transaksi_penjualan_harian
+    AFTER INSERT OR UPDATE OF total_amount, waktu_transaksi, id_cabang OR DELETE ON transaksi
+    FOR EACH ROW EXECUTE FUNCTION apply_penjualan_harian();
@@ -0,0 +1,102 @@
+-- Change feed for delta sync (GET /sync/changes). Triggers record the key
+-- of every inventory batch and transaction that is written; readers fetch
+-- the current row for each key, or send a tombstone when it is gone.
+--
+-- Sequence numbers are taken before commit, so they can become visible
+-- out of order. Readers therefore order by (xid, seq) and only read rows
+-- of transactions older than every transaction still running, see
+-- sync.py.
+
+CREATE TABLE change_log (
+    seq BIGSERIAL PRIMARY KEY,
+    xid XID8 NOT NULL DEFAULT pg_current_xact_id(),
+    entity VARCHAR(20) NOT NULL CHECK (entity IN ('inventory', 'transaksi')),
+    id_cabang INTEGER NOT NULL,
+    sku VARCHAR(100),
+    batch_number VARCHAR(50),
+    id_transaksi INTEGER,
+    waktu TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_change_log_xid_seq ON change_log (xid, seq);
+CREATE INDEX idx_change_log_cabang_xid_seq ON change_log (id_cabang, xid, seq);
+CREATE INDEX idx_change_log_waktu ON change_log (waktu);
+
+-- Newest position removed by pruning; older cursors must resync in full
+CREATE TABLE change_log_horizon (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    xid XID8 NOT NULL,
+    seq BIGINT NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION log_inventory_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        INSERT INTO change_log (entity, id_cabang, sku, batch_number)
+        VALUES ('inventory', OLD.id_cabang, OLD.sku, OLD.batch_number);
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND (NEW.id_cabang, NEW.sku, NEW.batch_number)
+            IS DISTINCT FROM (OLD.id_cabang, OLD.sku, OLD.batch_number)) THEN
+        INSERT INTO change_log (entity, id_cabang, sku, batch_number)
+        VALUES ('inventory', NEW.id_cabang, NEW.sku, NEW.batch_number);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Used for transaksi and transaksi_detail: a changed line changes its sale
+CREATE OR REPLACE FUNCTION log_transaksi_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        INSERT INTO change_log (entity, id_cabang, id_transaksi)
+        VALUES ('transaksi', OLD.id_cabang, OLD.id_transaksi);
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND (NEW.id_cabang, NEW.id_transaksi)
+            IS DISTINCT FROM (OLD.id_cabang, OLD.id_transaksi)) THEN
+        INSERT INTO change_log (entity, id_cabang, id_transaksi)
+        VALUES ('transaksi', NEW.id_cabang, NEW.id_transaksi);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_inventory_change_log
+    AFTER INSERT OR UPDATE OR DELETE ON inventory
+    FOR EACH ROW EXECUTE FUNCTION log_inventory_change();
+
+CREATE TRIGGER trg_transaksi_change_log
+    AFTER INSERT OR UPDATE OR DELETE ON transaksi
+    FOR EACH ROW EXECUTE FUNCTION log_transaksi_change();
+
+CREATE TRIGGER trg_transaksi_detail_change_log
+    AFTER INSERT OR UPDATE OR DELETE ON transaksi_detail
+    FOR EACH ROW EXECUTE FUNCTION log_transaksi_change();
+
+-- Drop entries older than `keep` and move the horizon past them
+CREATE OR REPLACE FUNCTION prune_change_log(keep INTERVAL)
+RETURNS INTEGER AS $$
+DECLARE
+    last_xid XID8;
+    last_seq BIGINT;
+    removed INTEGER;
+BEGIN
+    SELECT xid, seq INTO last_xid, last_seq
+    FROM change_log
+    WHERE waktu < now() - keep
+    ORDER BY xid DESC, seq DESC
+    LIMIT 1;
+
+    IF last_xid IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    DELETE FROM change_log WHERE (xid, seq) <= (last_xid, last_seq);
+    GET DIAGNOSTICS removed = ROW_COUNT;
+
+    INSERT INTO change_log_horizon (xid, seq) VALUES (last_xid, last_seq)
+    ON CONFLICT (id) DO UPDATE SET xid = EXCLUDED.xid, seq = EXCLUDED.seq;
+    RETURN removed;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,21 @@
+-- Reorder points forecast per outlet and SKU from recent daily sales,
+-- recomputed in bulk by `python maintenance.py forecast` (see forecast.py).
+-- The table is replaced as a whole on every run.
+
+CREATE TABLE saran_pemesanan (
+    id_cabang INTEGER NOT NULL REFERENCES cabang(id_cabang),
+    sku VARCHAR(100) NOT NULL,
+    -- Average units sold per day over the last 7 days and the full window
+    rata_harian_7 DOUBLE PRECISION NOT NULL,
+    rata_harian DOUBLE PRECISION NOT NULL,
+    deviasi_harian DOUBLE PRECISION NOT NULL,
+    -- Expected demand while a reorder is on its way, plus its safety margin
+    permintaan_lead_time DOUBLE PRECISION NOT NULL,
+    stok_pengaman DOUBLE PRECISION NOT NULL,
+    titik_pemesanan INTEGER NOT NULL,
+    -- Stock when computed; readers compare against live stock
+    stok_tersedia INTEGER NOT NULL,
+    dihitung_pada TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id_cabang, sku)
+);
+
@@ -0,0 +1,35 @@
+-- Audit trail of inventory and transaction changes: who changed what,
+-- with the old and new value of every changed field. Rows are written in
+-- batches after the change commits (see audit.py) and never modified.
+
+CREATE TABLE audit_log (
+    id BIGSERIAL PRIMARY KEY,
+    waktu TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    user_id INTEGER,
+    id_cabang INTEGER,
+    entity VARCHAR(20) NOT NULL CHECK (entity IN ('inventory', 'transaksi')),
+    action VARCHAR(20) NOT NULL CHECK (action IN ('created', 'updated', 'deleted')),
+    -- e.g. {"sku": ..., "batch_number": ...} or {"id_transaksi": ...}
+    entity_key JSONB NOT NULL,
+    -- {field: [old, new]}
+    perubahan JSONB NOT NULL,
+    request_id VARCHAR(64)
+);
+
+CREATE INDEX idx_audit_log_waktu ON audit_log USING BRIN (waktu);
+CREATE INDEX idx_audit_log_entity_key ON audit_log (entity, (entity_key->>'sku'), waktu)
+    WHERE entity = 'inventory';
+CREATE INDEX idx_audit_log_transaksi ON audit_log (((entity_key->>'id_transaksi')::int), waktu)
+    WHERE entity = 'transaksi';
+CREATE INDEX idx_audit_log_user_waktu ON audit_log (user_id, waktu);
+
+CREATE OR REPLACE FUNCTION reject_audit_log_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    RAISE EXCEPTION 'audit_log is append-only';
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_audit_log_append_only
+    BEFORE UPDATE OR DELETE ON audit_log
+    FOR EACH ROW EXECUTE FUNCTION reject_audit_log_change();
@@ -0,0 +1,6 @@
+-- Administrators may use the /admin endpoints (profiles, slow queries).
+-- The flag travels in the login token as the is_admin claim.
+
+ALTER TABLE users ADD COLUMN is_admin BOOLEAN NOT NULL DEFAULT FALSE;
+
+UPDATE users SET is_admin = TRUE WHERE username = 'admin';
@@ -0,0 +1,36 @@
+-- Statement statistics collected by the app (see slowlog.py), merged from
+-- every worker: calls and time per normalized statement, the most calls
+-- one request made (N+1 lookups stand out), and an EXPLAIN snapshot taken
+-- when a statement is first seen above the slow threshold.
+
+CREATE TABLE query_stats (
+    fingerprint VARCHAR(16) PRIMARY KEY,
+    query TEXT NOT NULL,
+    calls BIGINT NOT NULL DEFAULT 0,
+    total_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+    max_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+    slow_calls BIGINT NOT NULL DEFAULT 0,
+    max_per_request INTEGER NOT NULL DEFAULT 0,
+    last_route VARCHAR(100),
+    param_shape JSONB,
+    first_seen TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_seen TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    plan JSONB,
+    explained_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX idx_query_stats_total_ms ON query_stats (total_ms DESC);
+
+-- One row per execution above the threshold
+CREATE TABLE slow_query_log (
+    id BIGSERIAL PRIMARY KEY,
+    fingerprint VARCHAR(16) NOT NULL,
+    waktu TIMESTAMP WITH TIME ZONE NOT NULL,
+    duration_ms DOUBLE PRECISION NOT NULL,
+    route VARCHAR(100),
+    param_shape JSONB,
+    request_id VARCHAR(64)
+);
+
+CREATE INDEX idx_slow_query_log_fingerprint_waktu ON slow_query_log (fingerprint, waktu DESC);
+CREATE INDEX idx_slow_query_log_waktu ON slow_query_log USING BRIN (waktu);
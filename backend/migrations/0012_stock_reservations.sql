@@ -0,0 +1,23 @@
+-- Short-lived stock holds of open carts (see reservations.py). A hold
+-- counts against a batch's sellable stock until it expires, is released,
+-- or is converted by the sale that checks the cart out. Expired holds are
+-- ignored by every read and removed in bulk by maintenance.py.
+
+CREATE TABLE reservasi_stok (
+    id BIGSERIAL PRIMARY KEY,
+    id_keranjang UUID NOT NULL,
+    id_cabang INTEGER NOT NULL,
+    sku VARCHAR(100) NOT NULL,
+    batch_number VARCHAR(50) NOT NULL,
+    jumlah INTEGER NOT NULL CHECK (jumlah > 0),
+    user_id INTEGER,
+    dibuat_pada TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    kedaluwarsa TIMESTAMP WITH TIME ZONE NOT NULL,
+    CONSTRAINT uq_reservasi_stok_line UNIQUE (id_keranjang, id_cabang, sku, batch_number),
+    CONSTRAINT fk_reservasi_stok_inventory FOREIGN KEY (id_cabang, sku, batch_number)
+        REFERENCES inventory (id_cabang, sku, batch_number) ON UPDATE CASCADE ON DELETE CASCADE
+);
+
+-- Held quantity per batch; the covering columns keep it index-only
+CREATE INDEX idx_reservasi_stok_batch ON reservasi_stok (id_cabang, sku, batch_number, kedaluwarsa) INCLUDE (jumlah, id_keranjang);
+CREATE INDEX idx_reservasi_stok_kedaluwarsa ON reservasi_stok (kedaluwarsa);
@@ -0,0 +1,34 @@
+-- Integer surrogate key for inventory batches. Sale lines reference their
+-- batch by id_batch instead of repeating (sku, batch_number) strings, so
+-- detail rows and their batch index shrink and the detail/inventory joins
+-- compare one integer. (id_cabang, sku, batch_number) stays the primary
+-- key: it is the natural key clients address batches by.
+--
+-- The stock ledger, snapshots, change log and reservations keep the
+-- natural key; the ledger deliberately outlives deleted batches.
+
+ALTER TABLE inventory ADD COLUMN id_batch INTEGER GENERATED BY DEFAULT AS IDENTITY;
+ALTER TABLE inventory ADD CONSTRAINT uq_inventory_id_batch UNIQUE (id_batch);
+
+-- Map every sale line to its batch while the string columns still exist
+CREATE TEMPORARY TABLE detail_batch ON COMMIT DROP AS
+SELECT d.id, d.waktu_transaksi, i.id_batch
+FROM transaksi_detail d
+JOIN inventory i ON i.id_cabang = d.id_cabang AND i.sku = d.sku AND i.batch_number = d.batch_number;
+
+ALTER TABLE transaksi_detail DROP CONSTRAINT fk_transaksi_detail_inventory;
+DROP INDEX idx_transaksi_detail_cabang_sku_batch;
+ALTER TABLE transaksi_detail DROP COLUMN sku, DROP COLUMN batch_number;
+ALTER TABLE transaksi_detail ADD COLUMN id_batch INTEGER;
+
+-- Rows rewritten after the drop no longer carry the strings; VACUUM makes
+-- the old versions' space reusable
+UPDATE transaksi_detail d
+SET id_batch = m.id_batch
+FROM detail_batch m
+WHERE d.id = m.id AND d.waktu_transaksi = m.waktu_transaksi;
+
+ALTER TABLE transaksi_detail ALTER COLUMN id_batch SET NOT NULL;
+ALTER TABLE transaksi_detail ADD CONSTRAINT fk_transaksi_detail_inventory
+    FOREIGN KEY (id_batch) REFERENCES inventory (id_batch);
+CREATE INDEX idx_transaksi_detail_batch ON transaksi_detail (id_batch);
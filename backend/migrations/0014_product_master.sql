@@ -0,0 +1,72 @@
+-- Product master. Name, category, minimum and price are kept per outlet
+-- and SKU in produk instead of being copied onto every batch, so changing
+-- them is a one-row write and inventory rows only carry batch fields.
+-- Products stay per outlet: since 0006 every outlet sets its own prices.
+--
+-- A product exists while its outlet stocks at least one batch of it; the
+-- last batch's delete removes it (see inventory_writes.py).
+
+CREATE TABLE produk (
+    id_cabang INTEGER NOT NULL REFERENCES cabang (id_cabang),
+    sku VARCHAR(100) NOT NULL,
+    nama_item VARCHAR(100) NOT NULL,
+    kategori VARCHAR(50),
+    stok_minimum INTEGER DEFAULT 10,
+    harga FLOAT NOT NULL,
+    waktu_pembaruan TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id_cabang, sku)
+);
+
+-- Batches of a SKU were kept consistent; the latest one wins otherwise
+INSERT INTO produk (id_cabang, sku, nama_item, kategori, stok_minimum, harga, waktu_pembaruan)
+SELECT DISTINCT ON (id_cabang, sku) id_cabang, sku, nama_item, kategori, stok_minimum, harga, waktu_pembaruan
+FROM inventory
+ORDER BY id_cabang, sku, waktu_pembaruan DESC NULLS LAST;
+
+ALTER TABLE inventory ADD CONSTRAINT fk_inventory_produk
+    FOREIGN KEY (id_cabang, sku) REFERENCES produk (id_cabang, sku);
+
+DROP INDEX IF EXISTS idx_inventory_nama_item_trgm;
+DROP INDEX IF EXISTS idx_inventory_sku_trgm;
+DROP INDEX IF EXISTS idx_inventory_kategori;
+DROP INDEX IF EXISTS idx_inventory_cabang_kategori;
+ALTER TABLE inventory
+    DROP COLUMN nama_item,
+    DROP COLUMN kategori,
+    DROP COLUMN stok_minimum,
+    DROP COLUMN harga;
+
+-- GET /inventory?category= for head office and for one outlet
+CREATE INDEX idx_produk_kategori ON produk (kategori);
+CREATE INDEX idx_produk_cabang_kategori ON produk (id_cabang, kategori);
+
+-- ILIKE '%term%' search on nama_item / sku, now matched on the product
+-- so both sides of the OR are on one table; needs pg_trgm from 0004
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+        CREATE INDEX idx_produk_nama_item_trgm ON produk USING gin (nama_item gin_trgm_ops);
+        CREATE INDEX idx_produk_sku_trgm ON produk USING gin (sku gin_trgm_ops);
+    END IF;
+END;
+$$;
+
+-- Delta sync serves batches, so a changed product changes all of its
+-- outlet's batches
+CREATE OR REPLACE FUNCTION log_produk_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO change_log (entity, id_cabang, sku, batch_number)
+    SELECT 'inventory', id_cabang, sku, batch_number
+    FROM inventory
+    WHERE id_cabang = NEW.id_cabang AND sku = NEW.sku;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_produk_change_log
+    AFTER UPDATE ON produk
+    FOR EACH ROW
+    WHEN ((OLD.nama_item, OLD.kategori, OLD.stok_minimum, OLD.harga)
+          IS DISTINCT FROM (NEW.nama_item, NEW.kategori, NEW.stok_minimum, NEW.harga))
+    EXECUTE FUNCTION log_produk_change();
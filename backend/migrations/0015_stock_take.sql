@@ -0,0 +1,37 @@
+-- Stock takes (stock opname, see stock_take.py). A session collects the
+-- counted quantity of each batch together with the system stock at the
+-- time of the count; applying it adjusts every counted batch by the
+-- difference in one statement, so sales made after a batch was counted
+-- are kept.
+
+CREATE TABLE stok_opname (
+    id_opname SERIAL PRIMARY KEY,
+    id_cabang INTEGER NOT NULL REFERENCES cabang (id_cabang),
+    status VARCHAR(20) NOT NULL DEFAULT 'open' CHECK (status IN ('open', 'applied', 'cancelled')),
+    catatan TEXT,
+    user_id INTEGER,
+    dibuka_pada TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    ditutup_pada TIMESTAMP WITH TIME ZONE
+);
+
+-- One count in progress per outlet
+CREATE UNIQUE INDEX uq_stok_opname_open ON stok_opname (id_cabang) WHERE status = 'open';
+
+-- A recount of a batch replaces its line
+CREATE TABLE stok_opname_item (
+    id_opname INTEGER NOT NULL REFERENCES stok_opname (id_opname) ON DELETE CASCADE,
+    sku VARCHAR(100) NOT NULL,
+    batch_number VARCHAR(50) NOT NULL,
+    jumlah_hitung INTEGER NOT NULL CHECK (jumlah_hitung >= 0),
+    stok_sistem INTEGER NOT NULL,
+    user_id INTEGER,
+    dihitung_pada TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id_opname, sku, batch_number)
+);
+
+-- Movements of an applied stock take point back to it
+ALTER TABLE mutasi_stok DROP CONSTRAINT mutasi_stok_jenis_check;
+ALTER TABLE mutasi_stok ADD CONSTRAINT mutasi_stok_jenis_check CHECK (jenis IN (
+    'opening', 'receipt', 'sale', 'sale_edit', 'cancel', 'adjustment', 'delete', 'import', 'stock_take'
+));
+ALTER TABLE mutasi_stok ADD COLUMN id_opname INTEGER;
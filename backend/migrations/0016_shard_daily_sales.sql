@@ -0,0 +1,38 @@
+-- penjualan_harian had one row per outlet and WIB day. Every sale of the
+-- outlet upserted it from a trigger and held that row lock until commit,
+-- so all checkouts of an outlet (and edits and cancellations) queued on
+-- one hot row. Each day is now spread over 16 counter rows picked by
+-- id_transaksi; readers already sum the rows of a day.
+
+ALTER TABLE penjualan_harian ADD COLUMN shard SMALLINT NOT NULL DEFAULT 0;
+ALTER TABLE penjualan_harian DROP CONSTRAINT penjualan_harian_pkey;
+ALTER TABLE penjualan_harian ADD PRIMARY KEY (id_cabang, tanggal, shard);
+ALTER TABLE penjualan_harian ALTER COLUMN shard DROP DEFAULT;
+
+-- Removals are upserted as negative amounts into the sale's own shard, so
+-- they never wait on another shard and need no row to exist there
+-- (aggregated history before this migration sits in shard 0)
+CREATE OR REPLACE FUNCTION apply_penjualan_harian()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO penjualan_harian (id_cabang, tanggal, shard, total_amount, jumlah_transaksi)
+        VALUES (OLD.id_cabang, (OLD.waktu_transaksi AT TIME ZONE 'Asia/Jakarta')::date,
+                OLD.id_transaksi % 16, -OLD.total_amount, -1)
+        ON CONFLICT (id_cabang, tanggal, shard) DO UPDATE
+        SET total_amount = penjualan_harian.total_amount + EXCLUDED.total_amount,
+            jumlah_transaksi = penjualan_harian.jumlah_transaksi + EXCLUDED.jumlah_transaksi;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO penjualan_harian (id_cabang, tanggal, shard, total_amount, jumlah_transaksi)
+        VALUES (NEW.id_cabang, (NEW.waktu_transaksi AT TIME ZONE 'Asia/Jakarta')::date,
+                NEW.id_transaksi % 16, NEW.total_amount, 1)
+        ON CONFLICT (id_cabang, tanggal, shard) DO UPDATE
+        SET total_amount = penjualan_harian.total_amount + EXCLUDED.total_amount,
+            jumlah_transaksi = penjualan_harian.jumlah_transaksi + EXCLUDED.jumlah_transaksi;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -1,10 +1,20 @@
 # models.py
 from app import db
 from datetime import datetime, timezone, timedelta
+from sqlalchemy.dialects.postgresql import JSONB, UUID
 from werkzeug.security import generate_password_hash, check_password_hash
  
+WIB = timezone(timedelta(hours=7))  # UTC+7 for WIB
+
 def get_wib_time():
-    return datetime.now(timezone(timedelta(hours=7)))  # UTC+7 for WIB
+    return datetime.now(WIB)
+
+class Cabang(db.Model):
+    __tablename__ = 'cabang'
+
+    id_cabang = db.Column(db.Integer, primary_key=True)
+    kode = db.Column(db.String(20), unique=True, nullable=False)
+    nama = db.Column(db.String(100), nullable=False)
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -12,6 +22,10 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     password_hash = db.Column(db.String(200), nullable=False)
+    # NULL for head office, which sees every outlet
+    id_cabang = db.Column(db.Integer, db.ForeignKey('cabang.id_cabang'))
+    # May use the /admin endpoints
+    is_admin = db.Column(db.Boolean, nullable=False, default=False)
     
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -19,14 +33,14 @@ class User(db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
-class Inventory(db.Model):
-    __tablename__ = 'inventory'
+class Produk(db.Model):
+    """Attributes shared by an outlet's batches of one SKU"""
+    __tablename__ = 'produk'
 
+    id_cabang = db.Column(db.Integer, db.ForeignKey('cabang.id_cabang'), primary_key=True)
     sku = db.Column(db.String(100), primary_key=True)
-    batch_number = db.Column(db.String(50), primary_key=True)
     nama_item = db.Column(db.String(100), nullable=False)
     kategori = db.Column(db.String(50))
-    stok_tersedia = db.Column(db.Integer, default=0)
     stok_minimum = db.Column(db.Integer, default=10)
     harga = db.Column(db.Float, nullable=False)
     waktu_pembaruan = db.Column(
@@ -35,38 +49,218 @@ class Inventory(db.Model):
         onupdate=get_wib_time
     )
 
+class Inventory(db.Model):
+    __tablename__ = 'inventory'
+
+    id_cabang = db.Column(db.Integer, db.ForeignKey('cabang.id_cabang'), primary_key=True)
+    sku = db.Column(db.String(100), primary_key=True)
+    batch_number = db.Column(db.String(50), primary_key=True)
+    # Surrogate key sale lines reference batches by
+    id_batch = db.Column(db.Integer, db.Identity(), unique=True, nullable=False)
+    stok_tersedia = db.Column(db.Integer, default=0)
+    waktu_pembaruan = db.Column(
+        db.DateTime(timezone=True),
+        default=get_wib_time,
+        onupdate=get_wib_time
+    )
+
+    # The product comes along in the same query
+    produk = db.relationship('Produk', lazy='joined', innerjoin=True)
+
+    __table_args__ = (
+        db.ForeignKeyConstraint(['id_cabang', 'sku'], ['produk.id_cabang', 'produk.sku']),
+    )
+
+    @property
+    def nama_item(self):
+        return self.produk.nama_item
+
+    @property
+    def kategori(self):
+        return self.produk.kategori
+
+    @property
+    def stok_minimum(self):
+        return self.produk.stok_minimum
+
+    @property
+    def harga(self):
+        return self.produk.harga
+
+    @property
+    def last_updated(self):
+        """Latest change to the batch or its product"""
+        return max(filter(None, (self.waktu_pembaruan, self.produk.waktu_pembaruan)), default=None)
+
 class Transaksi(db.Model):
     __tablename__ = 'transaksi'
 
-    id_transaksi = db.Column(db.Integer, primary_key=True)
+    # Partitioned by month of waktu_transaksi, which therefore has to be
+    # part of the primary key
+    id_transaksi = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    id_cabang = db.Column(db.Integer, db.ForeignKey('cabang.id_cabang'), nullable=False)
     total_amount = db.Column(db.Float, nullable=False)
     waktu_transaksi = db.Column(
         db.DateTime(timezone=True), 
+        primary_key=True,
         default=get_wib_time
     )
     
-    # Add cascade="all, delete-orphan" to properly handle deletion
+    # Add cascade="all, delete-orphan" to properly handle deletion; one
+    # query loads the lines of every transaction in a result
     details = db.relationship(
         'TransaksiDetail', 
         backref='transaksi', 
-        lazy=True,
+        lazy='selectin',
         cascade="all, delete-orphan"
     )
     
 class TransaksiDetail(db.Model):
     __tablename__ = 'transaksi_detail'
     
-    id = db.Column(db.Integer, primary_key=True)
-    id_transaksi = db.Column(db.Integer, db.ForeignKey('transaksi.id_transaksi'), nullable=False)
-    sku = db.Column(db.String(100), nullable=False)
-    batch_number = db.Column(db.String(50), nullable=False)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    id_transaksi = db.Column(db.Integer, nullable=False)
+    # Copied from the parent so details live in the same monthly partition
+    waktu_transaksi = db.Column(db.DateTime(timezone=True), primary_key=True)
+    id_cabang = db.Column(db.Integer, nullable=False)
+    id_batch = db.Column(db.Integer, db.ForeignKey('inventory.id_batch'), nullable=False)
     jumlah = db.Column(db.Integer, nullable=False)
     harga_satuan = db.Column(db.Float, nullable=False)
     subtotal = db.Column(db.Float, nullable=False)
     
+    # The batch comes along in the same query, joined on the integer key
+    inventory = db.relationship('Inventory', lazy='joined', innerjoin=True)
+    
+    __table_args__ = (
+        db.ForeignKeyConstraint(
+            ['id_transaksi', 'waktu_transaksi'],
+            ['transaksi.id_transaksi', 'transaksi.waktu_transaksi'],
+            ondelete='CASCADE'
+        ),
+    )
+    
+    @property
+    def sku(self):
+        return self.inventory.sku
+    
+    @property
+    def batch_number(self):
+        return self.inventory.batch_number
+
+class MutasiStok(db.Model):
+    """One change to the stock of a batch; rows are never updated"""
+    __tablename__ = 'mutasi_stok'
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    id_cabang = db.Column(db.Integer, nullable=False)
+    sku = db.Column(db.String(100), nullable=False)
+    batch_number = db.Column(db.String(50), nullable=False)
+    # Signed change, negative for sales
+    jumlah = db.Column(db.Integer, nullable=False)
+    stok_setelah = db.Column(db.Integer, nullable=False)
+    jenis = db.Column(db.String(20), nullable=False)
+    id_transaksi = db.Column(db.Integer)
+    id_opname = db.Column(db.Integer)
+    user_id = db.Column(db.Integer)
+    # Stamped by the database, like the movements written in SQL, so the
+    # whole ledger is on one clock
+    waktu = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.current_timestamp())
+
+class Reservasi(db.Model):
+    """Stock held by an open cart until kedaluwarsa (see reservations.py)"""
+    __tablename__ = 'reservasi_stok'
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    id_keranjang = db.Column(UUID, nullable=False)
+    id_cabang = db.Column(db.Integer, nullable=False)
+    sku = db.Column(db.String(100), nullable=False)
+    batch_number = db.Column(db.String(50), nullable=False)
+    jumlah = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer)
+    dibuat_pada = db.Column(db.DateTime(timezone=True), nullable=False, default=get_wib_time)
+    kedaluwarsa = db.Column(db.DateTime(timezone=True), nullable=False)
+
     __table_args__ = (
         db.ForeignKeyConstraint(
-            ['sku', 'batch_number'],
-            ['inventory.sku', 'inventory.batch_number']
+            ['id_cabang', 'sku', 'batch_number'],
+            ['inventory.id_cabang', 'inventory.sku', 'inventory.batch_number'],
+            ondelete='CASCADE'
         ),
-    )
\ No newline at end of file
+    )
+
+class StokOpname(db.Model):
+    """A stock take of one outlet (see stock_take.py)"""
+    __tablename__ = 'stok_opname'
+
+    id_opname = db.Column(db.Integer, primary_key=True)
+    id_cabang = db.Column(db.Integer, db.ForeignKey('cabang.id_cabang'), nullable=False)
+    # open, applied or cancelled
+    status = db.Column(db.String(20), nullable=False, default='open')
+    catatan = db.Column(db.Text)
+    user_id = db.Column(db.Integer)
+    dibuka_pada = db.Column(db.DateTime(timezone=True), nullable=False, default=get_wib_time)
+    ditutup_pada = db.Column(db.DateTime(timezone=True))
+
+class StokOpnameItem(db.Model):
+    """Counted quantity of a batch and its system stock when counted"""
+    __tablename__ = 'stok_opname_item'
+
+    id_opname = db.Column(db.Integer, db.ForeignKey('stok_opname.id_opname', ondelete='CASCADE'), primary_key=True)
+    sku = db.Column(db.String(100), primary_key=True)
+    batch_number = db.Column(db.String(50), primary_key=True)
+    jumlah_hitung = db.Column(db.Integer, nullable=False)
+    stok_sistem = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer)
+    dihitung_pada = db.Column(db.DateTime(timezone=True), nullable=False, default=get_wib_time)
+
+class SnapshotStok(db.Model):
+    __tablename__ = 'snapshot_stok'
+
+    waktu_snapshot = db.Column(db.DateTime(timezone=True), primary_key=True)
+    id_cabang = db.Column(db.Integer, primary_key=True)
+    sku = db.Column(db.String(100), primary_key=True)
+    batch_number = db.Column(db.String(50), primary_key=True)
+    stok = db.Column(db.Integer, nullable=False)
+
+class PenjualanHarian(db.Model):
+    """Sales per outlet and WIB day, maintained by a trigger on transaksi.
+
+    A day is spread over several counter rows (shards) so concurrent sales
+    do not queue on one row; always sum them.
+    """
+    __tablename__ = 'penjualan_harian'
+
+    id_cabang = db.Column(db.Integer, db.ForeignKey('cabang.id_cabang'), primary_key=True)
+    tanggal = db.Column(db.Date, primary_key=True)
+    shard = db.Column(db.SmallInteger, primary_key=True)
+    total_amount = db.Column(db.Float, nullable=False, default=0)
+    jumlah_transaksi = db.Column(db.Integer, nullable=False, default=0)
+
+class SaranPemesanan(db.Model):
+    """Forecast reorder point per outlet and SKU, written by maintenance.py forecast"""
+    __tablename__ = 'saran_pemesanan'
+
+    id_cabang = db.Column(db.Integer, db.ForeignKey('cabang.id_cabang'), primary_key=True)
+    sku = db.Column(db.String(100), primary_key=True)
+    rata_harian_7 = db.Column(db.Float, nullable=False)
+    rata_harian = db.Column(db.Float, nullable=False)
+    deviasi_harian = db.Column(db.Float, nullable=False)
+    permintaan_lead_time = db.Column(db.Float, nullable=False)
+    stok_pengaman = db.Column(db.Float, nullable=False)
+    titik_pemesanan = db.Column(db.Integer, nullable=False)
+    stok_tersedia = db.Column(db.Integer, nullable=False)
+    dihitung_pada = db.Column(db.DateTime(timezone=True), nullable=False, default=get_wib_time)
+
+class AuditLog(db.Model):
+    """Append-only trail of inventory and transaction changes (see audit.py)"""
+    __tablename__ = 'audit_log'
+
+    id = db.Column(db.BigInteger, primary_key=True)
+    waktu = db.Column(db.DateTime(timezone=True), nullable=False, default=get_wib_time)
+    user_id = db.Column(db.Integer)
+    id_cabang = db.Column(db.Integer)
+    entity = db.Column(db.String(20), nullable=False)
+    action = db.Column(db.String(20), nullable=False)
+    entity_key = db.Column(JSONB, nullable=False)
+    perubahan = db.Column(JSONB, nullable=False)
+    request_id = db.Column(db.String(64))
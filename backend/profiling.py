@@ -0,0 +1,221 @@
+# profiling.py
+"""On-demand profiling of single requests.
+
+An admin token can ask for a profile with the X-Profile: 1 header or the
+?_profile=1 flag, and PROFILE_SAMPLE_RATE profiles a share of all requests.
+A profile is a sampling of the request thread's stack plus the timeline of
+its SQL statements, stored under PROFILE_DIR as:
+
+    <id>.collapsed   folded stacks, input for flamegraph.pl or speedscope
+    <id>.json        request, timings and SQL timeline
+
+Requests that are not profiled pay one header/argument lookup, and their
+statements one dict lookup in the SQLAlchemy listeners: those are attached
+once for the process, the sampler thread only exists while a profile is
+running. Stack sampling needs OS threads (the default gthread workers);
+under gevent the sampler only runs when the request yields, so rely on the
+SQL timeline there.
+"""
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from utils import request_token_payload
+
+logger = logging.getLogger(__name__)
+
+# SQL statements are kept up to this length in the timeline
+MAX_STATEMENT_LENGTH = 2000
+
+# Running profiles by request thread id
+_active = {}
+
+
+class StackSampler(threading.Thread):
+    """Counts the folded stacks of one thread at a fixed interval"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class RequestProfile:
+    def __init__(self, interval):
+        self.id = f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.thread_id = threading.get_ident()
+        self.started = time.perf_counter()
+        self.sampler = StackSampler(self.thread_id, interval)
+        self.queries = []
+
+    def start(self):
+        self.sampler.start()
+
+    def query_started(self, statement):
+        self.queries.append({
+            'start_ms': round((time.perf_counter() - self.started) * 1000, 3),
+            'statement': statement[:MAX_STATEMENT_LENGTH]
+        })
+
+    def query_finished(self, rowcount):
+        query = self.queries[-1]
+        query['duration_ms'] = round((time.perf_counter() - self.started) * 1000 - query['start_ms'], 3)
+        query['rowcount'] = rowcount
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _active.get(threading.get_ident())
+    if profile is not None:
+        profile.query_started(statement)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _active.get(threading.get_ident())
+    if profile is not None and profile.queries:
+        profile.query_finished(cursor.rowcount)
+
+
+def _requested():
+    """Whether an admin asked for a profile of this request"""
+    if request.headers.get('X-Profile') == '1' or request.args.get('_profile') == '1':
+        payload = request_token_payload()
+        return bool(payload and payload.get('is_admin'))
+    return False
+
+
+def profile_path(directory, profile_id, suffix):
+    # Ids come from URLs, never let them leave the directory
+    if os.path.basename(profile_id) != profile_id or profile_id.startswith('.'):
+        raise ValueError('invalid profile id')
+    return os.path.join(directory, f'{profile_id}.{suffix}')
+
+
+def list_profiles(directory, limit=100):
+    """Metadata of the newest stored profiles"""
+    try:
+        names = sorted((n for n in os.listdir(directory) if n.endswith('.json')), reverse=True)
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in names[:limit]:
+        try:
+            with open(os.path.join(directory, name)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        meta.pop('sql', None)
+        profiles.append(meta)
+    return profiles
+
+
+def _prune(directory, keep):
+    names = sorted(n[:-5] for n in os.listdir(directory) if n.endswith('.json'))
+    for profile_id in names[:-keep] if keep else []:
+        for suffix in ('json', 'collapsed'):
+            try:
+                os.remove(os.path.join(directory, f'{profile_id}.{suffix}'))
+            except FileNotFoundError:
+                pass
+
+
+def _path_without_token():
+    args = [(key, value) for key, value in request.args.items(multi=True) if key != 'access_token']
+    return f'{request.path}?{urlencode(args)}' if args else request.path
+
+
+def _save(app, profile, status):
+    directory = app.config['PROFILE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    duration_ms = (time.perf_counter() - profile.started) * 1000
+
+    with open(profile_path(directory, profile.id, 'collapsed'), 'w') as f:
+        for stack, count in profile.sampler.stacks.most_common():
+            f.write(f'{stack} {count}\n')
+
+    meta = {
+        'id': profile.id,
+        'recorded_at': datetime.now(timezone.utc).isoformat(),
+        'method': request.method,
+        'path': _path_without_token(),
+        'endpoint': request.endpoint,
+        'status': status,
+        'duration_ms': round(duration_ms, 2),
+        'samples': sum(profile.sampler.stacks.values()),
+        'interval_ms': app.config['PROFILE_INTERVAL_MS'],
+        'sql_count': len(profile.queries),
+        'sql_ms': round(sum(q.get('duration_ms', 0) for q in profile.queries), 2),
+        'user_id': g.get('user_id'),
+        'request_id': g.get('request_id'),
+        'sql': profile.queries
+    }
+    with open(profile_path(directory, profile.id, 'json'), 'w') as f:
+        json.dump(meta, f, default=str)
+    _prune(directory, app.config['PROFILE_KEEP'])
+
+
+def init_profiling(app):
+    # Attached once: listening and removing per request would mutate the
+    # engine's listener list while other threads run statements
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_profile():
+        sample_rate = app.config['PROFILE_SAMPLE_RATE']
+        if not (_requested() or (sample_rate and random.random() < sample_rate)):
+            return
+        profile = RequestProfile(app.config['PROFILE_INTERVAL_MS'] / 1000)
+        _active[profile.thread_id] = profile
+        profile.start()
+        g.profile = profile
+
+    @app.after_request
+    def tag_profile(response):
+        profile = g.get('profile')
+        if profile is not None:
+            response.headers['X-Profile-Id'] = profile.id
+            g.profile_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_profile(exc):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        profile.sampler.stop()
+        _active.pop(profile.thread_id, None)
+        try:
+            _save(app, profile, g.pop('profile_status', None))
+        except OSError as e:
+            logger.error("Could not store profile %s: %s", profile.id, e)
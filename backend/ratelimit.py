@@ -0,0 +1,177 @@
+# ratelimit.py
+import logging
+import math
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+from flask import current_app, g, jsonify, request
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+metrics.describe('rate_limited_total', 'Requests rejected with 429 by admission control')
+
+_local = threading.local()
+
+
+def rate_class(name):
+    """Set the rate-limit class of a route.
+
+    `name` is a class from RATE_LIMITS, None to exempt the route, or a
+    function returning either, evaluated per request. Routes without it are
+    'read' for GET and 'write' otherwise.
+    """
+    def decorator(f):
+        f.rate_class = name
+        return f
+    return decorator
+
+
+class SharedLimiter:
+    """Token buckets and concurrency leases in a SQLite file.
+
+    Every gunicorn worker on the host opens the same file (on tmpfs by
+    default), so the limits hold for the host rather than per worker.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _connection(self):
+        conn = getattr(_local, 'conn', None)
+        if conn is None or _local.path != self.path:
+            if conn is not None:
+                conn.close()
+            conn = sqlite3.connect(self.path, timeout=0.2, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS leases (id TEXT PRIMARY KEY, route_class TEXT, expires REAL)'
+            )
+            _local.conn, _local.path = conn, self.path
+        return conn
+
+    def take(self, key, capacity, per_second):
+        """Take one token; return 0 if allowed, else seconds until one is free"""
+        conn = self._connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * per_second)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / per_second
+            conn.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)', (key, tokens, now))
+            if random.random() < 0.001:
+                # Idle buckets are full again, dropping them changes nothing
+                conn.execute('DELETE FROM buckets WHERE updated < ?', (now - 3600,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+    def acquire(self, route_class, limit, lease_seconds):
+        """Take a concurrency slot; return its id, or None when all are busy.
+
+        Slots expire after lease_seconds so a killed worker cannot leak them.
+        """
+        conn = self._connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM leases WHERE expires < ?', (now,))
+            in_flight = conn.execute(
+                'SELECT count(*) FROM leases WHERE route_class = ?', (route_class,)
+            ).fetchone()[0]
+            lease_id = None
+            if in_flight < limit:
+                lease_id = uuid.uuid4().hex
+                conn.execute('INSERT INTO leases (id, route_class, expires) VALUES (?, ?, ?)',
+                             (lease_id, route_class, now + lease_seconds))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return lease_id
+
+    def release(self, lease_id):
+        self._connection().execute('DELETE FROM leases WHERE id = ?', (lease_id,))
+
+
+def request_rate_class():
+    """Rate-limit class of the current request, None if it is exempt"""
+    if request.method == 'OPTIONS':
+        return None
+    view = current_app.view_functions.get(request.endpoint)
+    if view is None:
+        return None
+    name = getattr(view, 'rate_class', 'read' if request.method in ('GET', 'HEAD') else 'write')
+    return name() if callable(name) else name
+
+
+def _client_identity():
+    """User id from a valid token of the request, else the client address"""
+    # utils needs the app's models, which import app, which imports this
+    from utils import request_token_payload
+
+    payload = request_token_payload()
+    if payload:
+        return f"user:{payload.get('user_id')}"
+    # Set from X-Forwarded-For by ProxyFix, counting only trusted proxies'
+    # entries; the client-supplied ones would let it pick its own bucket
+    return f'ip:{request.remote_addr}'
+
+
+def _too_many(route_class, reason, retry_after):
+    metrics.increment('rate_limited_total', route_class=route_class, reason=reason)
+    response = jsonify({'message': 'Too many requests, please retry later'})
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response, 429
+
+
+def init_rate_limiting(app):
+    @app.before_request
+    def admit_request():
+        if not app.config['RATE_LIMIT_ENABLED']:
+            return None
+        route_class = request_rate_class()
+        limit = app.config['RATE_LIMITS'].get(route_class) if route_class else None
+        if not limit:
+            return None
+
+        limiter = SharedLimiter(app.config['RATE_LIMIT_STORE'])
+        try:
+            wait = limiter.take(f'{route_class}:{_client_identity()}', limit['burst'], limit['per_second'])
+            if wait > 0:
+                return _too_many(route_class, 'rate', wait)
+
+            concurrency = app.config['RATE_LIMIT_CONCURRENCY'].get(route_class)
+            if concurrency:
+                lease_id = limiter.acquire(route_class, concurrency, app.config['RATE_LIMIT_LEASE_SECONDS'])
+                if lease_id is None:
+                    return _too_many(route_class, 'concurrency', 1)
+                g.rate_limit_lease = lease_id
+        except sqlite3.Error as e:
+            # Admission control must never take the API down with it
+            logger.warning("Rate limiter unavailable, admitting request: %s", e)
+        return None
+
+    @app.teardown_request
+    def release_lease(exc):
+        lease_id = g.pop('rate_limit_lease', None)
+        if lease_id:
+            try:
+                SharedLimiter(app.config['RATE_LIMIT_STORE']).release(lease_id)
+            except sqlite3.Error as e:
+                logger.warning("Could not release concurrency slot: %s", e)
@@ -0,0 +1,145 @@
+# reservations.py
+"""Short-lived stock holds for open carts.
+
+A cart (a client-generated UUID) holds quantities per batch while it is
+open; each hold expires RESERVATION_TTL_SECONDS after the cart was last
+touched. Sellable stock is stok_tersedia minus the active holds of other
+carts, so the sale that checks a cart out finds its quantities still
+there and converts the holds instead of racing other counters for them.
+
+Expired holds are never counted; maintenance.py sweep-reservations
+deletes them in bulk.
+"""
+from sqlalchemy import and_, text, tuple_
+
+from app import db
+from models import Reservasi
+
+
+def lock_batch(branch, sku, batch_number):
+    """Lock a batch against concurrent holds and sales; its stok_tersedia, or None.
+
+    Must run as its own statement: a statement that waits for the lock keeps
+    the snapshot it started with and would miss the holds committed meanwhile.
+    """
+    return db.session.execute(text("""
+        SELECT stok_tersedia FROM inventory
+        WHERE id_cabang = :id_cabang AND sku = :sku AND batch_number = :batch_number
+        FOR NO KEY UPDATE
+    """), {'id_cabang': branch, 'sku': sku, 'batch_number': batch_number}).scalar()
+
+
+def hold(cart_id, branch, sku, batch_number, jumlah, user_id, expires):
+    """Set the cart's hold on a locked batch to `jumlah` if enough stock is free.
+
+    Every other line of the cart is extended to `expires` as well. Returns
+    the row (held_by_others, jumlah, kedaluwarsa); jumlah is None when the
+    stock free of other carts' holds is short.
+    """
+    return db.session.execute(text("""
+        WITH held AS (
+            SELECT COALESCE(SUM(jumlah), 0) AS jumlah
+            FROM reservasi_stok
+            WHERE id_cabang = :id_cabang AND sku = :sku AND batch_number = :batch_number
+              AND kedaluwarsa > CURRENT_TIMESTAMP AND id_keranjang <> CAST(:cart AS uuid)
+        ), line AS (
+            INSERT INTO reservasi_stok (id_keranjang, id_cabang, sku, batch_number, jumlah, user_id, kedaluwarsa)
+            SELECT CAST(:cart AS uuid), :id_cabang, :sku, :batch_number, :jumlah, :user_id, :kedaluwarsa
+            FROM held, inventory i
+            WHERE i.id_cabang = :id_cabang AND i.sku = :sku AND i.batch_number = :batch_number
+              AND i.stok_tersedia - held.jumlah >= :jumlah
+            ON CONFLICT (id_keranjang, id_cabang, sku, batch_number) DO UPDATE
+                SET jumlah = EXCLUDED.jumlah, kedaluwarsa = EXCLUDED.kedaluwarsa
+                WHERE reservasi_stok.user_id IS NOT DISTINCT FROM EXCLUDED.user_id
+            RETURNING jumlah, kedaluwarsa
+        ), touch AS (
+            UPDATE reservasi_stok SET kedaluwarsa = :kedaluwarsa
+            WHERE id_keranjang = CAST(:cart AS uuid) AND user_id IS NOT DISTINCT FROM :user_id
+              AND kedaluwarsa > CURRENT_TIMESTAMP
+              AND NOT (id_cabang = :id_cabang AND sku = :sku AND batch_number = :batch_number)
+        )
+        SELECT held.jumlah AS held_by_others, line.jumlah, line.kedaluwarsa
+        FROM held LEFT JOIN line ON TRUE
+    """), {
+        'cart': cart_id, 'id_cabang': branch, 'sku': sku, 'batch_number': batch_number,
+        'jumlah': jumlah, 'user_id': user_id, 'kedaluwarsa': expires
+    }).first()
+
+
+def release_line(cart_id, branch, sku, batch_number, user_id):
+    """Drop one hold of the cart; whether there was one"""
+    return db.session.query(Reservasi).filter(
+        Reservasi.id_keranjang == cart_id,
+        Reservasi.id_cabang == branch,
+        Reservasi.sku == sku,
+        Reservasi.batch_number == batch_number,
+        Reservasi.user_id == user_id
+    ).delete(synchronize_session=False) > 0
+
+
+def release(cart_id, user_id):
+    """Drop every hold of the cart, e.g. at checkout; the number dropped"""
+    return db.session.query(Reservasi).filter(
+        Reservasi.id_keranjang == cart_id,
+        Reservasi.user_id == user_id
+    ).delete(synchronize_session=False)
+
+
+def cart_lines(cart_id, user_id):
+    """Active holds of the cart with the name and price of each batch"""
+    return db.session.execute(text("""
+        SELECT r.id_cabang, r.sku, r.batch_number, r.jumlah, r.kedaluwarsa, p.nama_item, p.harga
+        FROM reservasi_stok r
+        JOIN produk p USING (id_cabang, sku)
+        WHERE r.id_keranjang = CAST(:cart AS uuid) AND r.user_id IS NOT DISTINCT FROM :user_id
+          AND r.kedaluwarsa > CURRENT_TIMESTAMP
+        ORDER BY r.id
+    """), {'cart': cart_id, 'user_id': user_id}).all()
+
+
+def held_by_others(cart_id, user_id):
+    """Whether another user holds stock under the cart id"""
+    return db.session.query(db.session.query(Reservasi).filter(
+        Reservasi.id_keranjang == cart_id,
+        Reservasi.user_id.is_distinct_from(user_id)
+    ).exists()).scalar()
+
+
+def held_quantities(branch, keys, exclude_cart=None, user_id=None):
+    """{(sku, batch_number): quantity} held by active holds of other carts.
+
+    Holds of exclude_cart count as the buyer's own only if user_id placed
+    them. Run after the batches are locked so holds committed while waiting
+    for the locks are counted.
+    """
+    if not keys:
+        return {}
+    query = db.session.query(
+        Reservasi.sku,
+        Reservasi.batch_number,
+        db.func.sum(Reservasi.jumlah)
+    ).filter(
+        Reservasi.id_cabang == branch,
+        tuple_(Reservasi.sku, Reservasi.batch_number).in_(list(keys)),
+        Reservasi.kedaluwarsa > db.func.current_timestamp()
+    )
+    if exclude_cart:
+        query = query.filter(~and_(Reservasi.id_keranjang == exclude_cart,
+                                   Reservasi.user_id.is_not_distinct_from(user_id)))
+    rows = query.group_by(Reservasi.sku, Reservasi.batch_number).all()
+    return {(sku, batch_number): int(quantity) for sku, batch_number, quantity in rows}
+
+
+def reserved_by_batch(branch=None):
+    """{(id_cabang, sku, batch_number): quantity} of every active hold, for reads"""
+    query = db.session.query(
+        Reservasi.id_cabang,
+        Reservasi.sku,
+        Reservasi.batch_number,
+        db.func.sum(Reservasi.jumlah)
+    ).filter(Reservasi.kedaluwarsa > db.func.current_timestamp())
+    if branch:
+        query = query.filter(Reservasi.id_cabang == branch)
+    rows = query.group_by(Reservasi.id_cabang, Reservasi.sku, Reservasi.batch_number).all()
+    return {(id_cabang, sku, batch_number): int(quantity) for id_cabang, sku, batch_number, quantity in rows}
+
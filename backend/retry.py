@@ -0,0 +1,78 @@
+# retry.py
+import logging
+import random
+import time
+from functools import wraps
+
+from flask import current_app, jsonify, request
+from sqlalchemy.exc import DBAPIError
+
+import metrics
+from app import db
+
+logger = logging.getLogger(__name__)
+
+# SQLSTATEs after which replaying the whole transaction can succeed
+RETRYABLE_SQLSTATES = {
+    '40P01': 'deadlock',
+    '40001': 'serialization_failure',
+    '55P03': 'lock_timeout',
+}
+
+metrics.describe('db_transaction_retries_total', 'Transactions replayed after a conflict')
+metrics.describe('db_transaction_retries_exhausted_total', 'Transactions that still conflicted on the last attempt')
+
+
+def retry_reason(e):
+    """Name of the retryable conflict behind e, or None"""
+    if isinstance(e, DBAPIError):
+        return RETRYABLE_SQLSTATES.get(getattr(e.orig, 'pgcode', None))
+    return None
+
+
+def is_retryable(e):
+    return retry_reason(e) is not None
+
+
+def backoff_delay(attempt, base, cap):
+    """Full-jitter exponential backoff, in seconds"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def retry_transaction(f):
+    """Replay a route's unit of work when Postgres aborts it on a conflict.
+
+    The route must let retryable errors propagate (see is_retryable) and do
+    all its work inside the transaction, so a replay starts from scratch.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        max_attempts = current_app.config['DB_RETRY_MAX_ATTEMPTS']
+        base = current_app.config['DB_RETRY_BASE_DELAY_MS'] / 1000
+        cap = current_app.config['DB_RETRY_MAX_DELAY_MS'] / 1000
+
+        attempt = 1
+        while True:
+            try:
+                return f(*args, **kwargs)
+            except DBAPIError as e:
+                reason = retry_reason(e)
+                if reason is None:
+                    raise
+                db.session.rollback()
+
+                if attempt >= max_attempts:
+                    metrics.increment('db_transaction_retries_exhausted_total',
+                                      endpoint=request.endpoint, reason=reason)
+                    logger.warning("Giving up on %s after %d attempts: %s", request.endpoint, attempt, reason,
+                                   extra={'retry_reason': reason, 'attempts': attempt})
+                    response = jsonify({'message': 'Conflicting update in progress, please retry'})
+                    response.headers['Retry-After'] = '1'
+                    return response, 409
+
+                metrics.increment('db_transaction_retries_total', endpoint=request.endpoint, reason=reason)
+                logger.info("Retrying %s after %s (attempt %d)", request.endpoint, reason, attempt,
+                            extra={'retry_reason': reason, 'attempts': attempt})
+                time.sleep(backoff_delay(attempt, base, cap))
+                attempt += 1
+    return decorated
@@ -1,12 +1,40 @@
 # routes.py
-from flask import Blueprint, jsonify, request
-from models import User, Inventory, Transaksi, TransaksiDetail
+from flask import Blueprint, Response, current_app, g, jsonify, request, send_file
+from models import User, AuditLog, Cabang, Inventory, StokOpname, Transaksi, TransaksiDetail
 from app import db
-from utils import token_required, create_token, calculate_monthly_sales
+from utils import (
+    token_required, stream_token_required, admin_required, create_token, create_stream_token,
+    calculate_monthly_sales, parse_date_range,
+    parse_point_in_time, inventory_query, transactions_query, low_stock_query,
+    branch_scope, target_branch, inventory_to_dict, transaction_to_dict,
+    reorder_query, reorder_to_dict
+)
 from state import blacklisted_tokens
+from compression import compress
+from ratelimit import rate_class
+from budget import Overloaded, latency_budget
+from events import StreamLimitReached, broker, format_sse, publish, publish_stock_changes, track_stock_change, visible_to
+from ledger import movement_history, record_movement, stock_at
+from inventory_writes import delete_batch, insert_batch, previous_state, update_batch
+from reservations import cart_lines, held_by_others, held_quantities, hold, lock_batch, release, release_line, reserved_by_batch
+from stock_take import apply_session, cancel_session, lock_session, open_session, record_counts, uncounted_batches, variance_lines
+import audit
+from retry import is_retryable, retry_transaction
+from dashboard import build_summary, summary_flight
+from facets import facet_cache
+from profiling import list_profiles, profile_path
+from slowlog import ORDERS as SLOW_QUERY_ORDERS, query_detail, query_stats, top_queries
+from analytics_export import ExportRunning, export_job
+from sync import CursorExpired, changes_since, current_cursor, load_inventory, load_transactions
+import metrics
 from sqlalchemy import extract, text
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+import hmac
 import logging
+import os
+import queue
+import time
+import uuid
 
 # Configure logger
 logger = logging.getLogger(__name__)
@@ -16,31 +44,31 @@ main = Blueprint('main', __name__)
 
 # 1. Login endpoint
 @main.route('/login', methods=['POST'])
+@rate_class('login')
 def login():
     data = request.json
     username = data.get('username')
     password = data.get('password')
     
-    # Detailed logging
-    logger.info(f"Login attempt - Username: {username}")
-    
     try:
         # Find the user
         user = User.query.filter_by(username=username).first()
         
         if not user:
-            logger.warning(f"User not found: {username}")
+            logger.warning("Login failed: unknown user")
             return jsonify({'message': 'Invalid credentials'}), 401
         
         # Check password
         if user.check_password(password):
-            token = create_token(user.id)
+            token = create_token(user.id, user.id_cabang, user.is_admin)
             return jsonify({'token': token}), 200
         
         return jsonify({'message': 'Invalid credentials'}), 401
         
+    except Overloaded:
+        raise
     except Exception as e:
-        logger.error(f"Login error: {str(e)}")
+        logger.error("Login error: %s", e)
         return jsonify({'message': 'Login failed', 'error': str(e)}), 500
 
 # 2. Logout endpoint
@@ -54,121 +82,181 @@ def logout():
 # 3. Get stock levels
 @main.route('/inventory', methods=['GET'])
 @token_required
+@compress(gzip=6, br=5)
 def get_inventory():
-    # Get optional query parameters for filtering
-    category = request.args.get('category')
+    # Get optional query parameters for filtering; repeat category to match any of several
+    categories = [category for category in request.args.getlist('category') if category]
     search = request.args.get('search')
     
-    query = Inventory.query
-    
-    # Apply filters if provided
-    if category:
-        query = query.filter(Inventory.kategori == category)
-    if search:
-        search_term = f"%{search}%"
-        query = query.filter(
-            db.or_(
-                Inventory.nama_item.ilike(search_term),
-                Inventory.sku.ilike(search_term)
-            )
-        )
-    
-    inventory_items = query.all()
+    branch = branch_scope()
+    inventory_items = inventory_query(categories, search, branch).all()
+    reserved = reserved_by_batch(branch)
     
-    return jsonify([{
-        'sku': item.sku,
-        'batch_number': item.batch_number,
-        'nama_item': item.nama_item,
-        'kategori': item.kategori,
-        'stok_tersedia': item.stok_tersedia,
-        'stok_minimum': item.stok_minimum,
-        'harga': item.harga,
-        'waktu_pembaruan': item.waktu_pembaruan.isoformat() if item.waktu_pembaruan else None
-    } for item in inventory_items]), 200
+    return jsonify([
+        inventory_to_dict(item, reserved.get((item.id_cabang, item.sku, item.batch_number), 0))
+        for item in inventory_items
+    ]), 200
+
+# Categories with batch/SKU counts and stock totals, for filter UIs
+@main.route('/inventory/facets', methods=['GET'])
+@token_required
+def get_inventory_facets():
+    facets, _ = facet_cache.get(branch_scope(), current_app.config['FACETS_CACHE_SECONDS'])
+    return jsonify(facets), 200
 
 # 4. Get low stock products
 @main.route('/inventory/low-stock', methods=['GET'])
 @token_required
 def get_low_stock():
-    # Use SQLAlchemy's func for aggregation
-    from sqlalchemy import func
-    
     # Query that aggregates stock levels by SKU
-    low_stock_items = db.session.query(
-        Inventory.sku,
-        # These values are consistent per SKU, so min/max will give the same result
-        func.min(Inventory.nama_item).label('nama_item'),
-        func.min(Inventory.stok_minimum).label('stok_minimum'),
-        # Sum up all available stock across batches
-        func.sum(Inventory.stok_tersedia).label('total_stock')
-    ).group_by(
-        Inventory.sku
-    ).having(
-        # Compare total stock against minimum stock level
-        func.sum(Inventory.stok_tersedia) < func.min(Inventory.stok_minimum)
-    ).all()
+    low_stock_items = low_stock_query(branch_scope()).all()
     
     # Format response
     return jsonify([{
+        'id_cabang': item.id_cabang,
         'sku': item.sku,
         'nama_item': item.nama_item,
         'stok_tersedia': item.total_stock,
         'stok_minimum': item.stok_minimum,
     } for item in low_stock_items]), 200
 
+# Forecast reorder points (maintenance.py forecast); ?all=1 includes SKUs not yet due
+@main.route('/inventory/reorder-suggestions', methods=['GET'])
+@token_required
+def get_reorder_suggestions():
+    due_only = request.args.get('all') not in ('1', 'true')
+    rows = reorder_query(branch_scope(), due_only).all()
+    return jsonify([reorder_to_dict(row) for row in rows]), 200
+
 # 5. Update inventory
 @main.route('/inventory/<sku>/<batch_number>', methods=['PUT'])
 @token_required
 def update_inventory(sku, batch_number):
     data = request.json
+    branch = target_branch(data)
+    if branch is None:
+        return jsonify({'message': 'id_cabang is required'}), 400
     try:
-        inventory = Inventory.query.filter_by(
-            sku=sku,
-            batch_number=batch_number
-        ).first()
-        
+        inventory = update_batch(branch, sku, batch_number, data)
         if not inventory:
             return jsonify({
                 'message': 'Item not found'
             }), 404
         
-        sku_consistent_fields = {'nama_item', 'kategori', 'stok_minimum', 'harga'}
-        batch_specific_fields = {'stok_tersedia'}
-        
-        if any(field in data for field in sku_consistent_fields):
-            update_data = {k: v for k, v in data.items() if k in sku_consistent_fields}
-            if update_data:
-                Inventory.query.filter(
-                    Inventory.sku == sku
-                ).update(update_data)
-        
-        batch_updates = {k: v for k, v in data.items() if k in batch_specific_fields}
-        if batch_updates:
-            for key, value in batch_updates.items():
-                setattr(inventory, key, value)
+        stock_changes = {}
+        delta = (inventory.stok_tersedia or 0) - (inventory.old_stok_tersedia or 0)
+        if 'stok_tersedia' in data:
+            track_stock_change(stock_changes, inventory, delta)
         
+        audit.record('inventory', 'updated', {'sku': sku, 'batch_number': batch_number},
+                     previous_state(inventory), audit.inventory_state(inventory), branch)
+        publish('inventory', {'action': 'updated', 'id_cabang': branch, 'sku': sku, 'batch_number': batch_number})
+        publish_stock_changes(stock_changes)
         db.session.commit()
-        db.session.refresh(inventory)
         
         return jsonify({
             'message': 'Inventory updated successfully',
-            'inventory': {
-                'sku': inventory.sku,
-                'batch_number': inventory.batch_number,
-                'nama_item': inventory.nama_item,
-                'kategori': inventory.kategori,
-                'stok_tersedia': inventory.stok_tersedia,
-                'stok_minimum': inventory.stok_minimum,
-                'harga': inventory.harga,
-                'waktu_pembaruan': inventory.waktu_pembaruan.isoformat()
-            }
+            'inventory': inventory_to_dict(inventory)
         }), 200
             
+    except Overloaded:
+        raise
     except Exception as e:
         db.session.rollback()
-        logger.error(f"Error updating inventory: {str(e)}")
+        logger.error("Error updating inventory: %s", e)
         return jsonify({'error': str(e)}), 400
     
+# Stock per batch at a point in time
+@main.route('/inventory/stock-at', methods=['GET'])
+@token_required
+def get_stock_at():
+    if not request.args.get('at'):
+        return jsonify({'message': 'Query parameter "at" is required (YYYY-MM-DD or ISO datetime)'}), 400
+    try:
+        at = parse_point_in_time(request.args['at'])
+    except ValueError:
+        return jsonify({'message': 'Invalid "at", use YYYY-MM-DD or an ISO datetime'}), 400
+
+    rows = stock_at(at, request.args.get('sku'), request.args.get('batch_number'), branch_scope())
+    return jsonify({
+        'at': at.isoformat(),
+        'items': [{
+            'id_cabang': row.id_cabang,
+            'sku': row.sku,
+            'batch_number': row.batch_number,
+            'stok': int(row.stok)
+        } for row in rows]
+    }), 200
+
+# Stock movements of one batch
+@main.route('/inventory/<sku>/<batch_number>/movements', methods=['GET'])
+@token_required
+def get_stock_movements(sku, batch_number):
+    branch = target_branch()
+    if branch is None:
+        return jsonify({'message': 'branch is required'}), 400
+    try:
+        start, end = parse_date_range(request.args.get('start_date'), request.args.get('end_date'))
+    except ValueError:
+        return jsonify({'message': 'Dates must be YYYY-MM-DD'}), 400
+    limit = min(request.args.get('limit', 200, type=int), 1000)
+
+    movements = movement_history(branch, sku, batch_number, start, end, limit)
+    return jsonify([{
+        'id': m.id,
+        'jumlah': m.jumlah,
+        'stok_setelah': m.stok_setelah,
+        'jenis': m.jenis,
+        'id_transaksi': m.id_transaksi,
+        'id_opname': m.id_opname,
+        'user_id': m.user_id,
+        'waktu': m.waktu.isoformat()
+    } for m in movements]), 200
+
+# Audit trail: who changed a batch or a sale, newest first
+@main.route('/audit', methods=['GET'])
+@token_required
+@admin_required
+def get_audit_log():
+    try:
+        start, end = parse_date_range(request.args.get('start_date'), request.args.get('end_date'))
+    except ValueError:
+        return jsonify({'message': 'Dates must be YYYY-MM-DD'}), 400
+    limit = min(request.args.get('limit', 200, type=int), 1000)
+
+    query = AuditLog.query
+    branch = branch_scope()
+    if branch:
+        query = query.filter(AuditLog.id_cabang == branch)
+    if request.args.get('id_transaksi'):
+        query = query.filter(
+            AuditLog.entity == 'transaksi',
+            AuditLog.entity_key['id_transaksi'].astext.cast(db.Integer) == request.args.get('id_transaksi', type=int)
+        )
+    elif request.args.get('sku'):
+        query = query.filter(AuditLog.entity == 'inventory', AuditLog.entity_key['sku'].astext == request.args['sku'])
+    elif request.args.get('entity'):
+        query = query.filter(AuditLog.entity == request.args['entity'])
+    if request.args.get('user_id'):
+        query = query.filter(AuditLog.user_id == request.args.get('user_id', type=int))
+    if start:
+        query = query.filter(AuditLog.waktu >= start)
+    if end:
+        query = query.filter(AuditLog.waktu < end)
+
+    entries = query.order_by(AuditLog.waktu.desc(), AuditLog.id.desc()).limit(limit).all()
+    return jsonify([{
+        'id': e.id,
+        'waktu': e.waktu.isoformat(),
+        'user_id': e.user_id,
+        'id_cabang': e.id_cabang,
+        'entity': e.entity,
+        'action': e.action,
+        'key': e.entity_key,
+        'changes': e.perubahan,
+        'request_id': e.request_id
+    } for e in entries]), 200
+
 # 7. Get monthly sales
 @main.route('/transactions/monthly-sales', methods=['GET'])
 @token_required
@@ -176,15 +264,42 @@ def get_monthly_sales():
     year = request.args.get('year', datetime.now().year, type=int)
     month = request.args.get('month', datetime.now().month, type=int)
     
-    total_sales = calculate_monthly_sales(year, month)
+    total_sales = calculate_monthly_sales(year, month, branch_scope())
     return jsonify({
         'year': year,
         'month': month,
         'total_sales': total_sales
     }), 200
     
+# Everything the dashboard shows, in one request
+@main.route('/dashboard/summary', methods=['GET'])
+@token_required
+def get_dashboard_summary():
+    months = request.args.get('months', 12, type=int)
+    if not 1 <= months <= 36:
+        return jsonify({'message': 'months must be between 1 and 36'}), 400
+
+    branch = branch_scope()
+    # A burst of dashboards opening at once runs the aggregates only once
+    summary, shared = summary_flight.do(('summary', months, branch), lambda: build_summary(months, branch))
+    if shared:
+        metrics.increment('dashboard_summary_coalesced_total')
+    return jsonify(summary), 200
+
+# Outlets
+@main.route('/branches', methods=['GET'])
+@token_required
+def get_branches():
+    branches = Cabang.query.order_by(Cabang.id_cabang).all()
+    return jsonify([{
+        'id_cabang': branch.id_cabang,
+        'kode': branch.kode,
+        'nama': branch.nama
+    } for branch in branches]), 200
+
 # 8. Check database connection health
 @main.route('/health')
+@rate_class(None)
 def health_check():
     try:
         # Test database connection
@@ -200,6 +315,19 @@ def health_check():
             'error': str(e)
         }), 500
 
+# Counters of this worker in Prometheus format, for the scraper only
+@main.route('/metrics')
+@rate_class(None)
+@compress(enabled=False)
+def get_metrics():
+    secret = current_app.config['METRICS_TOKEN']
+    if not secret:
+        return jsonify({'message': 'Not found'}), 404
+    supplied = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(supplied.encode(), f'Bearer {secret}'.encode()):
+        return jsonify({'message': 'Invalid metrics token'}), 401
+    return Response(metrics.render_prometheus(), mimetype='text/plain')
+
 # Create new inventory
 @main.route('/inventory', methods=['POST'])
 @token_required
@@ -212,127 +340,115 @@ def create_inventory():
             'message': 'Missing required fields',
             'required_fields': list(required_fields)
         }), 400
+    
+    branch = target_branch(data)
+    if branch is None:
+        return jsonify({'message': 'id_cabang is required'}), 400
         
     try:
-        existing_sku = Inventory.query.filter_by(sku=data['sku']).first()
-        
-        if existing_sku:
-            data['nama_item'] = existing_sku.nama_item
-            data['kategori'] = existing_sku.kategori
-            data['stok_minimum'] = existing_sku.stok_minimum
-            data['harga'] = existing_sku.harga
-        
-        existing_inventory = Inventory.query.filter_by(
-            sku=data['sku'],
-            batch_number=data['batch_number']
-        ).first()
-        
-        if existing_inventory:
+        new_inventory = insert_batch(branch, data)
+        if not new_inventory:
             return jsonify({
                 'message': 'Inventory already exists'
             }), 409
         
-        new_inventory = Inventory(**data)
-        db.session.add(new_inventory)
+        stock_changes = {}
+        track_stock_change(stock_changes, new_inventory, new_inventory.stok_tersedia or 0)
+        audit.record('inventory', 'created', {'sku': new_inventory.sku, 'batch_number': new_inventory.batch_number},
+                     None, audit.inventory_state(new_inventory), branch)
+        publish('inventory', {'action': 'created', 'id_cabang': branch, 'sku': new_inventory.sku, 'batch_number': new_inventory.batch_number})
+        publish_stock_changes(stock_changes)
         db.session.commit()
         
         return jsonify({
             'message': 'Inventory created successfully',
-            'inventory': {
-                'sku': new_inventory.sku,
-                'batch_number': new_inventory.batch_number,
-                'nama_item': new_inventory.nama_item,
-                'kategori': new_inventory.kategori,
-                'stok_tersedia': new_inventory.stok_tersedia,
-                'stok_minimum': new_inventory.stok_minimum,
-                'harga': new_inventory.harga,
-                'waktu_pembaruan': new_inventory.waktu_pembaruan.isoformat()
-            }
+            'inventory': inventory_to_dict(new_inventory)
         }), 201
             
+    except Overloaded:
+        raise
     except Exception as e:
         db.session.rollback()
-        logger.error(f"Error creating inventory: {str(e)}")
+        logger.error("Error creating inventory: %s", e)
         return jsonify({'error': str(e)}), 400
 
 # Delete inventory
 @main.route('/inventory/<sku>/<batch_number>', methods=['DELETE'])
 @token_required
 def delete_inventory(sku, batch_number):
+    branch = target_branch()
+    if branch is None:
+        return jsonify({'message': 'branch is required'}), 400
     try:
-        # Check for existing transactions in TransaksiDetail instead of Transaksi
-        existing_transactions = TransaksiDetail.query.filter_by(
-            sku=sku,
-            batch_number=batch_number
-        ).first()
-        
-        if existing_transactions:
-            return jsonify({
-                'message': 'Cannot delete inventory with existing transactions',
-                'details': 'Delete operation rejected due to referential integrity'
-            }), 409
-            
-        # Find and delete inventory
-        inventory = Inventory.query.filter_by(
-            sku=sku,
-            batch_number=batch_number
-        ).first()
-        
-        if not inventory:
+        found, inventory = delete_batch(branch, sku, batch_number)
+        if not found:
             return jsonify({
                 'message': 'Item not found',
                 'details': f'No inventory found with SKU {sku} and batch number {batch_number}'
             }), 404
+        if not inventory:
+            db.session.rollback()
+            return jsonify({
+                'message': 'Cannot delete inventory with existing transactions',
+                'details': 'Delete operation rejected due to referential integrity'
+            }), 409
             
-        db.session.delete(inventory)
+        stock_changes = {(branch, sku, batch_number): (0, -(inventory.stok_tersedia or 0))}
+        audit.record('inventory', 'deleted', {'sku': sku, 'batch_number': batch_number},
+                     audit.inventory_state(inventory), None, branch)
+        publish('inventory', {'action': 'deleted', 'id_cabang': branch, 'sku': sku, 'batch_number': batch_number})
+        publish_stock_changes(stock_changes)
         db.session.commit()
         
         return jsonify({
             'message': 'Inventory deleted successfully',
             'deleted_item': {
+                'id_cabang': branch,
                 'sku': sku,
                 'batch_number': batch_number,
                 'nama_item': inventory.nama_item
             }
         }), 200
         
+    except Overloaded:
+        raise
     except Exception as e:
         db.session.rollback()
-        logger.error(f"Error deleting inventory: {str(e)}")
+        logger.error("Error deleting inventory: %s", e)
         return jsonify({'error': str(e)}), 400
 
-# Get all transactions
+def _transactions_rate_class():
+    """Without a date range the whole history is fetched"""
+    if request.args.get('start_date') or request.args.get('end_date'):
+        return 'read'
+    return 'export'
+
 # Get all transactions
 @main.route('/transactions', methods=['GET'])
 @token_required
+@rate_class(_transactions_rate_class)
+# Largest payload on the slowest links, worth the extra CPU
+@compress(gzip=7, br=6, zstd=6)
 def get_transactions():
     try:
+        # Optional WIB date range (YYYY-MM-DD, inclusive); only the matching
+        # monthly partitions are scanned
+        start, end = parse_date_range(request.args.get('start_date'), request.args.get('end_date'))
+        
         # Join with Inventory to get nama_item
-        transactions = db.session.query(Transaksi).all()
+        transactions = transactions_query(start, end, branch_scope()).all()
         
-        return jsonify([{
-            'id_transaksi': t.id_transaksi,
-            'total_amount': t.total_amount,
-            'waktu_transaksi': t.waktu_transaksi.isoformat() if t.waktu_transaksi else None,
-            'items': [{
-                'sku': detail.sku,
-                'batch_number': detail.batch_number,
-                'nama_item': Inventory.query.filter_by(
-                    sku=detail.sku,
-                    batch_number=detail.batch_number
-                ).first().nama_item,
-                'jumlah': detail.jumlah,
-                'harga_satuan': detail.harga_satuan,
-                'subtotal': detail.subtotal
-            } for detail in t.details]
-        } for t in transactions]), 200
+        return jsonify([transaction_to_dict(t) for t in transactions]), 200
+    except Overloaded:
+        raise
     except Exception as e:
-        logger.error(f"Error fetching transactions: {str(e)}")
+        logger.error("Error fetching transactions: %s", e)
         return jsonify({'error': str(e)}), 400
 
 # Add new transactions
 @main.route('/transactions', methods=['POST'])
 @token_required
+@retry_transaction
 def create_transaction():
     data = request.json
     if not isinstance(data.get('items'), list) or not data['items']:
@@ -340,31 +456,54 @@ def create_transaction():
             'message': 'At least one item is required',
             'required_fields': ['items[].sku', 'items[].batch_number', 'items[].jumlah']
         }), 400
+    branch = target_branch(data)
+    if branch is None:
+        return jsonify({'message': 'id_cabang is required'}), 400
+    # Checking out a cart converts its stock holds into the sale
+    cart_id = data.get('id_keranjang')
+    if cart_id is not None and not _valid_cart_id(cart_id):
+        return jsonify({'message': 'Invalid id_keranjang'}), 400
     
     try:
         # Initialize variables outside the transaction block
         total_amount = 0
         transaction_details = []
+        stock_changes = {}
+        movements = []
         
         # Start transaction
         with db.session.begin():
-            # Process each item
+            # Another user's cart id must not unlock that user's holds
+            if cart_id is not None and held_by_others(cart_id, g.user_id):
+                return jsonify({'message': 'Cart not found'}), 404
+            # Lock every batch first, in a fixed order so concurrent baskets
+            # sharing batches cannot deadlock
             for item in data['items']:
                 # Validate required fields
                 if not all(field in item for field in ['sku', 'batch_number', 'jumlah']):
                     raise ValueError("Missing required fields in item")
-                
-                # Get inventory and lock for update
-                inventory = Inventory.query.filter_by(
-                    sku=item['sku'], 
-                    batch_number=item['batch_number']
-                ).with_for_update().first()
+            locked = {}
+            for key in sorted({(item['sku'], item['batch_number']) for item in data['items']}):
+                # Get inventory and lock for update; the product joined
+                # in for name and price stays unlocked
+                locked[key] = Inventory.query.filter_by(
+                    id_cabang=branch,
+                    sku=key[0], 
+                    batch_number=key[1]
+                ).with_for_update(of=Inventory).first()
+            # Stock held by other open carts is not for sale
+            held = held_quantities(branch, locked, exclude_cart=cart_id, user_id=g.user_id)
+            
+            # Process each item
+            for item in data['items']:
+                key = (item['sku'], item['batch_number'])
+                inventory = locked[key]
                 
                 if not inventory:
                     raise ValueError(f"Product not found: SKU {item['sku']}, Batch {item['batch_number']}")
                 
                 # Validate stock availability
-                if inventory.stok_tersedia < item['jumlah']:
+                if inventory.stok_tersedia - held.get(key, 0) < item['jumlah']:
                     raise ValueError(f"Insufficient stock for {inventory.nama_item}")
                 
                 # Calculate subtotal
@@ -373,25 +512,52 @@ def create_transaction():
                 
                 # Update inventory
                 inventory.stok_tersedia -= item['jumlah']
+                track_stock_change(stock_changes, inventory, -item['jumlah'])
+                movements.append(record_movement(inventory, -item['jumlah'], 'sale'))
                 
                 # Create transaction detail
                 transaction_details.append({
                     'sku': item['sku'],
                     'batch_number': item['batch_number'],
+                    'id_batch': inventory.id_batch,
                     'jumlah': item['jumlah'],
                     'harga_satuan': inventory.harga,
                     'subtotal': subtotal
                 })
             
             # Create main transaction
-            transaction = Transaksi(total_amount=total_amount)
+            transaction = Transaksi(id_cabang=branch, total_amount=total_amount)
             db.session.add(transaction)
             db.session.flush()  # Get transaction ID
             
             # Create transaction details
             for detail in transaction_details:
                 detail['id_transaksi'] = transaction.id_transaksi
-                db.session.add(TransaksiDetail(**detail))
+                db.session.add(TransaksiDetail(
+                    id_transaksi=transaction.id_transaksi,
+                    waktu_transaksi=transaction.waktu_transaksi,
+                    id_cabang=branch,
+                    id_batch=detail.pop('id_batch'),
+                    jumlah=detail['jumlah'],
+                    harga_satuan=detail['harga_satuan'],
+                    subtotal=detail['subtotal']
+                ))
+            for movement in movements:
+                movement.id_transaksi = transaction.id_transaksi
+            audit.record('transaksi', 'created', {'id_transaksi': transaction.id_transaksi},
+                         None, audit.transaction_state(total_amount, transaction_details), branch)
+            if cart_id is not None:
+                release(cart_id, g.user_id)
+            
+            publish_stock_changes(stock_changes)
+            publish('sale', {
+                'action': 'created',
+                'id_cabang': branch,
+                'id_transaksi': transaction.id_transaksi,
+                'total_amount': total_amount,
+                'delta': total_amount,
+                'waktu_transaksi': transaction.waktu_transaksi.isoformat()
+            })
             
             # No need to call commit() - the context manager will handle it
             
@@ -406,13 +572,255 @@ def create_transaction():
     except ValueError as e:
         # No need to call rollback() - the context manager will handle it
         return jsonify({'message': str(e)}), 400
+    except Overloaded:
+        raise
     except Exception as e:
-        logger.error(f"Error processing transaction: {str(e)}")
+        if is_retryable(e):
+            raise
+        logger.error("Error processing transaction: %s", e)
         return jsonify({'error': 'Failed to process transaction'}), 400
 
+def _lock_batch_by_id(id_batch):
+    """Lock a batch by its surrogate key, refreshing a copy loaded with sale lines"""
+    return Inventory.query.filter_by(id_batch=id_batch).with_for_update(of=Inventory).populate_existing().first()
+
+def _valid_cart_id(cart_id):
+    try:
+        uuid.UUID(str(cart_id))
+    except ValueError:
+        return False
+    return True
+
+def _cart_to_dict(cart_id, lines):
+    return {
+        'id_keranjang': cart_id,
+        'kedaluwarsa': max(line.kedaluwarsa for line in lines).isoformat() if lines else None,
+        'items': [{
+            'id_cabang': line.id_cabang,
+            'sku': line.sku,
+            'batch_number': line.batch_number,
+            'nama_item': line.nama_item,
+            'jumlah': line.jumlah,
+            'harga_satuan': line.harga,
+            'subtotal': line.harga * line.jumlah
+        } for line in lines]
+    }
+
+# Stock held by an open cart; the cart id is a UUID chosen by the client
+@main.route('/reservations/<cart_id>', methods=['GET'])
+@token_required
+def get_reservations(cart_id):
+    if not _valid_cart_id(cart_id):
+        return jsonify({'message': 'Invalid cart id'}), 400
+    return jsonify(_cart_to_dict(cart_id, cart_lines(cart_id, g.user_id))), 200
+
+# Hold `jumlah` of a batch for the cart (0 releases it); extends the whole cart's holds
+@main.route('/reservations/<cart_id>/<sku>/<batch_number>', methods=['PUT'])
+@token_required
+@retry_transaction
+def put_reservation(cart_id, sku, batch_number):
+    data = request.json or {}
+    if not _valid_cart_id(cart_id):
+        return jsonify({'message': 'Invalid cart id'}), 400
+    jumlah = data.get('jumlah')
+    if not isinstance(jumlah, int) or isinstance(jumlah, bool) or jumlah < 0:
+        return jsonify({'message': 'jumlah must be a non-negative integer'}), 400
+    branch = target_branch(data)
+    if branch is None:
+        return jsonify({'message': 'id_cabang is required'}), 400
+
+    expires = datetime.now(timezone.utc) + timedelta(seconds=current_app.config['RESERVATION_TTL_SECONDS'])
+    with db.session.begin():
+        if jumlah == 0:
+            release_line(cart_id, branch, sku, batch_number, g.user_id)
+            return jsonify({'message': 'Reservation released'}), 200
+        stok_tersedia = lock_batch(branch, sku, batch_number)
+        if stok_tersedia is None:
+            return jsonify({'message': 'Item not found'}), 404
+        row = hold(cart_id, branch, sku, batch_number, jumlah, g.user_id, expires)
+        if row.jumlah is None:
+            return jsonify({
+                'message': 'Insufficient stock',
+                'stok_bebas': max(stok_tersedia - row.held_by_others, 0)
+            }), 409
+    return jsonify({
+        'id_keranjang': cart_id,
+        'id_cabang': branch,
+        'sku': sku,
+        'batch_number': batch_number,
+        'jumlah': row.jumlah,
+        'kedaluwarsa': row.kedaluwarsa.isoformat(),
+        'stok_bebas': stok_tersedia - row.held_by_others - row.jumlah
+    }), 200
+
+# Abandon a cart, releasing all of its holds
+@main.route('/reservations/<cart_id>', methods=['DELETE'])
+@token_required
+def delete_reservations(cart_id):
+    if not _valid_cart_id(cart_id):
+        return jsonify({'message': 'Invalid cart id'}), 400
+    with db.session.begin():
+        released = release(cart_id, g.user_id)
+    return jsonify({'message': 'Reservations released', 'released': released}), 200
+
+def _stock_take_to_dict(session):
+    return {
+        'id_opname': session.id_opname,
+        'id_cabang': session.id_cabang,
+        'status': session.status,
+        'catatan': session.catatan,
+        'user_id': session.user_id,
+        'dibuka_pada': session.dibuka_pada.isoformat() if session.dibuka_pada else None,
+        'ditutup_pada': session.ditutup_pada.isoformat() if session.ditutup_pada else None
+    }
+
+def _variance_line_to_dict(line):
+    return {
+        'sku': line.sku,
+        'batch_number': line.batch_number,
+        'nama_item': line.nama_item,
+        'kategori': line.kategori,
+        'stok_sistem': line.stok_sistem,
+        'jumlah_hitung': line.jumlah_hitung,
+        'selisih': line.selisih,
+        'nilai_selisih': line.nilai_selisih,
+        # None once the batch has been deleted; applying skips it
+        'stok_tersedia': line.stok_tersedia,
+        'stok_setelah': line.stok_setelah,
+        'dihitung_pada': line.dihitung_pada.isoformat()
+    }
+
+# Stock takes of the outlets in scope, newest first
+@main.route('/stock-takes', methods=['GET'])
+@token_required
+def get_stock_takes():
+    query = StokOpname.query
+    if branch_scope():
+        query = query.filter_by(id_cabang=branch_scope())
+    sessions = query.order_by(StokOpname.id_opname.desc()).limit(50).all()
+    return jsonify([_stock_take_to_dict(session) for session in sessions]), 200
+
+# Open a stock take; an outlet counts one at a time
+@main.route('/stock-takes', methods=['POST'])
+@token_required
+def create_stock_take():
+    data = request.json or {}
+    branch = target_branch(data)
+    if branch is None:
+        return jsonify({'message': 'id_cabang is required'}), 400
+    with db.session.begin():
+        session, created = open_session(branch, g.user_id, data.get('catatan'))
+        result = _stock_take_to_dict(session)
+    if not created:
+        return jsonify({'message': 'A stock take is already open for this outlet', 'stock_take': result}), 409
+    return jsonify({'message': 'Stock take opened', 'stock_take': result}), 201
+
+# Post counted quantities; a batch counted again replaces its earlier count
+@main.route('/stock-takes/<int:id_opname>/counts', methods=['POST'])
+@token_required
+@retry_transaction
+def post_stock_take_counts(id_opname):
+    data = request.json or {}
+    items = data.get('items')
+    max_items = current_app.config['STOCK_TAKE_MAX_ITEMS']
+    if not isinstance(items, list) or not items:
+        return jsonify({
+            'message': 'At least one item is required',
+            'required_fields': ['items[].sku', 'items[].batch_number', 'items[].jumlah']
+        }), 400
+    if len(items) > max_items:
+        return jsonify({'message': f'At most {max_items} items per request'}), 400
+
+    counts = {}
+    for item in items:
+        jumlah = item.get('jumlah') if isinstance(item, dict) else None
+        if (not isinstance(jumlah, int) or isinstance(jumlah, bool) or jumlah < 0
+                or not item.get('sku') or not item.get('batch_number')):
+            return jsonify({'message': 'Every item needs sku, batch_number and a non-negative integer jumlah'}), 400
+        # The last count of a batch in the request wins
+        counts[(str(item['sku']), str(item['batch_number']))] = jumlah
+
+    with db.session.begin():
+        session = lock_session(id_opname, branch_scope())
+        if not session:
+            return jsonify({'message': 'Stock take not found'}), 404
+        if session.status != 'open':
+            return jsonify({'message': f'Stock take is {session.status}'}), 409
+        recorded = record_counts(session, counts, g.user_id)
+
+    unknown = [{'sku': sku, 'batch_number': batch_number} for sku, batch_number in counts
+               if (sku, batch_number) not in recorded]
+    return jsonify({'recorded': len(recorded), 'unknown': unknown}), 200
+
+# Variance report: counted against system stock; ?differences=1 leaves out matching lines
+@main.route('/stock-takes/<int:id_opname>', methods=['GET'])
+@token_required
+def get_stock_take(id_opname):
+    query = StokOpname.query.filter_by(id_opname=id_opname)
+    if branch_scope():
+        query = query.filter_by(id_cabang=branch_scope())
+    session = query.first()
+    if not session:
+        return jsonify({'message': 'Stock take not found'}), 404
+
+    lines = variance_lines(session, request.args.get('differences') in ('1', 'true'))
+    summary = {
+        'counted': len(lines),
+        'uncounted': uncounted_batches(session) if session.status == 'open' else None,
+        'with_variance': sum(1 for line in lines if line.selisih),
+        'surplus': sum(line.selisih for line in lines if line.selisih > 0),
+        'shortage': -sum(line.selisih for line in lines if line.selisih < 0),
+        'net_value': sum(line.nilai_selisih or 0 for line in lines)
+    }
+    return jsonify({
+        'stock_take': _stock_take_to_dict(session),
+        'summary': summary,
+        'items': [_variance_line_to_dict(line) for line in lines]
+    }), 200
+
+# Apply every count of an open stock take at once and close it
+@main.route('/stock-takes/<int:id_opname>/apply', methods=['POST'])
+@token_required
+@retry_transaction
+def apply_stock_take(id_opname):
+    stock_changes = {}
+    with db.session.begin():
+        session = lock_session(id_opname, branch_scope(), exclusive=True)
+        if not session:
+            return jsonify({'message': 'Stock take not found'}), 404
+        if session.status != 'open':
+            return jsonify({'message': f'Stock take is {session.status}'}), 409
+        adjusted = apply_session(session, g.user_id)
+        for row in adjusted:
+            track_stock_change(stock_changes, row, row.stok_tersedia - row.stok_sebelum)
+            audit.record('inventory', 'updated', {'sku': row.sku, 'batch_number': row.batch_number},
+                         {'stok_tersedia': row.stok_sebelum}, {'stok_tersedia': row.stok_tersedia}, row.id_cabang)
+        publish_stock_changes(stock_changes)
+        result = {
+            'id_opname': id_opname,
+            'adjusted': len(adjusted),
+            'surplus': sum(row.stok_tersedia - row.stok_sebelum for row in adjusted if row.stok_tersedia > row.stok_sebelum),
+            'shortage': sum(row.stok_sebelum - row.stok_tersedia for row in adjusted if row.stok_tersedia < row.stok_sebelum)
+        }
+    return jsonify({'message': 'Stock take applied', **result}), 200
+
+# Discard an open stock take
+@main.route('/stock-takes/<int:id_opname>', methods=['DELETE'])
+@token_required
+def delete_stock_take(id_opname):
+    with db.session.begin():
+        session = lock_session(id_opname, branch_scope(), exclusive=True)
+        if not session:
+            return jsonify({'message': 'Stock take not found'}), 404
+        if session.status != 'open':
+            return jsonify({'message': f'Stock take is {session.status}'}), 409
+        cancel_session(session)
+    return jsonify({'message': 'Stock take cancelled', 'id_opname': id_opname}), 200
+
 # Update Transaction
 @main.route('/transactions/<int:transaction_id>', methods=['PUT'])
 @token_required
+@retry_transaction
 def update_transaction(transaction_id):
     data = request.json
     if not isinstance(data.get('items'), list) or not data['items']:
@@ -425,25 +833,32 @@ def update_transaction(transaction_id):
         # Initialize variables outside transaction block
         total_amount = 0
         new_details = []
+        new_lines = []
+        stock_changes = {}
 
         with db.session.begin():
             # Get transaction and validate
-            transaction = Transaksi.query.filter_by(id_transaksi=transaction_id).first()
+            transaction = transactions_query(branch=branch_scope()).filter_by(id_transaksi=transaction_id).first()
             if not transaction:
                 return jsonify({'message': 'Transaction not found'}), 404
             
             # Revert all inventory changes
-            for detail in transaction.details:
-                inventory = Inventory.query.filter_by(
-                    sku=detail.sku,
-                    batch_number=detail.batch_number
-                ).with_for_update().first()
+            for detail in sorted(transaction.details, key=lambda detail: detail.id_batch):
+                inventory = _lock_batch_by_id(detail.id_batch)
                 
                 if inventory:
                     inventory.stok_tersedia += detail.jumlah
+                    track_stock_change(stock_changes, inventory, detail.jumlah)
+                    record_movement(inventory, detail.jumlah, 'sale_edit', transaction_id)
+            
+            previous_total = transaction.total_amount
+            before = audit.transaction_state(previous_total, transaction.details)
             
             # Delete old transaction details
-            TransaksiDetail.query.filter_by(id_transaksi=transaction_id).delete()
+            TransaksiDetail.query.filter_by(
+                id_transaksi=transaction_id,
+                waktu_transaksi=transaction.waktu_transaksi
+            ).delete()
             
             # Process new items
             for item in data['items']:
@@ -451,17 +866,21 @@ def update_transaction(transaction_id):
                 if not all(field in item for field in ['sku', 'batch_number', 'jumlah']):
                     raise ValueError("Missing required fields in item")
                 
-                # Get inventory and lock for update
+                # Get inventory and lock for update; the batch may already be
+                # loaded with the old lines, so refresh it
                 inventory = Inventory.query.filter_by(
+                    id_cabang=transaction.id_cabang,
                     sku=item['sku'],
                     batch_number=item['batch_number']
-                ).with_for_update().first()
+                ).with_for_update(of=Inventory).populate_existing().first()
                 
                 if not inventory:
                     raise ValueError(f"Product not found: SKU {item['sku']}, Batch {item['batch_number']}")
                 
-                # Validate stock availability
-                if inventory.stok_tersedia < item['jumlah']:
+                # Validate stock availability, less what open carts hold
+                key = (item['sku'], item['batch_number'])
+                held = held_quantities(transaction.id_cabang, [key]).get(key, 0)
+                if inventory.stok_tersedia - held < item['jumlah']:
                     raise ValueError(f"Insufficient stock for {inventory.nama_item}")
                 
                 # Calculate subtotal
@@ -470,73 +889,107 @@ def update_transaction(transaction_id):
                 
                 # Update inventory
                 inventory.stok_tersedia -= item['jumlah']
+                track_stock_change(stock_changes, inventory, -item['jumlah'])
+                record_movement(inventory, -item['jumlah'], 'sale', transaction_id)
                 
                 # Create new transaction detail
                 new_detail = TransaksiDetail(
                     id_transaksi=transaction_id,
-                    sku=item['sku'],
-                    batch_number=item['batch_number'],
+                    waktu_transaksi=transaction.waktu_transaksi,
+                    id_cabang=transaction.id_cabang,
+                    inventory=inventory,
                     jumlah=item['jumlah'],
                     harga_satuan=inventory.harga,
                     subtotal=subtotal
                 )
                 db.session.add(new_detail)
                 new_details.append(new_detail)
+                new_lines.append({
+                    'sku': item['sku'],
+                    'batch_number': item['batch_number'],
+                    'jumlah': item['jumlah'],
+                    'harga_satuan': inventory.harga,
+                    'subtotal': subtotal
+                })
             
             # Update transaction total
             transaction.total_amount = total_amount
+            audit.record('transaksi', 'updated', {'id_transaksi': transaction_id},
+                         before, audit.transaction_state(total_amount, new_details), transaction.id_cabang)
+            
+            publish_stock_changes(stock_changes)
+            publish('sale', {
+                'action': 'updated',
+                'id_cabang': transaction.id_cabang,
+                'id_transaksi': transaction_id,
+                'total_amount': total_amount,
+                'delta': total_amount - previous_total,
+                'waktu_transaksi': transaction.waktu_transaksi.isoformat()
+            })
             
         # Return response after successful commit
         return jsonify({
             'message': 'Transaction updated successfully',
             'transaction_id': transaction_id,
             'total_amount': total_amount,
-            'details': [{
-                'sku': detail.sku,
-                'batch_number': detail.batch_number,
-                'jumlah': detail.jumlah,
-                'harga_satuan': detail.harga_satuan,
-                'subtotal': detail.subtotal
-            } for detail in new_details]
+            'details': new_lines
         }), 200
             
     except ValueError as e:
         return jsonify({'message': str(e)}), 400
+    except Overloaded:
+        raise
     except Exception as e:
-        logger.error(f"Error updating transaction: {str(e)}")
+        if is_retryable(e):
+            raise
+        logger.error("Error updating transaction: %s", e)
         return jsonify({'error': 'Failed to update transaction'}), 400
 
 # Delete Transaction
 @main.route('/transactions/<int:transaction_id>', methods=['DELETE'])
 @token_required
+@retry_transaction
 def delete_transaction(transaction_id):
     try:
         details = []
+        stock_changes = {}
 
         with db.session.begin():
             # Get transaction and validate
-            transaction = Transaksi.query.filter_by(id_transaksi=transaction_id).first()
+            transaction = transactions_query(branch=branch_scope()).filter_by(id_transaksi=transaction_id).first()
             if not transaction:
                 return jsonify({'message': 'Transaction not found'}), 404
             
             # Revert inventory changes
-            for detail in transaction.details:
-                inventory = Inventory.query.filter_by(
-                    sku=detail.sku,
-                    batch_number=detail.batch_number
-                ).with_for_update().first()
+            for detail in sorted(transaction.details, key=lambda detail: detail.id_batch):
+                inventory = _lock_batch_by_id(detail.id_batch)
                 
                 if inventory:
                     inventory.stok_tersedia += detail.jumlah
+                    track_stock_change(stock_changes, inventory, detail.jumlah)
+                    record_movement(inventory, detail.jumlah, 'cancel', transaction_id)
                     details.append({
                         'product': inventory.nama_item,
                         'returned_quantity': detail.jumlah,
                         'current_stock': inventory.stok_tersedia
                     })
             
+            audit.record('transaksi', 'deleted', {'id_transaksi': transaction_id},
+                         audit.transaction_state(transaction.total_amount, transaction.details), None,
+                         transaction.id_cabang)
             # Delete transaction (cascade will handle details)
             db.session.delete(transaction)
             
+            publish_stock_changes(stock_changes)
+            publish('sale', {
+                'action': 'cancelled',
+                'id_cabang': transaction.id_cabang,
+                'id_transaksi': transaction_id,
+                'total_amount': 0,
+                'delta': -transaction.total_amount,
+                'waktu_transaksi': transaction.waktu_transaksi.isoformat()
+            })
+            
         # Return response after successful commit
         return jsonify({
             'message': 'Transaction cancelled successfully',
@@ -544,6 +997,196 @@ def delete_transaction(transaction_id):
             'details': details
         }), 200
             
+    except Overloaded:
+        raise
     except Exception as e:
-        logger.error(f"Error cancelling transaction: {str(e)}")
-        return jsonify({'error': 'Failed to cancel transaction'}), 400
\ No newline at end of file
+        if is_retryable(e):
+            raise
+        logger.error("Error cancelling transaction: %s", e)
+        return jsonify({'error': 'Failed to cancel transaction'}), 400
+
+# Delta sync: what changed since a cursor
+@main.route('/sync/changes', methods=['GET'])
+@token_required
+@compress(gzip=6, br=5)
+def get_changes():
+    branch = branch_scope()
+    cursor = request.args.get('cursor')
+    if not cursor:
+        # Starting point: take the cursor first, then fetch everything in full
+        return jsonify({
+            'cursor': current_cursor(),
+            'has_more': False,
+            'inventory': {'upserts': [], 'deletes': []},
+            'transactions': {'upserts': [], 'deletes': []}
+        }), 200
+
+    limit = min(request.args.get('limit', current_app.config['SYNC_PAGE_SIZE'], type=int),
+                current_app.config['SYNC_MAX_PAGE_SIZE'])
+    try:
+        inventory_keys, transaction_ids, next_cursor, has_more = changes_since(cursor, branch, limit)
+    except CursorExpired:
+        return jsonify({'message': 'Cursor expired, fetch inventory and transactions in full'}), 410
+    except ValueError:
+        return jsonify({'message': 'Invalid cursor'}), 400
+
+    # A key whose row no longer exists has been deleted
+    items = load_inventory(inventory_keys)
+    found = {(item.id_cabang, item.sku, item.batch_number) for item in items}
+    transactions = load_transactions(transaction_ids)
+    found_ids = {t.id_transaksi for t in transactions}
+
+    return jsonify({
+        'cursor': next_cursor,
+        'has_more': has_more,
+        'inventory': {
+            'upserts': [inventory_to_dict(item) for item in items],
+            'deletes': [{
+                'id_cabang': id_cabang,
+                'sku': sku,
+                'batch_number': batch_number
+            } for id_cabang, sku, batch_number in inventory_keys if (id_cabang, sku, batch_number) not in found]
+        },
+        'transactions': {
+            'upserts': [transaction_to_dict(t) for t in transactions],
+            'deletes': [{'id_transaksi': id_transaksi} for id_transaksi in transaction_ids if id_transaksi not in found_ids]
+        }
+    }), 200
+
+# Stored request profiles (profiling.py), newest first
+@main.route('/admin/profiles', methods=['GET'])
+@token_required
+@admin_required
+def get_profiles():
+    limit = min(request.args.get('limit', 100, type=int), 500)
+    return jsonify(list_profiles(current_app.config['PROFILE_DIR'], limit)), 200
+
+# One profile: ?format=collapsed for the folded stacks, else timings and SQL
+@main.route('/admin/profiles/<profile_id>', methods=['GET'])
+@token_required
+@admin_required
+def get_profile(profile_id):
+    collapsed = request.args.get('format') == 'collapsed'
+    try:
+        path = profile_path(current_app.config['PROFILE_DIR'], profile_id, 'collapsed' if collapsed else 'json')
+        with open(path) as f:
+            content = f.read()
+    except (ValueError, FileNotFoundError):
+        return jsonify({'message': 'Profile not found'}), 404
+    if collapsed:
+        return Response(content, mimetype='text/plain',
+                        headers={'Content-Disposition': f'attachment; filename={profile_id}.collapsed'})
+    return Response(content, mimetype='application/json')
+
+# Statements ranked by total time across workers (?order=max_ms|calls|...)
+@main.route('/admin/slow-queries', methods=['GET'])
+@token_required
+@admin_required
+def get_slow_queries():
+    order = request.args.get('order', 'total_ms')
+    if order not in SLOW_QUERY_ORDERS:
+        return jsonify({'message': f"order must be one of {', '.join(SLOW_QUERY_ORDERS)}"}), 400
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    # Include this worker's latest numbers; the others flush on their own
+    query_stats.flush()
+    return jsonify(top_queries(order, limit)), 200
+
+# One statement fingerprint with its EXPLAIN plan and recent slow executions
+@main.route('/admin/slow-queries/<fingerprint>', methods=['GET'])
+@token_required
+@admin_required
+def get_slow_query(fingerprint):
+    detail = query_detail(fingerprint)
+    if detail is None:
+        return jsonify({'message': 'Query not found'}), 404
+    return jsonify(detail), 200
+
+# Start a refresh of the analytics snapshot file (?full=1 rebuilds it from
+# scratch); it runs in the background, poll the status route
+@main.route('/admin/analytics-export', methods=['POST'])
+@token_required
+@admin_required
+@rate_class('export')
+def refresh_analytics_export():
+    full = request.args.get('full', '0').lower() in ('1', 'true')
+    source = current_app.config['ANALYTICS_DATABASE_URL']
+    if full and not source:
+        return jsonify({
+            'message': 'A full export needs a read replica (ANALYTICS_DATABASE_URL)',
+            'details': 'Run maintenance.py analytics-export --full off-peak instead'
+        }), 409
+    try:
+        run = export_job.start(source or current_app.config['SQLALCHEMY_DATABASE_URI'],
+                               current_app.config['ANALYTICS_EXPORT_PATH'], full)
+    except ExportRunning:
+        return jsonify({'message': 'An analytics export is already running'}), 409
+    response = jsonify({'message': 'Analytics export started', 'run': run})
+    response.headers['Location'] = '/admin/analytics-export/status'
+    return response, 202
+
+# Progress of the last refresh and the snapshot currently on disk
+@main.route('/admin/analytics-export/status', methods=['GET'])
+@token_required
+@admin_required
+def get_analytics_export_status():
+    return jsonify(export_job.status(current_app.config['ANALYTICS_EXPORT_PATH'])), 200
+
+# Download the analytics snapshot as a SQLite database
+@main.route('/admin/analytics-export', methods=['GET'])
+@token_required
+@admin_required
+@rate_class('export')
+def download_analytics_export():
+    path = current_app.config['ANALYTICS_EXPORT_PATH']
+    if not os.path.exists(path):
+        return jsonify({'message': 'No analytics export yet'}), 404
+    return send_file(path, mimetype='application/vnd.sqlite3', as_attachment=True,
+                     download_name='apotek-analytics.sqlite')
+
+# Short-lived token for opening an event stream, which takes it in the URL
+@main.route('/events/token', methods=['POST'])
+@token_required
+def get_stream_token():
+    token = create_stream_token(g.user_id, g.branch_id, g.is_admin)
+    return jsonify({'token': token, 'expires_in': current_app.config['SSE_TOKEN_SECONDS']}), 200
+
+# Live stock and sales updates (Server-Sent Events)
+@main.route('/events/stream', methods=['GET'])
+@stream_token_required
+@compress(enabled=False)
+@latency_budget(None)
+def stream_events():
+    heartbeat = current_app.config['SSE_HEARTBEAT_SECONDS']
+    # Bounded lifetime so a stream never pins a worker thread forever;
+    # EventSource reconnects on its own after the `retry` delay
+    deadline = time.monotonic() + current_app.config['SSE_MAX_STREAM_SECONDS']
+    branch = branch_scope()
+    try:
+        subscriber = broker.subscribe()
+    except StreamLimitReached:
+        # Streams must not take every thread; the client retries, likely
+        # landing on another worker
+        response = jsonify({'message': 'Too many open event streams, please retry shortly'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            while time.monotonic() < deadline:
+                try:
+                    message = subscriber.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                if message is None:
+                    break
+                if visible_to(message, branch):
+                    yield format_sse(message)
+        finally:
+            broker.unsubscribe(subscriber)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
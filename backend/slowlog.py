@@ -0,0 +1,390 @@
+# slowlog.py
+"""Statement statistics and slow query capture.
+
+Every statement the app runs is timed by engine hooks and folded into
+per-worker aggregates keyed by a fingerprint of its normalized SQL
+(literals, placeholders and IN lists collapsed), so the thousand cheap
+lookups of an N+1 loop add up under one entry. Each request's calls per
+fingerprint are counted too; max_per_request makes such loops obvious.
+
+Statements slower than SLOW_QUERY_MS are also logged one by one with
+their route and parameter shape (types only, never values). The first
+time a fingerprint is slow within SLOW_QUERY_EXPLAIN_WINDOW_MINUTES its
+plan is captured on a separate connection: EXPLAIN (ANALYZE, BUFFERS) for
+plain SELECTs, inside a transaction that is rolled back, and a plain
+EXPLAIN for anything that writes.
+
+A background thread per worker merges the aggregates into query_stats and
+does the EXPLAINs, so requests only pay for a timer and a dict update.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import g, has_request_context, request
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+import metrics
+from app import db
+
+logger = logging.getLogger(__name__)
+
+metrics.describe('slow_queries_total', 'Statements slower than SLOW_QUERY_MS')
+metrics.describe('slow_query_samples_dropped_total', 'Slow statement samples lost to a full buffer')
+
+# Execution option that keeps a connection's statements out of the stats
+SKIP = 'slowlog_skip'
+
+# Columns the admin listing can rank by
+ORDERS = ('total_ms', 'max_ms', 'calls', 'slow_calls', 'max_per_request')
+
+# Parameter shapes list at most this many parameters
+MAX_SHAPE_PARAMS = 50
+
+_COMMENT = re.compile(r'--[^\n]*|/\*.*?\*/', re.S)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_PLACEHOLDER = re.compile(r'%\(\w+\)s|%s|\$\d+')
+_NUMBER = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_ROWS = re.compile(r'(\((?:\?|\.\.\.)(?:\s*,\s*(?:\?|\.\.\.))*\))(?:\s*,\s*\((?:\?|\.\.\.)(?:\s*,\s*(?:\?|\.\.\.))*\))+')
+_SPACE = re.compile(r'\s+')
+_LOCKING = re.compile(r'\bFOR\s+(?:UPDATE|NO\s+KEY\s+UPDATE|SHARE|KEY\s+SHARE)\b', re.I)
+
+_fingerprints = {}
+_FINGERPRINT_CACHE_SIZE = 5000
+
+
+def normalize(statement):
+    """SQL with comments, literals and placeholders replaced by ?"""
+    sql = _COMMENT.sub(' ', statement)
+    sql = _STRING.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _SPACE.sub(' ', sql).strip()
+    # IN lists and multi-row VALUES vary in length with the data
+    sql = _LIST.sub('(...)', sql)
+    sql = _ROWS.sub(r'\1, ...', sql)
+    return sql
+
+
+def fingerprint(statement):
+    """(fingerprint, normalized SQL) of a statement"""
+    cached = _fingerprints.get(statement)
+    if cached is None:
+        normalized = normalize(statement)
+        cached = (hashlib.sha1(normalized.encode()).hexdigest()[:16], normalized)
+        # Compiled statements repeat, so the cache rarely fills up
+        if len(_fingerprints) >= _FINGERPRINT_CACHE_SIZE:
+            _fingerprints.clear()
+        _fingerprints[statement] = cached
+    return cached
+
+
+def parameter_shape(parameters, executemany=False):
+    """Types of the bound parameters, never their values"""
+    if executemany:
+        rows = list(parameters or [])
+        return {'rows': len(rows), 'row': parameter_shape(rows[0]) if rows else None}
+    if isinstance(parameters, dict):
+        shape = {key: type(value).__name__ for key, value in sorted(parameters.items())[:MAX_SHAPE_PARAMS]}
+        if len(parameters) > MAX_SHAPE_PARAMS:
+            shape['...'] = len(parameters)
+        return shape
+    if isinstance(parameters, (list, tuple)):
+        shape = [type(value).__name__ for value in parameters[:MAX_SHAPE_PARAMS]]
+        if len(parameters) > MAX_SHAPE_PARAMS:
+            shape.append(f'... {len(parameters)}')
+        return shape
+    return None
+
+
+def read_only(statement):
+    """Whether EXPLAIN ANALYZE may run the statement: a SELECT that takes no row locks"""
+    sql = _COMMENT.sub(' ', statement).lstrip()
+    return sql[:6].upper() == 'SELECT' and not _LOCKING.search(sql)
+
+
+class QueryStats:
+    """Per-worker statement aggregates, merged into query_stats in the background"""
+
+    def __init__(self):
+        self.app = None
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._samples = []
+        self._explain = {}
+        self._explained = {}
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def init_app(self, app):
+        self.app = app
+        atexit.register(self.stop)
+
+    @property
+    def enabled(self):
+        return self.app is not None and self.app.config['SLOW_QUERY_ENABLED']
+
+    def record(self, statement, parameters, executemany, duration_ms):
+        config = self.app.config
+        fp, normalized = fingerprint(statement)
+        in_request = has_request_context()
+        route = request.endpoint if in_request else None
+        slow = duration_ms >= config['SLOW_QUERY_MS']
+        if slow:
+            metrics.increment('slow_queries_total')
+            shape = parameter_shape(parameters, executemany)
+            window = config['SLOW_QUERY_EXPLAIN_WINDOW_MINUTES'] * 60
+            now = time.monotonic()
+
+        with self._lock:
+            stats = self._pending.get(fp)
+            if stats is None:
+                stats = self._pending[fp] = {
+                    'fingerprint': fp, 'query': normalized, 'calls': 0, 'total_ms': 0.0,
+                    'max_ms': 0.0, 'slow_calls': 0, 'max_per_request': 0,
+                    'last_route': None, 'param_shape': None
+                }
+            stats['calls'] += 1
+            stats['total_ms'] += duration_ms
+            stats['max_ms'] = max(stats['max_ms'], duration_ms)
+            if route:
+                stats['last_route'] = route
+
+            if slow:
+                stats['slow_calls'] += 1
+                stats['param_shape'] = shape
+                if len(self._samples) < config['SLOW_QUERY_BUFFER_SIZE']:
+                    self._samples.append({
+                        'fingerprint': fp,
+                        'waktu': datetime.now(timezone.utc),
+                        'duration_ms': round(duration_ms, 3),
+                        'route': route,
+                        'param_shape': json.dumps(shape),
+                        'request_id': g.get('request_id') if in_request else None
+                    })
+                else:
+                    metrics.increment('slow_query_samples_dropped_total')
+                last = self._explained.get(fp)
+                if not executemany and (last is None or now - last >= window):
+                    self._explained[fp] = now
+                    # Keep the statement and its values only until it is explained
+                    self._explain[fp] = (statement, parameters)
+
+        if in_request:
+            counts = g.setdefault('query_counts', {})
+            counts[fp] = counts.get(fp, 0) + 1
+        self._ensure_thread()
+
+    def request_finished(self):
+        """Fold the calls per fingerprint of the ending request into max_per_request"""
+        counts = g.pop('query_counts', None)
+        if not counts:
+            return
+        with self._lock:
+            for fp, count in counts.items():
+                stats = self._pending.get(fp)
+                if stats is not None and count > stats['max_per_request']:
+                    stats['max_per_request'] = count
+
+    def flush(self):
+        """Merge this worker's aggregates and samples into the database now"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            samples, self._samples = self._samples, []
+            explain, self._explain = self._explain, {}
+        if not pending and not samples:
+            return
+        try:
+            with self.app.app_context():
+                with db.engine.connect().execution_options(**{SKIP: True}) as conn:
+                    with conn.begin():
+                        self._write(conn, pending, samples)
+                    for fp, (statement, parameters) in explain.items():
+                        self._capture_plan(conn, fp, statement, parameters)
+        except Exception as e:
+            logger.error("Query stats flush failed, %d statements lost: %s", len(pending), e)
+
+    def _write(self, conn, pending, samples):
+        if pending:
+            rows = [dict(stats, param_shape=json.dumps(stats['param_shape']) if stats['param_shape'] else None)
+                    for stats in pending.values()]
+            conn.execute(text("""
+                INSERT INTO query_stats AS s
+                    (fingerprint, query, calls, total_ms, max_ms, slow_calls, max_per_request, last_route, param_shape)
+                VALUES (:fingerprint, :query, :calls, :total_ms, :max_ms, :slow_calls, :max_per_request,
+                        :last_route, CAST(:param_shape AS JSONB))
+                ON CONFLICT (fingerprint) DO UPDATE SET
+                    calls = s.calls + EXCLUDED.calls,
+                    total_ms = s.total_ms + EXCLUDED.total_ms,
+                    max_ms = GREATEST(s.max_ms, EXCLUDED.max_ms),
+                    slow_calls = s.slow_calls + EXCLUDED.slow_calls,
+                    max_per_request = GREATEST(s.max_per_request, EXCLUDED.max_per_request),
+                    last_route = COALESCE(EXCLUDED.last_route, s.last_route),
+                    param_shape = COALESCE(EXCLUDED.param_shape, s.param_shape),
+                    last_seen = CURRENT_TIMESTAMP
+            """), rows)
+        if samples:
+            conn.execute(text("""
+                INSERT INTO slow_query_log (fingerprint, waktu, duration_ms, route, param_shape, request_id)
+                VALUES (:fingerprint, :waktu, :duration_ms, :route, CAST(:param_shape AS JSONB), :request_id)
+            """), samples)
+
+    def _capture_plan(self, conn, fp, statement, parameters):
+        # Workers share the window through explained_at: only one claims it
+        with conn.begin():
+            claimed = conn.execute(text("""
+                UPDATE query_stats SET explained_at = CURRENT_TIMESTAMP
+                WHERE fingerprint = :fp
+                  AND (explained_at IS NULL OR explained_at < CURRENT_TIMESTAMP - make_interval(mins => :window))
+                RETURNING fingerprint
+            """), {'fp': fp, 'window': self.app.config['SLOW_QUERY_EXPLAIN_WINDOW_MINUTES']}).first()
+        if claimed is None:
+            return
+        try:
+            plan = explain(statement, parameters, self.app.config['SLOW_QUERY_EXPLAIN_TIMEOUT_MS'])
+        except Exception as e:
+            logger.warning("EXPLAIN of query %s failed: %s", fp, e)
+            plan = {'error': str(e)}
+        with conn.begin():
+            conn.execute(text('UPDATE query_stats SET plan = CAST(:plan AS JSONB) WHERE fingerprint = :fp'),
+                         {'fp': fp, 'plan': json.dumps(plan, default=str)})
+
+    def stop(self, timeout=10):
+        """Flush what is pending and stop the background thread; safe to call twice"""
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self.app is not None:
+            self.flush()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if (self._thread is None or not self._thread.is_alive()) and not self._stopping.is_set():
+                    self._thread = threading.Thread(target=self._run, name='query-stats', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        interval = self.app.config['SLOW_QUERY_FLUSH_SECONDS']
+        while not self._stopping.wait(interval):
+            self.flush()
+
+
+def explain(statement, parameters, timeout_ms):
+    """The JSON plan of a statement, run on its own pooled connection.
+
+    Read-only SELECTs get ANALYZE and BUFFERS; the transaction is always
+    rolled back. The raw connection bypasses the engine hooks.
+    """
+    analyze = read_only(statement)
+    options = 'ANALYZE, BUFFERS, FORMAT JSON' if analyze else 'FORMAT JSON'
+    raw = db.engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute('SET LOCAL statement_timeout = %s', (int(timeout_ms),))
+        cursor.execute(f'EXPLAIN ({options}) {statement}', parameters)
+        return {'analyze': analyze, 'plan': cursor.fetchone()[0]}
+    finally:
+        raw.rollback()
+        raw.close()
+
+
+query_stats = QueryStats()
+
+
+def top_queries(order='total_ms', limit=50):
+    """Aggregates across workers, worst first by one of ORDERS"""
+    if order not in ORDERS:
+        raise ValueError(f'order must be one of {", ".join(ORDERS)}')
+    rows = db.session.execute(text(f"""
+        SELECT fingerprint, query, calls, total_ms, max_ms, slow_calls, max_per_request,
+               last_route, param_shape, first_seen, last_seen, explained_at, plan IS NOT NULL AS has_plan
+        FROM query_stats
+        ORDER BY {order} DESC
+        LIMIT :limit
+    """), {'limit': limit}).mappings()
+    return [_stats_to_dict(row) for row in rows]
+
+
+def query_detail(fingerprint, samples=50):
+    """One fingerprint with its plan and most recent slow executions, or None"""
+    row = db.session.execute(text('SELECT * FROM query_stats WHERE fingerprint = :fp'),
+                             {'fp': fingerprint}).mappings().first()
+    if row is None:
+        return None
+    detail = _stats_to_dict(row)
+    detail['plan'] = row['plan']
+    detail['samples'] = [{
+        'waktu': sample['waktu'].isoformat(),
+        'duration_ms': sample['duration_ms'],
+        'route': sample['route'],
+        'param_shape': sample['param_shape'],
+        'request_id': sample['request_id']
+    } for sample in db.session.execute(text("""
+        SELECT waktu, duration_ms, route, param_shape, request_id
+        FROM slow_query_log
+        WHERE fingerprint = :fp
+        ORDER BY waktu DESC
+        LIMIT :limit
+    """), {'fp': fingerprint, 'limit': samples}).mappings()]
+    return detail
+
+
+def _stats_to_dict(row):
+    return {
+        'fingerprint': row['fingerprint'],
+        'query': row['query'],
+        'calls': row['calls'],
+        'total_ms': round(row['total_ms'], 2),
+        'avg_ms': round(row['total_ms'] / row['calls'], 3) if row['calls'] else None,
+        'max_ms': round(row['max_ms'], 2),
+        'slow_calls': row['slow_calls'],
+        'max_per_request': row['max_per_request'],
+        'last_route': row['last_route'],
+        'param_shape': row['param_shape'],
+        'first_seen': row['first_seen'].isoformat(),
+        'last_seen': row['last_seen'].isoformat(),
+        'explained_at': row['explained_at'].isoformat() if row['explained_at'] else None,
+        'has_plan': row.get('has_plan', row.get('plan') is not None)
+    }
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('slowlog_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _stop_timer(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('slowlog_start')
+    if not starts:
+        return
+    duration_ms = (time.perf_counter() - starts.pop()) * 1000
+    if query_stats.enabled and not conn.get_execution_options().get(SKIP):
+        query_stats.record(statement, parameters, executemany, duration_ms)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _discard_timer(exception_context):
+    # A failed statement never reaches after_cursor_execute
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('slowlog_start'):
+        conn.info['slowlog_start'].pop()
+
+
+def init_slowlog(app):
+    query_stats.init_app(app)
+
+    @app.teardown_request
+    def fold_request_counts(exc):
+        if query_stats.enabled:
+            query_stats.request_finished()
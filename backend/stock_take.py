@@ -0,0 +1,154 @@
+# stock_take.py
+"""Stock takes (stock opname).
+
+A session is opened per outlet, counted quantities are posted to it in
+batches of lines, and applying it reconciles every counted batch at once.
+Each line keeps the system stock read when the batch was counted, so the
+adjustment is the count's difference to that figure: sales made between
+counting a batch and applying the session stay booked.
+
+Counting takes no inventory locks. Applying locks the counted batches in
+key order, the order sales lock them in, for one statement.
+"""
+import json
+
+from sqlalchemy import text
+
+from app import db
+from models import StokOpname
+
+
+def open_session(branch, user_id, catatan=None):
+    """Open a stock take for the outlet; (session, created).
+
+    An outlet has at most one open session, which is returned instead if
+    it exists.
+    """
+    id_opname = db.session.execute(text("""
+        INSERT INTO stok_opname (id_cabang, catatan, user_id)
+        VALUES (:id_cabang, :catatan, :user_id)
+        ON CONFLICT (id_cabang) WHERE status = 'open' DO NOTHING
+        RETURNING id_opname
+    """), {'id_cabang': branch, 'catatan': catatan, 'user_id': user_id}).scalar()
+    if id_opname is None:
+        return StokOpname.query.filter_by(id_cabang=branch, status='open').first(), False
+    return db.session.get(StokOpname, id_opname), True
+
+
+def lock_session(id_opname, branch=None, exclusive=False):
+    """Lock a session against being applied (shared) or changed (exclusive).
+
+    Must run as its own statement, before reading the lines, so lines
+    posted while waiting for the lock are seen. None if the session is
+    missing or outside `branch`.
+    """
+    query = StokOpname.query.filter_by(id_opname=id_opname)
+    if branch:
+        query = query.filter_by(id_cabang=branch)
+    return query.with_for_update(read=not exclusive).populate_existing().first()
+
+
+def record_counts(session, counts, user_id):
+    """Upsert counted quantities {(sku, batch_number): jumlah} of a locked open session.
+
+    Lines for batches the outlet does not stock are skipped; returns the
+    (sku, batch_number) keys that were recorded.
+    """
+    if not counts:
+        return set()
+    items = [{'sku': sku, 'batch_number': batch_number, 'jumlah': jumlah}
+             for (sku, batch_number), jumlah in counts.items()]
+    rows = db.session.execute(text("""
+        INSERT INTO stok_opname_item (id_opname, sku, batch_number, jumlah_hitung, stok_sistem, user_id)
+        SELECT :id_opname, i.sku, i.batch_number, c.jumlah, i.stok_tersedia, :user_id
+        FROM jsonb_to_recordset(CAST(:items AS jsonb)) AS c(sku text, batch_number text, jumlah integer)
+        JOIN inventory i ON i.id_cabang = :id_cabang AND i.sku = c.sku AND i.batch_number = c.batch_number
+        ON CONFLICT (id_opname, sku, batch_number) DO UPDATE
+            SET jumlah_hitung = EXCLUDED.jumlah_hitung,
+                stok_sistem = EXCLUDED.stok_sistem,
+                user_id = EXCLUDED.user_id,
+                dihitung_pada = CURRENT_TIMESTAMP
+        RETURNING sku, batch_number
+    """), {
+        'id_opname': session.id_opname,
+        'id_cabang': session.id_cabang,
+        'items': json.dumps(items),
+        'user_id': user_id
+    }).all()
+    return {(row.sku, row.batch_number) for row in rows}
+
+
+def variance_lines(session, differences_only=False):
+    """Counted lines with their variance, value and the stock applying would leave"""
+    differences = 'AND c.jumlah_hitung <> c.stok_sistem' if differences_only else ''
+    return db.session.execute(text(f"""
+        SELECT c.sku, c.batch_number, p.nama_item, p.kategori, c.stok_sistem, c.jumlah_hitung,
+               c.jumlah_hitung - c.stok_sistem AS selisih,
+               (c.jumlah_hitung - c.stok_sistem) * p.harga AS nilai_selisih,
+               i.stok_tersedia,
+               GREATEST(i.stok_tersedia + c.jumlah_hitung - c.stok_sistem, 0) AS stok_setelah,
+               c.dihitung_pada
+        FROM stok_opname_item c
+        LEFT JOIN inventory i
+          ON i.id_cabang = :id_cabang AND i.sku = c.sku AND i.batch_number = c.batch_number
+        LEFT JOIN produk p ON p.id_cabang = :id_cabang AND p.sku = c.sku
+        WHERE c.id_opname = :id_opname {differences}
+        ORDER BY c.sku, c.batch_number
+    """), {'id_opname': session.id_opname, 'id_cabang': session.id_cabang}).all()
+
+
+def uncounted_batches(session):
+    """Number of the outlet's batches the session has no count for"""
+    return db.session.execute(text("""
+        SELECT count(*)
+        FROM inventory i
+        WHERE i.id_cabang = :id_cabang
+          AND NOT EXISTS (
+              SELECT 1 FROM stok_opname_item c
+              WHERE c.id_opname = :id_opname AND c.sku = i.sku AND c.batch_number = i.batch_number
+          )
+    """), {'id_opname': session.id_opname, 'id_cabang': session.id_cabang}).scalar()
+
+
+def apply_session(session, user_id):
+    """Adjust every counted batch of an exclusively locked open session and close it.
+
+    Returns the adjusted batches as (id_cabang, sku, batch_number,
+    stok_tersedia, stok_sebelum); batches whose count matched, or that
+    were deleted since, are left alone. Stock never goes below zero.
+    """
+    return db.session.execute(text("""
+        WITH locked AS (
+            SELECT i.id_cabang, i.sku, i.batch_number, i.stok_tersedia,
+                   c.jumlah_hitung - c.stok_sistem AS selisih
+            FROM stok_opname_item c
+            JOIN inventory i
+              ON i.id_cabang = :id_cabang AND i.sku = c.sku AND i.batch_number = c.batch_number
+            WHERE c.id_opname = :id_opname AND c.jumlah_hitung <> c.stok_sistem
+            ORDER BY i.sku, i.batch_number
+            FOR NO KEY UPDATE OF i
+        ), upd AS (
+            UPDATE inventory i
+            SET stok_tersedia = GREATEST(locked.stok_tersedia + locked.selisih, 0),
+                waktu_pembaruan = CURRENT_TIMESTAMP
+            FROM locked
+            WHERE i.id_cabang = locked.id_cabang AND i.sku = locked.sku AND i.batch_number = locked.batch_number
+            RETURNING i.id_cabang, i.sku, i.batch_number, i.stok_tersedia, locked.stok_tersedia AS stok_sebelum
+        ), movement AS (
+            INSERT INTO mutasi_stok (id_cabang, sku, batch_number, jumlah, stok_setelah, jenis, id_opname, user_id)
+            SELECT id_cabang, sku, batch_number, stok_tersedia - stok_sebelum, stok_tersedia, 'stock_take', :id_opname, :user_id
+            FROM upd
+            WHERE stok_tersedia <> stok_sebelum
+        ), closed AS (
+            UPDATE stok_opname
+            SET status = 'applied', ditutup_pada = CURRENT_TIMESTAMP
+            WHERE id_opname = :id_opname
+        )
+        SELECT * FROM upd WHERE stok_tersedia <> stok_sebelum
+    """), {'id_opname': session.id_opname, 'id_cabang': session.id_cabang, 'user_id': user_id}).all()
+
+
+def cancel_session(session):
+    """Close a locked open session without touching stock"""
+    session.status = 'cancelled'
+    session.ditutup_pada = db.func.current_timestamp()
@@ -0,0 +1,97 @@
+# sync.py
+import base64
+
+from sqlalchemy import text, tuple_
+
+from app import db
+from models import Inventory, Transaksi
+
+
+class CursorExpired(Exception):
+    """The cursor points before the pruned part of the change log"""
+
+
+def encode_cursor(xid, seq):
+    return base64.urlsafe_b64encode(f'{xid}:{seq}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (xid, seq); raises ValueError for anything malformed"""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    xid, seq = base64.urlsafe_b64decode(padded.encode()).decode().split(':')
+    return int(xid), int(seq)
+
+
+def current_cursor():
+    """Cursor positioned after every change that is already settled"""
+    xmin = db.session.execute(text('SELECT pg_snapshot_xmin(pg_current_snapshot())::text')).scalar()
+    return encode_cursor(int(xmin), 0)
+
+
+def changes_since(cursor, branch=None, limit=500):
+    """Keys changed after `cursor`, in commit-safe order.
+
+    Only changes of transactions older than the oldest one still running
+    are returned, so a change that commits later can never sort before a
+    cursor already handed out.
+
+    Returns (inventory_keys, transaction_ids, next_cursor, has_more).
+    """
+    xid, seq = decode_cursor(cursor)
+
+    horizon = db.session.execute(text(
+        'SELECT xid::text, seq FROM change_log_horizon'
+    )).first()
+    if horizon and (xid, seq) < (int(horizon[0]), horizon[1]):
+        raise CursorExpired()
+
+    branch_filter = 'AND c.id_cabang = :branch' if branch else ''
+    rows = db.session.execute(text(f"""
+        SELECT c.xid::text AS xid, c.seq, c.entity, c.id_cabang, c.sku, c.batch_number, c.id_transaksi,
+               s.xmin::text AS xmin
+        FROM (SELECT pg_snapshot_xmin(pg_current_snapshot()) AS xmin) s
+        LEFT JOIN change_log c
+          ON (c.xid, c.seq) > (CAST(:xid AS text)::xid8, :seq)
+         AND c.xid < s.xmin
+         {branch_filter}
+        ORDER BY c.xid, c.seq
+        LIMIT :limit
+    """), {'xid': str(xid), 'seq': seq, 'branch': branch, 'limit': limit}).all()
+
+    # Without matches the LEFT JOIN still yields one row carrying xmin
+    changes = [row for row in rows if row.seq is not None]
+    xmin = int(rows[0].xmin)
+
+    inventory_keys = {}
+    transaction_ids = {}
+    for row in changes:
+        if row.entity == 'inventory':
+            inventory_keys[(row.id_cabang, row.sku, row.batch_number)] = None
+        else:
+            transaction_ids[row.id_transaksi] = None
+
+    has_more = len(changes) == limit
+    if has_more:
+        next_cursor = encode_cursor(int(changes[-1].xid), changes[-1].seq)
+    elif xmin > xid:
+        # Everything settled has been returned, skip ahead to the horizon
+        next_cursor = encode_cursor(xmin, 0)
+    else:
+        next_cursor = cursor
+
+    return list(inventory_keys), list(transaction_ids), next_cursor, has_more
+
+
+def load_inventory(keys):
+    """Current rows for the given (id_cabang, sku, batch_number) keys"""
+    if not keys:
+        return []
+    return Inventory.query.filter(
+        tuple_(Inventory.id_cabang, Inventory.sku, Inventory.batch_number).in_(keys)
+    ).all()
+
+
+def load_transactions(ids):
+    if not ids:
+        return []
+    return Transaksi.query.filter(Transaksi.id_transaksi.in_(ids)).all()
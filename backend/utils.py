@@ -1,20 +1,56 @@
 from functools import wraps
-from flask import jsonify, request
+from flask import current_app, g, jsonify, request
 import jwt
 from datetime import datetime, timedelta, timezone
 from config import Config
 from app import db
-from models import Transaksi  # Changed from app.models import Transaksi
+from sqlalchemy.orm import contains_eager
+from models import Inventory, PenjualanHarian, Produk, SaranPemesanan, Transaksi, WIB  # Changed from app.models import Transaksi
 from state import blacklisted_tokens
 
-def create_token(user_id):
-    """Create JWT token for authentication"""
+def create_token(user_id, branch_id=None, is_admin=False):
+    """Create JWT token for authentication; branch_id None means head office"""
     payload = {
         'user_id': user_id,
+        'branch_id': branch_id,
+        'is_admin': is_admin,
         'exp': datetime.now(timezone.utc) + timedelta(hours=12)
     }
     return jwt.encode(payload, Config.JWT_SECRET_KEY, algorithm='HS256')
 
+def create_stream_token(user_id, branch_id=None, is_admin=False):
+    """Short-lived token that only opens an event stream.
+
+    EventSource cannot send headers, so this one travels in the URL (and
+    with it into proxy logs); it is useless anywhere else and soon expired.
+    """
+    payload = {
+        'user_id': user_id,
+        'branch_id': branch_id,
+        'is_admin': is_admin,
+        'scope': 'stream',
+        'exp': datetime.now(timezone.utc) + timedelta(seconds=Config.SSE_TOKEN_SECONDS)
+    }
+    return jwt.encode(payload, Config.JWT_SECRET_KEY, algorithm='HS256')
+
+def accepts_query_token(view):
+    """Whether a view takes its token from ?access_token= (see stream_token_required)"""
+    return getattr(view, 'query_token', False)
+
+def _authenticate(token, scope=None):
+    """Claims of a valid token of the given scope (None: a session token)"""
+    if token in blacklisted_tokens:
+        raise jwt.InvalidTokenError('Token has been invalidated')
+    data = jwt.decode(token, Config.JWT_SECRET_KEY, algorithms=['HS256'])
+    if data.get('scope') != scope:
+        raise jwt.InvalidTokenError('Token has the wrong scope')
+    return data
+
+def _set_identity(data):
+    g.user_id = data.get('user_id')
+    g.branch_id = data.get('branch_id')
+    g.is_admin = bool(data.get('is_admin'))
+
 def token_required(f):
     """Decorator to protect routes"""
     @wraps(f)
@@ -24,22 +60,256 @@ def token_required(f):
             return jsonify({'message': 'Token is missing!'}), 401
         try:
             token = token.split()[1]  # Remove 'Bearer ' prefix
-            if token in blacklisted_tokens:
-                return jsonify({'message': 'Token has been invalidated'}), 401
-            data = jwt.decode(token, Config.JWT_SECRET_KEY, algorithms=['HS256'])
-        except:
+            data = _authenticate(token)
+        except Exception:
             return jsonify({'message': 'Token is invalid!'}), 401
+        _set_identity(data)
         return f(*args, **kwargs)
     return decorated
 
-def calculate_monthly_sales(year=None, month=None):
-    """Calculate total sales for a given month"""
-    from sqlalchemy import extract
-    
-    query = Transaksi.query
+def stream_token_required(f):
+    """Decorator for event streams: a session token in the Authorization
+    header, or a stream token (create_stream_token) in ?access_token="""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        header = request.headers.get('Authorization')
+        query_token = request.args.get('access_token')
+        if not header and not query_token:
+            return jsonify({'message': 'Token is missing!'}), 401
+        try:
+            if header:
+                data = _authenticate(header.split()[1])
+            else:
+                data = _authenticate(query_token, scope='stream')
+        except Exception:
+            return jsonify({'message': 'Token is invalid!'}), 401
+        _set_identity(data)
+        return f(*args, **kwargs)
+    decorated.query_token = True
+    return decorated
+
+def admin_required(f):
+    """Decorator for admin-only routes; use below @token_required"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not g.get('is_admin'):
+            return jsonify({'message': 'Admin access required'}), 403
+        return f(*args, **kwargs)
+    return decorated
+
+def request_token_payload():
+    """Claims of the request's bearer token, or None if absent or invalid.
+
+    For hooks that run before the route; routes use @token_required.
+    """
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        token, scope = header.split()[1], None
+    elif accepts_query_token(current_app.view_functions.get(request.endpoint)):
+        token, scope = request.args.get('access_token'), 'stream'
+    else:
+        return None
+    if not token:
+        return None
+    try:
+        return _authenticate(token, scope)
+    except jwt.InvalidTokenError:
+        return None
+
+def branch_scope():
+    """Outlet the request is limited to, or None for every outlet.
+
+    Outlet users are pinned to the outlet in their token; head office sees
+    all outlets unless it narrows the request with ?branch=<id_cabang>.
+    """
+    if g.get('branch_id') is not None:
+        return g.branch_id
+    return request.args.get('branch', type=int)
+
+def target_branch(data=None):
+    """The single outlet a request acts on (writes, one batch), or None if
+    a head-office user did not say which and there is no default"""
+    if g.get('branch_id') is not None:
+        return g.branch_id
+    if data and data.get('id_cabang') is not None:
+        return int(data['id_cabang'])
+    return request.args.get('branch', type=int) or Config.DEFAULT_BRANCH_ID
+
+def month_bounds(year, month):
+    """Return the [start, end) datetimes of a WIB calendar month"""
+    start = datetime(year, month, 1, tzinfo=WIB)
+    if month == 12:
+        end = datetime(year + 1, 1, 1, tzinfo=WIB)
+    else:
+        end = datetime(year, month + 1, 1, tzinfo=WIB)
+    return start, end
+
+def parse_date_range(start_date=None, end_date=None):
+    """Turn optional YYYY-MM-DD strings into a [start, end) range in WIB"""
+    start = datetime.strptime(start_date, '%Y-%m-%d').replace(tzinfo=WIB) if start_date else None
+    end = datetime.strptime(end_date, '%Y-%m-%d').replace(tzinfo=WIB) + timedelta(days=1) if end_date else None
+    return start, end
+
+def parse_point_in_time(value):
+    """Parse YYYY-MM-DD (start of that WIB day) or an ISO datetime; naive means WIB"""
+    if len(value) == 10:
+        return datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=WIB)
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=WIB)
+    return moment
+
+def monthly_sales_query(year=None, month=None, branch=None):
+    """Query for the sales total of a month, or of all time.
+
+    Reads the per-outlet daily aggregate, so even head-office totals never
+    scan transaksi.
+    """
+    query = PenjualanHarian.query
+    if branch:
+        query = query.filter(PenjualanHarian.id_cabang == branch)
     if year and month:
+        start, end = month_bounds(year, month)
+        query = query.filter(
+            PenjualanHarian.tanggal >= start.date(),
+            PenjualanHarian.tanggal < end.date()
+        )
+    return query.with_entities(db.func.sum(PenjualanHarian.total_amount))
+
+def calculate_monthly_sales(year=None, month=None, branch=None):
+    """Calculate total sales for a given month"""
+    return monthly_sales_query(year, month, branch).scalar() or 0
+
+def inventory_query(category=None, search=None, branch=None):
+    """Inventory rows filtered by outlet, exact category (one, or a list of
+    which any may match) and/or name/SKU search"""
+    # Filters and eager load share the one join to the product
+    query = Inventory.query.join(Inventory.produk).options(contains_eager(Inventory.produk))
+    if branch:
+        query = query.filter(Inventory.id_cabang == branch)
+    if isinstance(category, str):
+        query = query.filter(Produk.kategori == category)
+    elif category:
+        query = query.filter(Produk.kategori.in_(category))
+    if search:
+        search_term = f"%{search}%"
         query = query.filter(
-            extract('year', Transaksi.waktu_transaksi) == year,
-            extract('month', Transaksi.waktu_transaksi) == month
+            db.or_(
+                Produk.nama_item.ilike(search_term),
+                Produk.sku.ilike(search_term)
+            )
         )
-    return query.with_entities(db.func.sum(Transaksi.total_amount)).scalar() or 0
\ No newline at end of file
+    return query
+
+def transactions_query(start=None, end=None, branch=None):
+    """Transactions of an optional outlet within an optional [start, end) range"""
+    query = Transaksi.query
+    if branch:
+        query = query.filter(Transaksi.id_cabang == branch)
+    if start:
+        query = query.filter(Transaksi.waktu_transaksi >= start)
+    if end:
+        query = query.filter(Transaksi.waktu_transaksi < end)
+    return query
+
+def low_stock_query(branch=None):
+    """SKUs whose stock summed over an outlet's batches is below their minimum"""
+    query = db.session.query(
+        Produk.id_cabang,
+        Produk.sku,
+        Produk.nama_item,
+        Produk.stok_minimum,
+        # Sum up all available stock across batches
+        db.func.sum(Inventory.stok_tersedia).label('total_stock')
+    ).join(
+        Inventory, db.and_(Inventory.id_cabang == Produk.id_cabang, Inventory.sku == Produk.sku)
+    ).group_by(
+        # The primary key: the product's other columns come along
+        Produk.id_cabang,
+        Produk.sku
+    ).having(
+        # Compare total stock against minimum stock level
+        db.func.sum(Inventory.stok_tersedia) < Produk.stok_minimum
+    )
+    if branch:
+        query = query.filter(Produk.id_cabang == branch)
+    return query
+
+def reorder_query(branch=None, due_only=True):
+    """Forecast reorder points with the live stock and name of each SKU.
+
+    due_only keeps the SKUs whose stock has fallen to their reorder point.
+    """
+    stock = db.session.query(
+        Produk.id_cabang,
+        Produk.sku,
+        Produk.nama_item,
+        db.func.sum(Inventory.stok_tersedia).label('total_stock')
+    ).join(
+        Inventory, db.and_(Inventory.id_cabang == Produk.id_cabang, Inventory.sku == Produk.sku)
+    ).group_by(Produk.id_cabang, Produk.sku)
+    if branch:
+        stock = stock.filter(Produk.id_cabang == branch)
+    stock = stock.subquery()
+
+    query = db.session.query(
+        SaranPemesanan,
+        stock.c.nama_item,
+        stock.c.total_stock
+    ).join(
+        stock, db.and_(stock.c.id_cabang == SaranPemesanan.id_cabang, stock.c.sku == SaranPemesanan.sku)
+    ).order_by(SaranPemesanan.id_cabang, SaranPemesanan.sku)
+    if branch:
+        query = query.filter(SaranPemesanan.id_cabang == branch)
+    if due_only:
+        query = query.filter(stock.c.total_stock <= SaranPemesanan.titik_pemesanan)
+    return query
+
+def reorder_to_dict(row):
+    saran, nama_item, total_stock = row
+    return {
+        'id_cabang': saran.id_cabang,
+        'sku': saran.sku,
+        'nama_item': nama_item,
+        'stok_tersedia': int(total_stock or 0),
+        'titik_pemesanan': saran.titik_pemesanan,
+        'rata_harian': round(saran.rata_harian, 2),
+        'rata_harian_7': round(saran.rata_harian_7, 2),
+        'permintaan_lead_time': round(saran.permintaan_lead_time, 2),
+        'stok_pengaman': round(saran.stok_pengaman, 2),
+        'dihitung_pada': saran.dihitung_pada.isoformat()
+    }
+
+def inventory_to_dict(item, reserved=None):
+    """reserved: quantity held by carts, adds stok_reservasi and the sellable stok_bebas"""
+    result = {
+        'id_cabang': item.id_cabang,
+        'sku': item.sku,
+        'batch_number': item.batch_number,
+        'nama_item': item.nama_item,
+        'kategori': item.kategori,
+        'stok_tersedia': item.stok_tersedia,
+        'stok_minimum': item.stok_minimum,
+        'harga': item.harga,
+        'waktu_pembaruan': item.last_updated.isoformat() if item.last_updated else None
+    }
+    if reserved is not None:
+        result['stok_reservasi'] = reserved
+        result['stok_bebas'] = (item.stok_tersedia or 0) - reserved
+    return result
+
+def transaction_to_dict(t):
+    return {
+        'id_transaksi': t.id_transaksi,
+        'id_cabang': t.id_cabang,
+        'total_amount': t.total_amount,
+        'waktu_transaksi': t.waktu_transaksi.isoformat() if t.waktu_transaksi else None,
+        'items': [{
+            'sku': detail.sku,
+            'batch_number': detail.batch_number,
+            'nama_item': detail.inventory.nama_item,
+            'jumlah': detail.jumlah,
+            'harga_satuan': detail.harga_satuan,
+            'subtotal': detail.subtotal
+        } for detail in t.details]
+    }
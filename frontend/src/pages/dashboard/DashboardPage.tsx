@@ -1,6 +1,6 @@
 // src/pages/dashboard/DashboardPage.tsx
 import { useEffect, useState } from 'react';
-import { subMonths, format } from 'date-fns';
+import { format } from 'date-fns';
 import { dashboardApi, LowStockItem } from './api/dashboardApi';
 import { SalesChart } from './components/SalesChart';
 import { StockStatus } from './components/StockStatus';
@@ -22,27 +22,14 @@ export const DashboardPage = () => {
         setIsLoading(true);
         setError(null);
 
-        // Fetch sales data for last 12 months
-        const currentDate = new Date();
-        const monthlyData: ChartData[] = [];
+        // Sales for the last 12 months and low stock items in one request
+        const summary = await dashboardApi.getSummary(12);
 
-        for (let i = 0; i < 12; i++) {
-          const date = subMonths(currentDate, i);
-          const year = date.getFullYear();
-          const month = date.getMonth() + 1;
-
-          const salesResponse = await dashboardApi.getMonthlySales(year, month);
-          monthlyData.unshift({
-            date: format(date, 'MMM yyyy'),
-            sales: salesResponse.total_sales
-          });
-        }
-
-        setSalesData(monthlyData);
-
-        // Fetch low stock items
-        const lowStockResponse = await dashboardApi.getLowStockItems();
-        setLowStockItems(lowStockResponse);
+        setSalesData(summary.sales.map((entry) => ({
+          date: format(new Date(entry.year, entry.month - 1), 'MMM yyyy'),
+          sales: entry.total_sales
+        })));
+        setLowStockItems(summary.low_stock);
 
       } catch (err) {
         setError('Failed to fetch dashboard data');
@@ -53,6 +40,31 @@ export const DashboardPage = () => {
     };
 
     fetchData();
+
+    // Keep the dashboard current from pushed events instead of polling
+    const unsubscribe = dashboardApi.subscribeToEvents({
+      onSale: (event) => {
+        const label = format(new Date(event.waktu_transaksi), 'MMM yyyy');
+        setSalesData((current) => current.map((entry) =>
+          entry.date === label ? { ...entry, sales: entry.sales + event.delta } : entry
+        ));
+      },
+      onLowStock: (event) => {
+        setLowStockItems((current) => {
+          const others = current.filter((item) => item.sku !== event.sku);
+          if (event.status === 'recovered') return others;
+          return [...others, {
+            sku: event.sku,
+            nama_item: event.nama_item,
+            stok_tersedia: event.stok_tersedia,
+            stok_minimum: event.stok_minimum
+          }];
+        });
+      },
+      onResync: fetchData
+    });
+
+    return unsubscribe;
   }, []); // Empty dependency array means this runs once on mount
 
   if (isLoading) {
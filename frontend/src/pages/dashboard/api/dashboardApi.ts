@@ -14,7 +14,65 @@ export interface LowStockItem {
   stok_minimum: number;
 }
 
+export interface CategoryStock {
+  kategori: string | null;
+  sku_count: number;
+  total_stock: number;
+}
+
+export interface ReorderSuggestion {
+  id_cabang: number;
+  sku: string;
+  nama_item: string;
+  stok_tersedia: number;
+  titik_pemesanan: number;
+  rata_harian: number;
+  rata_harian_7: number;
+  permintaan_lead_time: number;
+  stok_pengaman: number;
+  dihitung_pada: string;
+}
+
+export interface DashboardSummary {
+  generated_at: string;
+  sales: MonthlySales[];
+  low_stock: LowStockItem[];
+  // SKUs at or below their forecast reorder point
+  reorder: ReorderSuggestion[];
+  categories: CategoryStock[];
+  transactions_today: number;
+}
+
+export interface SaleEvent {
+  action: 'created' | 'updated' | 'cancelled';
+  id_transaksi: number;
+  total_amount: number;
+  delta: number;
+  waktu_transaksi: string;
+}
+
+export interface LowStockEvent extends LowStockItem {
+  status: 'low' | 'recovered';
+}
+
+export interface DashboardEventHandlers {
+  onSale?: (event: SaleEvent) => void;
+  onLowStock?: (event: LowStockEvent) => void;
+  onResync?: () => void;
+}
+
 export const dashboardApi = {
+  // Sales series, low stock, category totals and today's count in one request
+  getSummary: async (months = 12) => {
+    try {
+      const response = await api.get<DashboardSummary>(`/dashboard/summary?months=${months}`);
+      return response.data;
+    } catch (error: any) {
+      console.error('Failed to fetch dashboard summary:', error.response?.data || error.message);
+      throw error;
+    }
+  },
+
   getMonthlySales: async (year: number, month: number) => {
     try {
       const response = await api.get<MonthlySales>(`/transactions/monthly-sales?year=${year}&month=${month}`);
@@ -33,5 +91,49 @@ export const dashboardApi = {
       console.error('Failed to fetch low stock items:', error.response?.data || error.message);
       throw error;
     }
+  },
+
+  // Live updates over Server-Sent Events; returns a function that closes the stream.
+  // EventSource cannot send headers, so the stream is opened with a
+  // short-lived stream token in the URL and reopened with a fresh one once
+  // the browser gives up reconnecting on the expired token.
+  subscribeToEvents: (handlers: DashboardEventHandlers) => {
+    let source: EventSource | null = null;
+    let closed = false;
+    let retryTimer: ReturnType<typeof setTimeout> | undefined;
+
+    const open = async () => {
+      try {
+        const response = await api.post<{ token: string }>('/events/token');
+        if (closed) return;
+        const url = `${import.meta.env.VITE_API_URL}/events/stream?access_token=${encodeURIComponent(response.data.token)}`;
+        source = new EventSource(url);
+      } catch (error: any) {
+        console.error('Failed to open event stream:', error.response?.data || error.message);
+        retryTimer = setTimeout(open, 5000);
+        return;
+      }
+
+      source.addEventListener('sale', (event) => {
+        handlers.onSale?.(JSON.parse((event as MessageEvent).data));
+      });
+      source.addEventListener('low_stock', (event) => {
+        handlers.onLowStock?.(JSON.parse((event as MessageEvent).data));
+      });
+      source.addEventListener('resync', () => handlers.onResync?.());
+      source.onerror = () => {
+        if (source?.readyState === EventSource.CLOSED && !closed) {
+          handlers.onResync?.();
+          retryTimer = setTimeout(open, 3000);
+        }
+      };
+    };
+    open();
+
+    return () => {
+      closed = true;
+      clearTimeout(retryTimer);
+      source?.close();
+    };
   }
 };
\ No newline at end of file
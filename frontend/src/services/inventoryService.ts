@@ -10,14 +10,39 @@ export interface InventoryItem {
   stok_minimum: number;
   harga: number;
   waktu_pembaruan?: string;
+  // Held by open carts, and what is left to sell
+  stok_reservasi?: number;
+  stok_bebas?: number;
+}
+
+export interface CategoryFacet {
+  kategori: string | null;
+  batch_count: number;
+  sku_count: number;
+  total_stock: number;
+}
+
+export interface InventoryFacets {
+  generated_at: string;
+  id_cabang: number | null;
+  categories: CategoryFacet[];
 }
 
 export const inventoryService = {
   getAllInventory: async (params?: { 
-    category?: string; 
+    category?: string | string[]; 
     search?: string;
   }) => {
-    const response = await api.get<InventoryItem[]>('/inventory', { params });
+    // Several categories are sent as repeated ?category= parameters
+    const response = await api.get<InventoryItem[]>('/inventory', {
+      params,
+      paramsSerializer: { indexes: null }
+    });
+    return response.data;
+  },
+
+  getFacets: async () => {
+    const response = await api.get<InventoryFacets>('/inventory/facets');
     return response.data;
   },
 
@@ -0,0 +1,50 @@
+// src/services/reservationService.ts
+import api from '../utils/axios';
+
+export interface CartLine {
+  id_cabang: number;
+  sku: string;
+  batch_number: string;
+  nama_item: string;
+  jumlah: number;
+  harga_satuan: number;
+  subtotal: number;
+}
+
+export interface Cart {
+  id_keranjang: string;
+  kedaluwarsa: string | null;
+  items: CartLine[];
+}
+
+export interface Reservation {
+  id_keranjang: string;
+  id_cabang: number;
+  sku: string;
+  batch_number: string;
+  jumlah: number;
+  kedaluwarsa: string;
+  stok_bebas: number;
+}
+
+// A cart holds stock while it is open; a 409 means the batch cannot cover
+// the quantity (the response carries stok_bebas)
+export const reservationService = {
+  newCartId: () => crypto.randomUUID(),
+
+  getCart: async (cartId: string) => {
+    const response = await api.get<Cart>(`/reservations/${cartId}`);
+    return response.data;
+  },
+
+  // jumlah 0 releases the line
+  setQuantity: async (cartId: string, sku: string, batch_number: string, jumlah: number) => {
+    const response = await api.put<Reservation>(`/reservations/${cartId}/${sku}/${batch_number}`, { jumlah });
+    return response.data;
+  },
+
+  releaseCart: async (cartId: string) => {
+    const response = await api.delete(`/reservations/${cartId}`);
+    return response.data;
+  }
+};
@@ -0,0 +1,90 @@
+// src/services/stockTakeService.ts
+import api from '../utils/axios';
+
+export interface StockTake {
+  id_opname: number;
+  id_cabang: number;
+  status: 'open' | 'applied' | 'cancelled';
+  catatan: string | null;
+  user_id: number | null;
+  dibuka_pada: string;
+  ditutup_pada: string | null;
+}
+
+export interface StockCount {
+  sku: string;
+  batch_number: string;
+  jumlah: number;
+}
+
+export interface VarianceLine {
+  sku: string;
+  batch_number: string;
+  nama_item: string | null;
+  kategori: string | null;
+  stok_sistem: number;
+  jumlah_hitung: number;
+  selisih: number;
+  nilai_selisih: number | null;
+  stok_tersedia: number | null;
+  stok_setelah: number | null;
+  dihitung_pada: string;
+}
+
+export interface VarianceReport {
+  stock_take: StockTake;
+  summary: {
+    counted: number;
+    uncounted: number | null;
+    with_variance: number;
+    surplus: number;
+    shortage: number;
+    net_value: number;
+  };
+  items: VarianceLine[];
+}
+
+// Server-side cap on lines per request (STOCK_TAKE_MAX_ITEMS)
+const COUNT_CHUNK = 5000;
+
+export const stockTakeService = {
+  list: async () => {
+    const response = await api.get<StockTake[]>('/stock-takes');
+    return response.data;
+  },
+
+  // A 409 carries the outlet's stock take that is already open
+  open: async (catatan?: string) => {
+    const response = await api.post<{ stock_take: StockTake }>('/stock-takes', { catatan });
+    return response.data.stock_take;
+  },
+
+  // Posts the counts in chunks; returns the lines of unknown batches
+  postCounts: async (id: number, counts: StockCount[]) => {
+    const unknown: { sku: string; batch_number: string }[] = [];
+    for (let start = 0; start < counts.length; start += COUNT_CHUNK) {
+      const response = await api.post(`/stock-takes/${id}/counts`, {
+        items: counts.slice(start, start + COUNT_CHUNK)
+      });
+      unknown.push(...response.data.unknown);
+    }
+    return unknown;
+  },
+
+  getReport: async (id: number, differencesOnly = false) => {
+    const response = await api.get<VarianceReport>(`/stock-takes/${id}`, {
+      params: differencesOnly ? { differences: 1 } : {}
+    });
+    return response.data;
+  },
+
+  apply: async (id: number) => {
+    const response = await api.post(`/stock-takes/${id}/apply`);
+    return response.data;
+  },
+
+  cancel: async (id: number) => {
+    const response = await api.delete(`/stock-takes/${id}`);
+    return response.data;
+  }
+};
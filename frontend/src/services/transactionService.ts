@@ -25,7 +25,8 @@ export const transactionService = {
     return response.data;
   },
 
-  createTransaction: async (data: { items: { sku: string; batch_number: string; jumlah: number; }[] }) => {
+  // Pass the cart's id_keranjang to convert its stock holds into the sale
+  createTransaction: async (data: { id_keranjang?: string; items: { sku: string; batch_number: string; jumlah: number; }[] }) => {
     const response = await api.post<Transaction>('/transactions', data);
     return response.data;
   },
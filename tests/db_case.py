@@ -0,0 +1,83 @@
+# ./tests/db_case.py
+"""Base class of the tests that run against a real database.
+
+They need a disposable Postgres database, given as TEST_DATABASE_URL; its
+public schema is dropped and rebuilt from the migrations for every test
+class.
+"""
+
+import os
+import sys
+import unittest
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+TEST_DATABASE_URL = os.getenv('TEST_DATABASE_URL')
+
+
+def reset_database():
+    """Drop everything and apply the migrations from scratch"""
+    conn = psycopg2.connect(TEST_DATABASE_URL)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute('DROP SCHEMA IF EXISTS public CASCADE')
+        cursor.execute('DROP SCHEMA IF EXISTS archive CASCADE')
+        cursor.execute('CREATE SCHEMA public')
+    conn.close()
+
+    import migrate
+    migrate.migrate(TEST_DATABASE_URL)
+
+
+@unittest.skipUnless(TEST_DATABASE_URL, 'TEST_DATABASE_URL is not set')
+class DatabaseTestCase(unittest.TestCase):
+    """A freshly migrated database and an app running against it.
+
+    `config` overrides settings of the test app. Subclasses seed their own
+    data in setUpClass after calling this one; `headers` authenticates as
+    user 1 of outlet 1.
+    """
+
+    config = {}
+
+    @classmethod
+    def setUpClass(cls):
+        reset_database()
+
+        from app import create_app
+        from config import Config
+
+        settings = {'SQLALCHEMY_DATABASE_URI': TEST_DATABASE_URL, 'RATE_LIMIT_ENABLED': False}
+        settings.update(cls.config)
+        cls.app = create_app(type('TestConfig', (Config,), settings))
+        cls.headers = cls.auth(1, branch_id=1)
+
+    @classmethod
+    def auth(cls, user_id, branch_id=None, is_admin=False):
+        """Authorization header of a token for the user; no branch is head office"""
+        from utils import create_token
+
+        with cls.app.app_context():
+            return {'Authorization': f'Bearer {create_token(user_id, branch_id, is_admin)}'}
+
+    @staticmethod
+    def execute(sql, params=None):
+        """Run one statement in its own committed transaction"""
+        conn = psycopg2.connect(TEST_DATABASE_URL)
+        with conn, conn.cursor() as cursor:
+            cursor.execute(sql, params)
+        conn.close()
+
+    @staticmethod
+    def query(sql, params=None):
+        conn = psycopg2.connect(TEST_DATABASE_URL)
+        with conn, conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        conn.close()
+        return rows
+
+    def setUp(self):
+        self.client = self.app.test_client()
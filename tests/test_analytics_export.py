@@ -0,0 +1,132 @@
+# ./tests/test_analytics_export.py
+"""Analytics snapshot export to SQLite.
+
+The database test needs a disposable Postgres database, given as
+TEST_DATABASE_URL; its public schema is dropped and rebuilt from the
+migrations.
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from analytics_export import _RowSink, export_snapshot
+
+from db_case import TEST_DATABASE_URL, DatabaseTestCase
+
+
+class RowSinkTestCase(unittest.TestCase):
+    def test_parses_copy_text_format(self):
+        lite = sqlite3.connect(':memory:')
+        lite.execute('CREATE TABLE t (a INTEGER, b TEXT, c REAL)')
+        sink = _RowSink(lite, 't', batch_size=2)
+        # Rows may arrive split at any point
+        for chunk in ['1\tplain\t2.5\n2\t\\N\t', '3\n3\ttab\\there\\\\line\\nbreak\t\\N\n', '4\tlast\t1\n']:
+            sink.write(chunk)
+        sink.flush()
+        self.assertEqual(sink.count, 4)
+        self.assertEqual(lite.execute('SELECT a, b, c FROM t ORDER BY a').fetchall(), [
+            (1, 'plain', 2.5),
+            (2, None, 3.0),
+            (3, 'tab\there\\line\nbreak', None),
+            (4, 'last', 1.0),
+        ])
+
+
+class AnalyticsExportTestCase(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = cls.auth(1, is_admin=True)
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'analytics.sqlite')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def export(self, full=False):
+        conn = psycopg2.connect(TEST_DATABASE_URL)
+        try:
+            return export_snapshot(conn, self.path, full)
+        finally:
+            conn.close()
+
+    def exported(self, sql, *params):
+        lite = sqlite3.connect(self.path)
+        try:
+            return lite.execute(sql, params).fetchall()
+        finally:
+            lite.close()
+
+    def sell(self, jumlah):
+        response = self.client.post('/transactions', json={
+            'items': [{'sku': 'ANL001', 'batch_number': 'B1', 'jumlah': jumlah}]
+        }, headers=self.headers)
+        self.assertEqual(response.status_code, 201)
+        return response.json['transaction_id']
+
+    def test_full_then_incremental(self):
+        self.client.post('/inventory', json={
+            'sku': 'ANL001', 'batch_number': 'B1', 'nama_item': 'Analytics', 'kategori': 'Test',
+            'harga': 1000, 'stok_tersedia': 50
+        }, headers=self.headers)
+        kept = self.sell(1)
+        cancelled = self.sell(2)
+
+        self.assertEqual(self.export()['mode'], 'full')
+        self.assertEqual(
+            self.exported('SELECT sku, batch_number, jumlah FROM transaksi_detail WHERE id_transaksi = ?', kept),
+            [('ANL001', 'B1', 1)]
+        )
+
+        added = self.sell(3)
+        self.client.delete(f'/transactions/{cancelled}', headers=self.headers)
+        summary = self.export()
+        self.assertEqual(summary['mode'], 'incremental')
+        self.assertEqual((summary['transaksi'], summary['removed']), (1, 1))
+
+        ids = {row[0] for row in self.exported('SELECT id_transaksi FROM transaksi')}
+        self.assertIn(kept, ids)
+        self.assertIn(added, ids)
+        self.assertNotIn(cancelled, ids)
+        self.assertEqual(self.exported("SELECT stok_tersedia FROM inventory WHERE sku = 'ANL001'"), [(46,)])
+
+        # A rebuild agrees with the refreshed file
+        before = self.exported('SELECT * FROM transaksi_detail ORDER BY id')
+        self.assertEqual(self.export(full=True)['mode'], 'full')
+        self.assertEqual(self.exported('SELECT * FROM transaksi_detail ORDER BY id'), before)
+
+    def test_refresh_runs_in_the_background(self):
+        from analytics_export import export_job
+
+        previous = self.app.config['ANALYTICS_EXPORT_PATH']
+        self.app.config['ANALYTICS_EXPORT_PATH'] = self.path
+        try:
+            # Without a replica a full copy would hold back the primary
+            response = self.client.post('/admin/analytics-export?full=1', headers=self.admin)
+            self.assertEqual(response.status_code, 409)
+
+            response = self.client.post('/admin/analytics-export', headers=self.admin)
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.headers['Location'], '/admin/analytics-export/status')
+            export_job.join(30)
+
+            status = self.client.get('/admin/analytics-export/status', headers=self.admin).json
+            self.assertFalse(status['running'])
+            self.assertEqual(status['last_run']['state'], 'done')
+            self.assertEqual(status['snapshot']['mode'], status['last_run']['summary']['mode'])
+        finally:
+            self.app.config['ANALYTICS_EXPORT_PATH'] = previous
+
+
+if __name__ == '__main__':
+    unittest.main()
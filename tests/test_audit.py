@@ -0,0 +1,114 @@
+# ./tests/test_audit.py
+
+import os
+import sys
+import threading
+import time
+import unittest
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+import metrics
+from app import create_app
+from audit import AuditWriter, diff
+from db_case import DatabaseTestCase
+
+
+class RecordingWriter(AuditWriter):
+    """Collects flushed batches instead of inserting them"""
+
+    def __init__(self, block=None):
+        super().__init__()
+        self.batches = []
+        self.block = block
+
+    def _flush(self, batch, attempts=3):
+        if self.block is not None:
+            self.block.wait(5)
+        if batch:
+            self.batches.append(batch)
+
+
+def make_app(**config):
+    app = create_app()
+    app.config.update(AUDIT_BUFFER_SIZE=100, AUDIT_BATCH_SIZE=50,
+                      AUDIT_FLUSH_INTERVAL_MS=50, AUDIT_ENQUEUE_TIMEOUT_MS=1)
+    app.config.update(config)
+    return app
+
+
+def entries(count):
+    return [{'entity': 'inventory', 'action': 'updated', 'n': i} for i in range(count)]
+
+
+class AuditTestCase(unittest.TestCase):
+    def test_diff_keeps_changed_fields_only(self):
+        self.assertEqual(
+            diff({'harga': 1000, 'stok_tersedia': 5}, {'harga': 1200, 'stok_tersedia': 5}),
+            {'harga': [1000, 1200]}
+        )
+        self.assertEqual(diff(None, {'harga': 1000}), {'harga': [None, 1000]})
+
+    def test_entries_are_written_in_batches(self):
+        writer = RecordingWriter()
+        writer.init_app(make_app())
+        writer.enqueue(entries(120))
+        writer.stop()
+
+        self.assertEqual(sum(len(batch) for batch in writer.batches), 120)
+        self.assertLessEqual(max(len(batch) for batch in writer.batches), 50)
+        self.assertLess(len(writer.batches), 120)
+
+    def test_stop_flushes_everything_buffered(self):
+        """Entries still queued at shutdown are written, not lost"""
+        writer = RecordingWriter()
+        writer.init_app(make_app(AUDIT_FLUSH_INTERVAL_MS=10000))
+        writer.enqueue(entries(10))
+        writer.stop()
+        self.assertEqual(sum(len(batch) for batch in writer.batches), 10)
+
+    def test_full_buffer_drops_instead_of_blocking(self):
+        release = threading.Event()
+        writer = RecordingWriter(block=release)
+        writer.init_app(make_app(AUDIT_BUFFER_SIZE=5, AUDIT_BATCH_SIZE=1))
+        dropped_before = metrics.snapshot().get(('audit_entries_dropped_total', (('reason', 'buffer_full'),)), 0)
+
+        started = time.perf_counter()
+        writer.enqueue(entries(50))
+        self.assertLess(time.perf_counter() - started, 1)
+
+        dropped = metrics.snapshot().get(('audit_entries_dropped_total', (('reason', 'buffer_full'),)), 0)
+        self.assertGreater(dropped - dropped_before, 0)
+        release.set()
+        writer.stop()
+
+
+class AuditLogTestCase(DatabaseTestCase):
+    def entry(self, n, request_id=None):
+        return {'waktu': datetime.now(timezone.utc), 'user_id': 1, 'id_cabang': 1, 'entity': 'inventory',
+                'action': 'updated', 'entity_key': {'n': n}, 'perubahan': {}, 'request_id': request_id}
+
+    def test_bad_entry_does_not_drop_its_batch(self):
+        writer = AuditWriter()
+        writer.init_app(self.app)
+        # Too long for the request_id column
+        writer._flush([self.entry(1), self.entry(2, 'x' * 65), self.entry(3)])
+        rows = self.query("SELECT entity_key->>'n' FROM audit_log ORDER BY id")
+        self.assertEqual(rows, [('1',), ('3',)])
+
+    def test_only_admins_read_the_trail(self):
+        self.assertEqual(self.client.get('/audit', headers=self.headers).status_code, 403)
+        response = self.client.get('/audit', headers=self.auth(1, branch_id=1, is_admin=True))
+        self.assertEqual(response.status_code, 200)
+
+    def test_unusable_request_ids_are_replaced(self):
+        response = self.client.get('/branches', headers={**self.headers, 'X-Request-ID': 'r' * 65})
+        self.assertNotEqual(response.headers['X-Request-ID'], 'r' * 65)
+        self.assertLessEqual(len(response.headers['X-Request-ID']), 64)
+        response = self.client.get('/branches', headers={**self.headers, 'X-Request-ID': 'edge-7f3a'})
+        self.assertEqual(response.headers['X-Request-ID'], 'edge-7f3a')
+
+
+if __name__ == '__main__':
+    unittest.main()
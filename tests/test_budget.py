@@ -0,0 +1,100 @@
+# ./tests/test_budget.py
+"""Per-request latency budgets enforced by Postgres timeouts.
+
+Needs a disposable Postgres database, given as TEST_DATABASE_URL; its
+public schema is dropped and rebuilt from the migrations.
+"""
+
+import os
+import sqlite3
+import sys
+import unittest
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from config import Config
+from db_case import TEST_DATABASE_URL, DatabaseTestCase
+
+
+class PoolExhaustedTestCase(unittest.TestCase):
+    def test_checkout_timeout_is_shed(self):
+        from sqlalchemy.exc import TimeoutError as PoolTimeout
+
+        from budget import Overloaded, PoolExhausted, SheddingQueuePool
+
+        pool = SheddingQueuePool(lambda: sqlite3.connect(':memory:'), pool_size=1, max_overflow=0, timeout=0.01)
+        held = pool.connect()
+        with self.assertRaises(PoolExhausted) as caught:
+            pool.connect()
+        # Routes let it through as Overloaded, the app answers it as a pool timeout
+        self.assertIsInstance(caught.exception, Overloaded)
+        self.assertIsInstance(caught.exception, PoolTimeout)
+        held.close()
+        pool.connect().close()
+
+
+class BudgetTestCase(DatabaseTestCase):
+    config = {'LATENCY_BUDGETS_MS': dict(Config.LATENCY_BUDGETS_MS, read=300)}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from sqlalchemy import text
+
+        from app import db
+        from budget import latency_budget
+
+        @cls.app.route('/_test/timeouts')
+        def timeouts():
+            return {
+                'statement_timeout': db.session.execute(text('SHOW statement_timeout')).scalar(),
+                'lock_timeout': db.session.execute(text('SHOW lock_timeout')).scalar()
+            }
+
+        @cls.app.route('/_test/sleep')
+        def sleep():
+            db.session.execute(text('SELECT pg_sleep(5)'))
+            return {}
+
+        @cls.app.route('/_test/lock')
+        @latency_budget(200)
+        def lock():
+            db.session.execute(text('SELECT * FROM cabang WHERE id_cabang = 1 FOR UPDATE'))
+            return {}
+
+    def test_transaction_gets_the_remaining_budget(self):
+        response = self.client.get('/_test/timeouts')
+        self.assertLessEqual(int(response.json['statement_timeout'].rstrip('ms')), 300)
+        self.assertEqual(response.json['lock_timeout'], response.json['statement_timeout'])
+
+    def test_runaway_statement_is_cancelled(self):
+        import metrics
+
+        response = self.client.get('/_test/sleep')
+        self.assertEqual(response.status_code, 504)
+        self.assertEqual(response.json['code'], 'latency_budget_exceeded')
+        counted = metrics.snapshot().get(
+            ('latency_budget_exceeded_total', (('endpoint', 'sleep'), ('reason', 'statement_timeout'))))
+        self.assertEqual(counted, 1)
+
+        # The timeouts were local to the request's transaction
+        from app import db
+        from sqlalchemy import text
+        with self.app.app_context():
+            self.assertEqual(db.session.execute(text('SHOW statement_timeout')).scalar(), '0')
+
+    def test_lock_wait_is_cut_short(self):
+        holder = psycopg2.connect(TEST_DATABASE_URL)
+        try:
+            with holder.cursor() as cursor:
+                cursor.execute('SELECT * FROM cabang WHERE id_cabang = 1 FOR UPDATE')
+                response = self.client.get('/_test/lock')
+        finally:
+            holder.close()
+        self.assertEqual(response.status_code, 504)
+
+
+if __name__ == '__main__':
+    unittest.main()
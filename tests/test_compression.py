@@ -0,0 +1,72 @@
+# ./tests/test_compression.py
+
+import gzip
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from flask import Flask, Response, jsonify
+
+from compression import compress, init_compression
+
+
+class CompressionTestCase(unittest.TestCase):
+    def setUp(self):
+        """Minimal app with the compression hook, no database needed"""
+        self.app = Flask(__name__)
+        init_compression(self.app)
+
+        @self.app.route('/large')
+        def large():
+            return jsonify([{'sku': f'SKU{i:05d}', 'nama_item': 'Paracetamol 500mg'} for i in range(500)])
+
+        @self.app.route('/small')
+        def small():
+            return jsonify({'status': 'ok'})
+
+        @self.app.route('/export')
+        def export():
+            def rows():
+                yield 'sku,jumlah\n'
+                for i in range(1000):
+                    yield f'SKU{i:05d},{i}\n'
+            return Response(rows(), mimetype='text/csv')
+
+        @self.app.route('/uncompressed')
+        @compress(enabled=False)
+        def uncompressed():
+            return jsonify(['x' * 5000])
+
+        self.client = self.app.test_client()
+
+    def test_large_json_is_gzipped(self):
+        response = self.client.get('/large', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        body = gzip.decompress(response.data)
+        self.assertTrue(body.startswith(b'[{'))
+
+    def test_no_compression_without_accept_encoding(self):
+        response = self.client.get('/large')
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_small_payload_is_not_compressed(self):
+        response = self.client.get('/small', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_streamed_export_is_compressed(self):
+        response = self.client.get('/export', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', response.headers)
+        lines = gzip.decompress(response.data).decode().splitlines()
+        self.assertEqual(len(lines), 1001)
+
+    def test_route_can_opt_out(self):
+        response = self.client.get('/uncompressed', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# ./tests/test_daily_sales.py
+"""Per-outlet daily sales counters, against a real database.
+
+Needs a disposable Postgres database, given as TEST_DATABASE_URL; its
+public schema is dropped and rebuilt from the migrations.
+"""
+
+import os
+import sys
+import unittest
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from db_case import TEST_DATABASE_URL, DatabaseTestCase
+
+SALE = """
+    INSERT INTO transaksi (id_transaksi, id_cabang, total_amount)
+    VALUES (%s, 1, %s)
+"""
+
+
+class DailySalesTestCase(DatabaseTestCase):
+    def today(self):
+        conn = psycopg2.connect(TEST_DATABASE_URL)
+        with conn, conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT COALESCE(sum(total_amount), 0), COALESCE(sum(jumlah_transaksi), 0)
+                FROM penjualan_harian
+                WHERE id_cabang = 1 AND tanggal = (now() AT TIME ZONE 'Asia/Jakarta')::date
+            """)
+            row = cursor.fetchone()
+        conn.close()
+        return row
+
+    def test_concurrent_sales_do_not_wait_on_each_other(self):
+        before_amount, before_count = self.today()
+        first = psycopg2.connect(TEST_DATABASE_URL)
+        second = psycopg2.connect(TEST_DATABASE_URL)
+        try:
+            with first.cursor() as cursor:
+                cursor.execute(SALE, (900001, 100))
+            # The first sale is still uncommitted; a sale of the same outlet
+            # on another shard must not queue behind it
+            with second.cursor() as cursor:
+                cursor.execute("SET lock_timeout = '500ms'")
+                cursor.execute(SALE, (900002, 50))
+            second.commit()
+            first.commit()
+
+            with first.cursor() as cursor:
+                # An edit and a cancellation move the counters back
+                cursor.execute('UPDATE transaksi SET total_amount = 120 WHERE id_transaksi = 900001')
+                cursor.execute('DELETE FROM transaksi WHERE id_transaksi = 900002')
+            first.commit()
+        finally:
+            first.close()
+            second.close()
+
+        amount, count = self.today()
+        self.assertEqual((amount - before_amount, count - before_count), (120, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
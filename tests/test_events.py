@@ -0,0 +1,116 @@
+# ./tests/test_events.py
+"""Event broker LISTEN connection and stream authentication, against a real database.
+
+Needs a disposable Postgres database, given as TEST_DATABASE_URL; its
+public schema is dropped and rebuilt from the migrations.
+"""
+
+import os
+import queue
+import select
+import sys
+import unittest
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from db_case import TEST_DATABASE_URL, DatabaseTestCase
+
+
+class EventBrokerTestCase(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from utils import create_stream_token
+
+        with cls.app.app_context():
+            cls.stream_token = create_stream_token(1, branch_id=1)
+        cls.token = cls.headers['Authorization'].split()[1]
+
+    def notify(self, payload):
+        conn = psycopg2.connect(TEST_DATABASE_URL)
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', ('apotek_events', payload))
+        conn.close()
+
+    def test_connect_listens_on_a_detached_connection(self):
+        from events import EventBroker
+
+        broker = EventBroker()
+        broker.init_app(self.app)
+        conn = broker._connect()
+        try:
+            self.assertFalse(conn.closed)
+            self.notify('{"kind": "sale", "data": {"id_cabang": 1}}')
+            self.assertNotEqual(select.select([conn], [], [], 5), ([], [], []))
+            conn.poll()
+            self.assertEqual([n.payload for n in conn.notifies], ['{"kind": "sale", "data": {"id_cabang": 1}}'])
+        finally:
+            conn.close()
+
+    def test_subscriber_receives_notifications(self):
+        from events import EventBroker
+
+        broker = EventBroker()
+        broker.init_app(self.app)
+        subscriber = broker.subscribe()
+        try:
+            # The listener thread may not have issued LISTEN yet
+            for _ in range(50):
+                self.notify('{"kind": "stock", "data": {"id_cabang": 1}}')
+                try:
+                    message = subscriber.get(timeout=0.2)
+                    break
+                except queue.Empty:
+                    continue
+            else:
+                self.fail('no event delivered')
+            self.assertEqual(message['kind'], 'stock')
+        finally:
+            broker.unsubscribe(subscriber)
+
+    def test_stream_takes_only_stream_tokens_in_the_url(self):
+        response = self.client.get(f'/events/stream?access_token={self.token}')
+        self.assertEqual(response.status_code, 401)
+
+        response = self.client.get(f'/events/stream?access_token={self.stream_token}')
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+        token = self.client.post('/events/token', headers={'Authorization': f'Bearer {self.token}'}).json['token']
+        response = self.client.get(f'/events/stream?access_token={token}')
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+    def test_streams_per_worker_are_capped(self):
+        from events import EventBroker, StreamLimitReached
+
+        cap = self.app.config['SSE_MAX_STREAMS_PER_WORKER']
+        self.app.config['SSE_MAX_STREAMS_PER_WORKER'] = 1
+        try:
+            broker = EventBroker()
+            broker.init_app(self.app)
+            subscriber = broker.subscribe()
+            with self.assertRaises(StreamLimitReached):
+                broker.subscribe()
+            broker.unsubscribe(subscriber)
+            broker.unsubscribe(broker.subscribe())
+
+            self.app.config['SSE_MAX_STREAMS_PER_WORKER'] = 0
+            response = self.client.get(f'/events/stream?access_token={self.stream_token}')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers['Retry-After'], '5')
+        finally:
+            self.app.config['SSE_MAX_STREAMS_PER_WORKER'] = cap
+
+    def test_other_routes_ignore_url_tokens(self):
+        self.assertEqual(self.client.get(f'/inventory?access_token={self.token}').status_code, 401)
+        # A stream token is no bearer token either
+        response = self.client.get('/inventory', headers={'Authorization': f'Bearer {self.stream_token}'})
+        self.assertEqual(response.status_code, 401)
+
+
+if __name__ == '__main__':
+    unittest.main()
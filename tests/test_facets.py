@@ -0,0 +1,63 @@
+# ./tests/test_facets.py
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from app import create_app
+from facets import FacetCache
+
+
+class FacetCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.cache = FacetCache()
+        # No LISTEN connection: events are fed to on_event directly
+        self.cache._listening = True
+        self.builds = []
+
+    def build(self, branch):
+        self.builds.append(branch)
+        return {'id_cabang': branch, 'build': len(self.builds)}
+
+    def test_entries_are_reused_until_they_expire(self):
+        first, hit = self.cache.get(2, 60, self.build)
+        self.assertFalse(hit)
+        second, hit = self.cache.get(2, 60, self.build)
+        self.assertTrue(hit)
+        self.assertIs(first, second)
+        self.cache.get(3, 0, self.build)
+        self.cache.get(3, 0, self.build)
+        self.assertEqual(self.builds, [2, 3, 3])
+
+    def test_outlet_event_drops_that_outlet_and_all_outlets(self):
+        for branch in (None, 2, 3):
+            self.cache.get(branch, 60, self.build)
+        self.cache.on_event({'kind': 'stock', 'data': {'id_cabang': 2, 'items': []}})
+        for branch in (None, 2, 3):
+            self.cache.get(branch, 60, self.build)
+        self.assertEqual(self.builds, [None, 2, 3, None, 2])
+
+    def test_resync_and_unrelated_events(self):
+        self.cache.get(2, 60, self.build)
+        self.cache.on_event({'kind': 'low_stock', 'data': {'id_cabang': 2}})
+        self.cache.get(2, 60, self.build)
+        self.assertEqual(self.builds, [2])
+        self.cache.on_event({'kind': 'resync', 'data': {}})
+        self.cache.get(2, 60, self.build)
+        self.assertEqual(self.builds, [2, 2])
+
+    def test_result_built_across_an_invalidation_is_not_cached(self):
+        def racing_build(branch):
+            self.cache.on_event({'kind': 'sale', 'data': {'id_cabang': branch}})
+            return self.build(branch)
+
+        self.cache.get(2, 60, racing_build)
+        _, hit = self.cache.get(2, 60, self.build)
+        self.assertFalse(hit)
+
+
+if __name__ == '__main__':
+    unittest.main()
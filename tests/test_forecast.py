@@ -0,0 +1,50 @@
+# ./tests/test_forecast.py
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+import numpy as np
+
+from forecast import reorder_points
+
+
+class ReorderPointTestCase(unittest.TestCase):
+    def test_steady_demand_needs_no_safety_stock(self):
+        result = reorder_points(np.full((1, 28), 3.0), lead_time_days=7, service_z=1.65)
+        self.assertAlmostEqual(result['rata_harian'][0], 3.0)
+        self.assertAlmostEqual(result['stok_pengaman'][0], 0.0)
+        self.assertEqual(result['titik_pemesanan'][0], 21)
+
+    def test_unsold_sku_has_zero_reorder_point(self):
+        result = reorder_points(np.zeros((2, 28)), lead_time_days=7, service_z=1.65)
+        self.assertEqual(list(result['titik_pemesanan']), [0, 0])
+
+    def test_variable_demand_adds_safety_stock(self):
+        demand = np.tile([6.0, 0.0], (1, 14))
+        result = reorder_points(demand, lead_time_days=4, service_z=2)
+        self.assertAlmostEqual(result['permintaan_lead_time'][0], 12.0)
+        expected_safety = 2 * demand[0].std(ddof=1) * 2
+        self.assertAlmostEqual(result['stok_pengaman'][0], expected_safety)
+        self.assertEqual(result['titik_pemesanan'][0], int(np.ceil(12 + expected_safety)))
+
+    def test_recent_rise_raises_demand_but_drop_does_not_lower_it(self):
+        rising = np.concatenate([np.zeros(21), np.full(7, 4.0)])
+        falling = rising[::-1]
+        result = reorder_points(np.vstack([rising, falling]), lead_time_days=1, service_z=0)
+        self.assertEqual(result['titik_pemesanan'][0], 4)
+        self.assertEqual(result['titik_pemesanan'][1], 1)
+
+    def test_rows_are_independent(self):
+        """Each SKU's result matches computing it on its own"""
+        rng = np.random.default_rng(7)
+        demand = rng.poisson(2.0, size=(500, 28)).astype(float)
+        together = reorder_points(demand, lead_time_days=7, service_z=1.65)['titik_pemesanan']
+        alone = [reorder_points(demand[i:i + 1], 7, 1.65)['titik_pemesanan'][0] for i in (0, 250, 499)]
+        self.assertEqual([together[0], together[250], together[499]], alone)
+
+
+if __name__ == '__main__':
+    unittest.main()
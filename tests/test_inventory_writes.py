@@ -0,0 +1,124 @@
+# ./tests/test_inventory_writes.py
+"""Single-statement inventory writes, against a real database.
+
+Needs a disposable Postgres database, given as TEST_DATABASE_URL; its
+public schema is dropped and rebuilt from the migrations.
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from db_case import TEST_DATABASE_URL, DatabaseTestCase
+
+
+class InventoryWritesTestCase(DatabaseTestCase):
+    def create(self, sku, batch_number, **fields):
+        data = {'sku': sku, 'batch_number': batch_number, 'nama_item': 'Item',
+                'kategori': 'Test', 'harga': 1000, 'stok_tersedia': 5}
+        data.update(fields)
+        return self.client.post('/inventory', json=data, headers=self.headers)
+
+    def movements(self, sku):
+        conn = psycopg2.connect(TEST_DATABASE_URL)
+        with conn, conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT batch_number, jenis, jumlah, stok_setelah, user_id
+                FROM mutasi_stok WHERE sku = %s ORDER BY id
+            """, (sku,))
+            rows = cursor.fetchall()
+        conn.close()
+        return rows
+
+    def test_insert_records_the_receipt(self):
+        response = self.create('INW001', 'B1', stok_tersedia=7)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json['inventory']['stok_tersedia'], 7)
+        self.assertEqual(self.movements('INW001'), [('B1', 'receipt', 7, 7, 1)])
+
+        # ON CONFLICT leaves the batch and the ledger alone
+        response = self.create('INW001', 'B1', stok_tersedia=99)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.movements('INW001'), [('B1', 'receipt', 7, 7, 1)])
+
+    def test_update_returns_previous_values(self):
+        from app import db
+        from inventory_writes import previous_state, update_batch
+
+        self.create('INW002', 'B1', stok_tersedia=5)
+        with self.app.app_context():
+            row = update_batch(1, 'INW002', 'B1', {'harga': 1500, 'stok_tersedia': 8})
+            db.session.commit()
+        self.assertEqual((row.harga, row.stok_tersedia), (1500, 8))
+        self.assertEqual(previous_state(row), {
+            'nama_item': 'Item', 'kategori': 'Test', 'stok_minimum': 10, 'harga': 1000, 'stok_tersedia': 5
+        })
+        self.assertEqual(self.movements('INW002')[1:], [('B1', 'adjustment', 3, 8, None)])
+
+        # Setting the same stock is no movement
+        response = self.client.put('/inventory/INW002/B1', json={'stok_tersedia': 8, 'kategori': 'Other'},
+                                   headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['inventory']['kategori'], 'Other')
+        self.assertEqual(len(self.movements('INW002')), 2)
+
+        response = self.client.put('/inventory/INW002/B9', json={'harga': 1}, headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+    def test_delete_tells_missing_from_sold(self):
+        self.assertEqual(self.client.delete('/inventory/INW003/B1', headers=self.headers).status_code, 404)
+
+        self.create('INW003', 'B1', stok_tersedia=5)
+        self.create('INW003', 'B2', stok_tersedia=4)
+        response = self.client.post('/transactions', json={
+            'items': [{'sku': 'INW003', 'batch_number': 'B1', 'jumlah': 1}]
+        }, headers=self.headers)
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.delete('/inventory/INW003/B1', headers=self.headers)
+        self.assertEqual(response.status_code, 409)
+
+        response = self.client.delete('/inventory/INW003/B2', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['deleted_item']['nama_item'], 'Item')
+        # The ledger closes the deleted batch at zero
+        self.assertEqual(self.movements('INW003')[-1], ('B2', 'delete', -4, 0, 1))
+        self.assertEqual(self.client.delete('/inventory/INW003/B2', headers=self.headers).status_code, 404)
+
+    def test_concurrent_deletes_take_the_product_with_the_last_batch(self):
+        self.create('INW004', 'B1')
+        self.create('INW004', 'B2')
+
+        other = psycopg2.connect(TEST_DATABASE_URL)
+        try:
+            # Another request deleting B1, still uncommitted
+            with other.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM produk WHERE id_cabang = 1 AND sku = 'INW004' FOR UPDATE")
+                cursor.execute("DELETE FROM inventory WHERE id_cabang = 1 AND sku = 'INW004' AND batch_number = 'B1'")
+            responses = []
+            request = threading.Thread(target=lambda: responses.append(
+                self.app.test_client().delete('/inventory/INW004/B2', headers=self.headers)))
+            request.start()
+            time.sleep(0.3)
+            self.assertTrue(request.is_alive())
+            other.commit()
+            request.join()
+        finally:
+            other.close()
+
+        self.assertEqual(responses[0].status_code, 200)
+        conn = psycopg2.connect(TEST_DATABASE_URL)
+        with conn, conn.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM produk WHERE sku = 'INW004'")
+            self.assertEqual(cursor.fetchone(), (0,))
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
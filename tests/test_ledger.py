@@ -0,0 +1,118 @@
+# ./tests/test_ledger.py
+"""The stock ledger and its snapshots, against a real database.
+
+Needs a disposable Postgres database, given as TEST_DATABASE_URL; its
+public schema is dropped and rebuilt from the migrations.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from db_case import DatabaseTestCase
+
+
+class LedgerTestCase(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.execute("INSERT INTO cabang (id_cabang, kode, nama) VALUES (2, 'CAB2', 'Outlet Dua')")
+        cls.head_office = cls.auth(1)
+
+    def now(self):
+        return self.query('SELECT now()')[0][0]
+
+    def replayed(self, branch, at):
+        """Stock of LED1/B1 at `at` from the ledger alone"""
+        return self.query("""
+            SELECT coalesce(sum(jumlah), 0) FROM mutasi_stok
+            WHERE id_cabang = %s AND sku = 'LED1' AND batch_number = 'B1' AND waktu <= %s
+        """, (branch, at))[0][0]
+
+    def stock_at(self, at, headers):
+        response = self.client.get('/inventory/stock-at', query_string={'at': at.isoformat(), 'sku': 'LED1'},
+                                   headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return {item['id_cabang']: item['stok'] for item in response.json['items']}
+
+    def test_stock_at_matches_the_replayed_ledger_around_a_snapshot(self):
+        for branch, stock in ((1, 10), (2, 4)):
+            response = self.client.post('/inventory', json={
+                'id_cabang': branch, 'sku': 'LED1', 'batch_number': 'B1', 'nama_item': 'Ledger',
+                'kategori': 'Test', 'harga': 1000, 'stok_tersedia': stock
+            }, headers=self.head_office)
+            self.assertEqual(response.status_code, 201)
+        received = self.now()
+
+        response = self.client.post('/transactions', json={
+            'items': [{'sku': 'LED1', 'batch_number': 'B1', 'jumlah': 3}]
+        }, headers=self.headers)
+        self.assertEqual(response.status_code, 201)
+        id_transaksi = response.json['transaction_id']
+        sold = self.now()
+
+        response = self.client.put(f'/transactions/{id_transaksi}', json={
+            'items': [{'sku': 'LED1', 'batch_number': 'B1', 'jumlah': 1}]
+        }, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        edited = self.now()
+
+        self.assertEqual(self.client.delete(f'/transactions/{id_transaksi}', headers=self.headers).status_code, 200)
+        cancelled = self.now()
+
+        batches = self.query("""
+            SELECT count(DISTINCT (id_cabang, sku, batch_number)) FROM mutasi_stok WHERE waktu <= %s
+        """, (edited,))
+        self.assertEqual(self.query('SELECT take_stock_snapshot(%s)', (edited,)), batches)
+        self.assertEqual(self.query('SELECT take_stock_snapshot(%s)', (edited,)), [(0,)])
+        self.assertEqual(self.query("""
+            SELECT id_cabang, stok FROM snapshot_stok WHERE sku = 'LED1' ORDER BY id_cabang
+        """), [(1, 9), (2, 4)])
+
+        # Before the snapshot the ledger is replayed from the start, at and
+        # after it only the tail past the snapshot
+        for at, expected in ((received, 10), (sold, 7), (edited, 9), (cancelled, 10)):
+            self.assertEqual(self.replayed(1, at), expected)
+            self.assertEqual(self.stock_at(at, self.head_office), {1: expected, 2: 4})
+            self.assertEqual(self.stock_at(at, self.headers), {1: expected})
+
+        from ledger import stock_at
+        with self.app.app_context():
+            rows = stock_at(cancelled, 'LED1', 'B1', 2)
+        self.assertEqual([(row.id_cabang, row.sku, row.batch_number, row.stok) for row in rows],
+                         [(2, 'LED1', 'B1', 4)])
+
+        self.assertEqual(self.client.get('/inventory/stock-at', headers=self.headers).status_code, 400)
+
+    def test_movement_history_is_ordered_and_per_outlet(self):
+        for branch, stock in ((1, 6), (2, 8)):
+            self.client.post('/inventory', json={
+                'id_cabang': branch, 'sku': 'LED2', 'batch_number': 'B1', 'nama_item': 'Ledger',
+                'kategori': 'Test', 'harga': 1000, 'stok_tersedia': stock
+            }, headers=self.head_office)
+        response = self.client.post('/transactions', json={
+            'items': [{'sku': 'LED2', 'batch_number': 'B1', 'jumlah': 2}]
+        }, headers=self.headers)
+        id_transaksi = response.json['transaction_id']
+        self.client.put(f'/transactions/{id_transaksi}', json={
+            'items': [{'sku': 'LED2', 'batch_number': 'B1', 'jumlah': 5}]
+        }, headers=self.headers)
+        self.client.delete(f'/transactions/{id_transaksi}', headers=self.headers)
+
+        movements = self.client.get('/inventory/LED2/B1/movements', headers=self.headers).json
+        self.assertEqual([(m['jenis'], m['jumlah'], m['stok_setelah']) for m in movements], [
+            ('receipt', 6, 6), ('sale', -2, 4), ('sale_edit', 2, 6), ('sale', -5, 1), ('cancel', 5, 6)
+        ])
+        self.assertEqual([m['waktu'] for m in movements], sorted(m['waktu'] for m in movements))
+
+        # Another outlet's user cannot read outlet 1 by asking for it
+        other = self.client.get('/inventory/LED2/B1/movements?branch=1', headers=self.auth(3, branch_id=2)).json
+        self.assertEqual([(m['jenis'], m['stok_setelah']) for m in other], [('receipt', 8)])
+        movements = self.client.get('/inventory/LED2/B1/movements?branch=2', headers=self.head_office).json
+        self.assertEqual([(m['jenis'], m['stok_setelah']) for m in movements], [('receipt', 8)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+# ./tests/test_logging_config.py
+
+import json
+import logging
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from app import create_app
+from logging_config import JsonFormatter, RequestContextFilter, parse_levels
+
+
+class Capture(logging.Handler):
+    """Keeps records, tagged with the request the way the queue handler tags them"""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.addFilter(RequestContextFilter())
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class JsonFormatterTestCase(unittest.TestCase):
+    def record(self, **extra):
+        record = logging.LogRecord('routes', logging.WARNING, __file__, 1, 'Stock low for %s', ('SKU1',), None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_standard_and_extra_fields(self):
+        entry = json.loads(JsonFormatter().format(self.record(request_id='abc', user_id=None, status=404)))
+        self.assertEqual(entry['level'], 'WARNING')
+        self.assertEqual(entry['logger'], 'routes')
+        self.assertEqual(entry['message'], 'Stock low for SKU1')
+        self.assertEqual((entry['request_id'], entry['status']), ('abc', 404))
+        self.assertTrue(entry['ts'].endswith('+00:00'))
+        # Unset context is left out rather than written as null
+        self.assertNotIn('user_id', entry)
+        self.assertNotIn('args', entry)
+
+    def test_exceptions_are_formatted(self):
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            record = self.record(exc_info=sys.exc_info())
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertIn('ValueError: boom', entry['exc_info'])
+
+    def test_parse_levels(self):
+        self.assertEqual(parse_levels('sqlalchemy.engine=warning, routes=DEBUG,bogus'),
+                         {'sqlalchemy.engine': 'WARNING', 'routes': 'DEBUG'})
+        self.assertEqual(parse_levels(None), {})
+
+
+class RequestLoggingTestCase(unittest.TestCase):
+    def setUp(self):
+        """The real app's logging hooks on test routes; nothing reaches the database"""
+        self.app = create_app()
+        self.app.config.update(LOG_SUCCESS_SAMPLE_RATE=0, LOG_SLOW_REQUEST_MS=60000)
+
+        @self.app.route('/test/ok')
+        def ok():
+            logging.getLogger('test.route').warning("Inside the request")
+            return {'ok': True}
+
+        @self.app.route('/test/broken')
+        def broken():
+            return {'message': 'broken'}, 500
+
+        self.client = self.app.test_client()
+        self.access = Capture()
+        self.route = Capture()
+        for name, handler in (('access', self.access), ('test.route', self.route)):
+            logging.getLogger(name).addHandler(handler)
+            self.addCleanup(logging.getLogger(name).removeHandler, handler)
+
+    def test_request_id_reaches_the_response_and_the_records(self):
+        response = self.client.get('/test/ok', headers={'X-Request-ID': 'edge-1234'})
+        self.assertEqual(response.headers['X-Request-ID'], 'edge-1234')
+        self.assertEqual([record.request_id for record in self.route.records], ['edge-1234'])
+
+        # Without one, each request gets its own
+        first = self.client.get('/test/ok').headers['X-Request-ID']
+        second = self.client.get('/test/ok').headers['X-Request-ID']
+        self.assertNotEqual(first, second)
+        self.assertEqual([record.request_id for record in self.route.records[1:]], [first, second])
+
+    def test_successes_are_sampled_and_failures_always_logged(self):
+        self.client.get('/test/ok')
+        self.client.get('/test/missing')
+        self.client.get('/test/broken')
+        self.assertEqual([(record.levelno, record.status) for record in self.access.records],
+                         [(logging.WARNING, 404), (logging.ERROR, 500)])
+
+        self.app.config['LOG_SUCCESS_SAMPLE_RATE'] = 1
+        self.client.get('/test/ok', headers={'X-Request-ID': 'sampled'})
+        record = self.access.records[-1]
+        self.assertEqual((record.levelno, record.status, record.request_id), (logging.INFO, 200, 'sampled'))
+        self.assertEqual((record.method, record.path, record.endpoint), ('GET', '/test/ok', 'ok'))
+        self.assertGreaterEqual(record.duration_ms, 0)
+
+    def test_slow_successes_are_always_logged(self):
+        self.app.config['LOG_SLOW_REQUEST_MS'] = 0
+        self.client.get('/test/ok')
+        self.assertEqual([(record.levelno, record.status) for record in self.access.records],
+                         [(logging.WARNING, 200)])
+
+
+if __name__ == '__main__':
+    unittest.main()
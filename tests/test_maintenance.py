@@ -0,0 +1,77 @@
+# ./tests/test_maintenance.py
+"""Partition upkeep and archiving, against a real database.
+
+Needs a disposable Postgres database, given as TEST_DATABASE_URL; its
+public schema is dropped and rebuilt from the migrations.
+"""
+
+import os
+import sys
+import unittest
+from datetime import timedelta
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from db_case import TEST_DATABASE_URL, DatabaseTestCase
+
+
+def previous_month(month):
+    return (month - timedelta(days=1)).replace(day=1)
+
+
+class ArchiveTestCase(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.conn = psycopg2.connect(TEST_DATABASE_URL)
+        self.conn.autocommit = True
+        self.addCleanup(self.conn.close)
+
+    def located(self, month):
+        """Schemas holding the transaksi and transaksi_detail tables of a month"""
+        suffix = month.strftime('y%Ym%m')
+        return self.query("""
+            SELECT table_schema, table_name FROM information_schema.tables
+            WHERE table_name IN (%s, %s) ORDER BY table_name
+        """, (f'transaksi_{suffix}', f'transaksi_detail_{suffix}'))
+
+    def test_closed_months_move_to_the_archive(self):
+        from maintenance import archive_before, archive_month, attached_months, current_month, ensure_partitions
+
+        current = current_month(self.conn)
+        last, older = previous_month(current), previous_month(previous_month(current))
+        self.execute('SELECT create_transaksi_partitions(%s, %s)', (older, last))
+        ensure_partitions(self.conn, 2)
+        self.assertEqual(ensure_partitions(self.conn, 2), 0)
+        self.assertTrue({older, last, current} <= set(attached_months(self.conn)))
+
+        self.execute("""
+            INSERT INTO transaksi (total_amount, waktu_transaksi, id_cabang)
+            VALUES (1000, %s::timestamp AT TIME ZONE 'Asia/Jakarta', 1)
+        """, (older,))
+
+        archive_month(self.conn, older)
+        suffix = older.strftime('y%Ym%m')
+        self.assertEqual(self.located(older), [
+            ('archive', f'transaksi_detail_{suffix}'), ('archive', f'transaksi_{suffix}')
+        ])
+        self.assertEqual(self.query(f'SELECT total_amount FROM archive.transaksi_{suffix}'), [(1000,)])
+        self.assertEqual(self.query('SELECT count(*) FROM transaksi'), [(0,)])
+
+        self.assertGreaterEqual(archive_before(self.conn, current), 1)
+        attached = attached_months(self.conn)
+        self.assertNotIn(last, attached)
+        self.assertIn(current, attached)
+        self.assertEqual({schema for schema, _ in self.located(last)}, {'archive'})
+
+        # The open month still takes sales
+        with self.assertRaises(ValueError):
+            archive_month(self.conn, current)
+        with self.assertRaises(ValueError):
+            archive_before(self.conn, (current + timedelta(days=31)).replace(day=1))
+        self.assertEqual({schema for schema, _ in self.located(current)}, {'public'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+# ./tests/test_metrics.py
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from app import create_app
+from utils import create_token
+
+
+class MetricsEndpointTestCase(unittest.TestCase):
+    def setUp(self):
+        """The real app; /metrics never reaches the database"""
+        self.app = create_app()
+        self.app.config['METRICS_TOKEN'] = 'scrape-secret'
+        self.client = self.app.test_client()
+
+    def test_only_the_scraper_reads_metrics(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        # A user's token is not the scraper's, not even an admin's
+        with self.app.app_context():
+            admin = {'Authorization': f'Bearer {create_token(1, is_admin=True)}'}
+        self.assertEqual(self.client.get('/metrics', headers=admin).status_code, 401)
+
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/plain')
+
+    def test_metrics_are_off_without_a_token(self):
+        self.app.config['METRICS_TOKEN'] = None
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+        self.assertEqual(response.status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+# ./tests/test_migrate.py
+"""The migration runner.
+
+The database tests need a disposable Postgres database, given as
+TEST_DATABASE_URL; each test runs its own migration files against an empty
+public schema.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+import migrate
+from db_case import TEST_DATABASE_URL, DatabaseTestCase, reset_database
+
+
+class SplitStatementsTestCase(unittest.TestCase):
+    def test_splits_on_top_level_semicolons(self):
+        sql = """-- migrate:no-transaction
+-- A comment; with a semicolon
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_a ON a (x);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_b
+    ON b (y);
+;
+"""
+        self.assertEqual(migrate.split_statements(sql), [
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_a ON a (x);',
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_b\n    ON b (y);'
+        ])
+
+    def test_keeps_dollar_quoted_bodies_whole(self):
+        function = """CREATE FUNCTION f() RETURNS INTEGER AS $$
+BEGIN
+    -- not a comment to the splitter
+    RETURN 1;
+END;
+$$ LANGUAGE plpgsql;"""
+        self.assertEqual(migrate.split_statements(function + '\nSELECT f()'), [function, 'SELECT f()'])
+
+
+@unittest.skipUnless(TEST_DATABASE_URL, 'TEST_DATABASE_URL is not set')
+class MigrateTestCase(unittest.TestCase):
+    execute = staticmethod(DatabaseTestCase.execute)
+    query = staticmethod(DatabaseTestCase.query)
+
+    def setUp(self):
+        conn = psycopg2.connect(TEST_DATABASE_URL)
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute('DROP SCHEMA IF EXISTS public CASCADE')
+            cursor.execute('DROP SCHEMA IF EXISTS archive CASCADE')
+            cursor.execute('CREATE SCHEMA public')
+        conn.close()
+
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.real_directory = migrate.MIGRATIONS_DIR
+        migrate.MIGRATIONS_DIR = self.directory
+
+    def tearDown(self):
+        migrate.MIGRATIONS_DIR = self.real_directory
+
+    @classmethod
+    def tearDownClass(cls):
+        # Leave the schema the other test classes expect
+        reset_database()
+
+    def write(self, filename, sql):
+        with open(os.path.join(self.directory, filename), 'w', encoding='utf-8') as f:
+            f.write(sql)
+
+    def test_failed_concurrent_index_is_rebuilt_on_rerun(self):
+        self.write('0001_items.sql', 'CREATE TABLE items (code INTEGER);\nINSERT INTO items VALUES (1), (1);\n')
+        self.write('0002_unique_code.sql', '-- migrate:no-transaction\n'
+                   'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_items_code ON items (code);\n')
+
+        with self.assertRaises(psycopg2.errors.UniqueViolation):
+            migrate.migrate(TEST_DATABASE_URL)
+        self.assertEqual(self.query('SELECT version FROM schema_migrations'), [(1,)])
+        self.assertEqual(self.query("""
+            SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = 'uq_items_code'
+        """), [(False,)])
+
+        self.execute('DELETE FROM items WHERE ctid <> (SELECT min(ctid) FROM items)')
+        self.assertEqual(migrate.migrate(TEST_DATABASE_URL), 1)
+        self.assertEqual(self.query("""
+            SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = 'uq_items_code'
+        """), [(True,)])
+        with self.assertRaises(psycopg2.errors.UniqueViolation):
+            self.execute('INSERT INTO items VALUES (1)')
+
+    def test_edited_migration_aborts_the_run(self):
+        self.write('0001_items.sql', 'CREATE TABLE items (code INTEGER);\n')
+        self.assertEqual(migrate.migrate(TEST_DATABASE_URL), 1)
+
+        self.write('0001_items.sql', 'CREATE TABLE items (code BIGINT);\n')
+        self.write('0002_names.sql', 'CREATE TABLE names (name TEXT);\n')
+        with self.assertRaises(migrate.ChecksumMismatch):
+            migrate.migrate(TEST_DATABASE_URL)
+        # Nothing after the edited file ran
+        self.assertEqual(self.query("SELECT to_regclass('names') IS NULL"), [(True,)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+# ./tests/test_products.py
+"""Per-outlet product attributes shared by batches, against a real database.
+
+Needs a disposable Postgres database, given as TEST_DATABASE_URL; its
+public schema is dropped and rebuilt from the migrations.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from db_case import DatabaseTestCase
+
+
+class ProductTestCase(DatabaseTestCase):
+    def create(self, batch_number, **fields):
+        data = {'sku': 'PRD001', 'batch_number': batch_number, 'nama_item': 'Product',
+                'kategori': 'Test', 'harga': 1000, 'stok_tersedia': 5}
+        data.update(fields)
+        return self.client.post('/inventory', json=data, headers=self.headers)
+
+    def batches(self):
+        items = self.client.get('/inventory?search=PRD001', headers=self.headers).json
+        return {item['batch_number']: item for item in items}
+
+    def test_batches_share_the_product(self):
+        self.assertEqual(self.create('B1').status_code, 201)
+        # A further batch takes over the attributes already set
+        response = self.create('B2', nama_item='Other', harga=1)
+        self.assertEqual(response.json['inventory']['harga'], 1000)
+
+        before = self.query("SELECT count(*) FROM change_log WHERE sku = 'PRD001'")[0][0]
+        response = self.client.put('/inventory/PRD001/B1', json={'harga': 1500}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({item['harga'] for item in self.batches().values()}, {1500})
+        # Delta sync still hears about both batches
+        after = self.query("SELECT count(*) FROM change_log WHERE sku = 'PRD001'")[0][0]
+        self.assertEqual(after - before, 2)
+
+        self.client.delete('/inventory/PRD001/B1', headers=self.headers)
+        self.assertEqual(self.query("SELECT count(*) FROM produk WHERE sku = 'PRD001'"), [(1,)])
+        self.client.delete('/inventory/PRD001/B2', headers=self.headers)
+        self.assertEqual(self.query("SELECT count(*) FROM produk WHERE sku = 'PRD001'"), [(0,)])
+
+        # Gone with its last batch, the SKU starts over with new attributes
+        self.assertEqual(self.create('B3', harga=2000).json['inventory']['harga'], 2000)
+
+
+if __name__ == '__main__':
+    unittest.main()
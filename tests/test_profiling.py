@@ -0,0 +1,74 @@
+# ./tests/test_profiling.py
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from app import create_app
+import profiling
+from utils import create_token
+
+
+class ProfilingTestCase(unittest.TestCase):
+    def setUp(self):
+        """App with a slow test route; nothing reaches the database"""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.app = create_app()
+        self.app.config.update(PROFILE_DIR=self.tmp.name, PROFILE_INTERVAL_MS=1,
+                               PROFILE_SAMPLE_RATE=0, RATE_LIMIT_ENABLED=False)
+
+        @self.app.route('/test/slow')
+        def slow():
+            deadline = time.perf_counter() + 0.05
+            while time.perf_counter() < deadline:
+                pass
+            return {'ok': True}
+
+        self.client = self.app.test_client()
+        with self.app.app_context():
+            self.admin = create_token(1, is_admin=True)
+            self.user = create_token(2)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def get(self, token, **headers):
+        return self.client.get('/test/slow', headers={'Authorization': f'Bearer {token}', **headers})
+
+    def test_admin_request_stores_profile(self):
+        response = self.get(self.admin, **{'X-Profile': '1'})
+        profile_id = response.headers['X-Profile-Id']
+
+        with open(profiling.profile_path(self.tmp.name, profile_id, 'collapsed')) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(any('slow (test_profiling.py' in line for line in lines))
+        # Folded stack format: frames joined by ';', then a sample count
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in lines))
+
+        [meta] = profiling.list_profiles(self.tmp.name)
+        self.assertEqual(meta['id'], profile_id)
+        self.assertEqual(meta['status'], 200)
+        self.assertGreater(meta['samples'], 0)
+
+    def test_non_admin_and_plain_requests_are_not_profiled(self):
+        self.assertNotIn('X-Profile-Id', self.get(self.user, **{'X-Profile': '1'}).headers)
+        self.assertNotIn('X-Profile-Id', self.get(self.admin).headers)
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def test_sampled_requests_are_profiled(self):
+        self.app.config['PROFILE_SAMPLE_RATE'] = 1
+        self.assertIn('X-Profile-Id', self.get(self.user).headers)
+
+    def test_profile_ids_cannot_escape_the_directory(self):
+        for profile_id in ('../secret', '.hidden', 'a/b'):
+            with self.assertRaises(ValueError):
+                profiling.profile_path(self.tmp.name, profile_id, 'json')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+# ./tests/test_ratelimit.py
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from app import create_app
+from ratelimit import SharedLimiter, rate_class
+from state import blacklisted_tokens
+from utils import create_stream_token, create_token
+
+
+class SharedLimiterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.limiter = SharedLimiter(os.path.join(self.tmp.name, 'limits.sqlite'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_bucket_allows_burst_then_reports_wait(self):
+        """The burst is admitted, the next request learns how long to wait"""
+        waits = [self.limiter.take('read:user:1', 3, 0.5) for _ in range(4)]
+        self.assertEqual(waits[:3], [0, 0, 0])
+        self.assertGreater(waits[3], 0)
+        self.assertLessEqual(waits[3], 2)
+
+    def test_buckets_are_independent(self):
+        for _ in range(2):
+            self.limiter.take('export:user:1', 2, 0.1)
+        self.assertGreater(self.limiter.take('export:user:1', 2, 0.1), 0)
+        self.assertEqual(self.limiter.take('export:user:2', 2, 0.1), 0)
+        self.assertEqual(self.limiter.take('read:user:1', 2, 0.1), 0)
+
+    def test_concurrency_slots_are_capped_and_released(self):
+        first = self.limiter.acquire('export', 2, 60)
+        second = self.limiter.acquire('export', 2, 60)
+        self.assertIsNotNone(first)
+        self.assertIsNotNone(second)
+        self.assertIsNone(self.limiter.acquire('export', 2, 60))
+
+        self.limiter.release(first)
+        self.assertIsNotNone(self.limiter.acquire('export', 2, 60))
+
+    def test_expired_slots_are_reclaimed(self):
+        """A worker killed mid-request does not hold its slot forever"""
+        self.assertIsNotNone(self.limiter.acquire('export', 1, -1))
+        self.assertIsNotNone(self.limiter.acquire('export', 1, 60))
+
+
+class AdmissionControlTestCase(unittest.TestCase):
+    def setUp(self):
+        """App with tiny limits on test routes; nothing reaches the database"""
+        self.tmp = tempfile.TemporaryDirectory()
+        self.app = create_app()
+        self.app.config.update(
+            RATE_LIMIT_ENABLED=True,
+            RATE_LIMIT_STORE=os.path.join(self.tmp.name, 'limits.sqlite'),
+            RATE_LIMITS={
+                'read': {'per_second': 0.01, 'burst': 2},
+                'export': {'per_second': 100, 'burst': 100}
+            },
+            RATE_LIMIT_CONCURRENCY={'export': 1}
+        )
+
+        @self.app.route('/test/read')
+        def read():
+            return {'ok': True}
+
+        @self.app.route('/test/export')
+        @rate_class('export')
+        def export():
+            return {'ok': True}
+
+        @self.app.route('/test/exempt')
+        @rate_class(None)
+        def exempt():
+            return {'ok': True}
+
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_rejects_with_retry_after_once_bucket_is_empty(self):
+        for _ in range(2):
+            self.assertEqual(self.client.get('/test/read').status_code, 200)
+        response = self.client.get('/test/read')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+
+    def test_users_have_separate_buckets(self):
+        with self.app.app_context():
+            tokens = [create_token(user_id) for user_id in (1, 2)]
+        for _ in range(2):
+            self.client.get('/test/read', headers={'Authorization': f'Bearer {tokens[0]}'})
+        self.assertEqual(
+            self.client.get('/test/read', headers={'Authorization': f'Bearer {tokens[0]}'}).status_code, 429)
+        self.assertEqual(
+            self.client.get('/test/read', headers={'Authorization': f'Bearer {tokens[1]}'}).status_code, 200)
+
+    def test_unusable_tokens_share_the_address_bucket(self):
+        with self.app.app_context():
+            revoked, stream, valid = create_token(3), create_stream_token(4), create_token(5)
+        blacklisted_tokens.add(revoked)
+        self.addCleanup(blacklisted_tokens.discard, revoked)
+
+        for _ in range(2):
+            self.assertEqual(self.client.get('/test/read').status_code, 200)
+        # A logged-out token, or a stream token outside its stream, is anonymous
+        for token in (revoked, stream):
+            response = self.client.get('/test/read', headers={'Authorization': f'Bearer {token}'})
+            self.assertEqual(response.status_code, 429)
+        self.assertEqual(
+            self.client.get('/test/read', headers={'Authorization': f'Bearer {valid}'}).status_code, 200)
+
+    def test_forged_forwarded_for_shares_one_bucket(self):
+        # nginx appends the real peer to whatever the client sent
+        for forged in ('1.1.1.1', '2.2.2.2'):
+            response = self.client.get('/test/read', headers={'X-Forwarded-For': f'{forged}, 10.0.0.7'})
+            self.assertEqual(response.status_code, 200)
+        response = self.client.get('/test/read', headers={'X-Forwarded-For': '3.3.3.3, 10.0.0.7'})
+        self.assertEqual(response.status_code, 429)
+        # Another client behind the same proxy has its own bucket
+        self.assertEqual(
+            self.client.get('/test/read', headers={'X-Forwarded-For': '10.0.0.8'}).status_code, 200)
+
+    def test_concurrency_cap(self):
+        # Another worker holds the only export slot
+        limiter = SharedLimiter(self.app.config['RATE_LIMIT_STORE'])
+        lease_id = limiter.acquire('export', 1, 60)
+        self.assertEqual(self.client.get('/test/export').status_code, 429)
+
+        limiter.release(lease_id)
+        self.assertEqual(self.client.get('/test/export').status_code, 200)
+        # Its own slot is released once the request finishes
+        self.assertEqual(self.client.get('/test/export').status_code, 200)
+
+    def test_exempt_routes_are_not_limited(self):
+        for _ in range(5):
+            self.assertEqual(self.client.get('/test/exempt').status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# ./tests/test_reservations.py
+"""Cart stock holds against a real database.
+
+Needs a disposable Postgres database, given as TEST_DATABASE_URL; its
+public schema is dropped and rebuilt from the migrations.
+"""
+
+import os
+import sys
+import unittest
+import uuid
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from db_case import TEST_DATABASE_URL, DatabaseTestCase
+
+
+class ReservationTestCase(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.other = cls.auth(2, branch_id=1)
+
+    def setUp(self):
+        super().setUp()
+        conn = psycopg2.connect(TEST_DATABASE_URL)
+        with conn, conn.cursor() as cursor:
+            cursor.execute('DELETE FROM reservasi_stok')
+            cursor.execute("""
+                INSERT INTO produk (id_cabang, sku, nama_item, kategori, stok_minimum, harga)
+                VALUES (1, 'RSV001', 'Reserved Item', 'Test', 1, 1000)
+                ON CONFLICT (id_cabang, sku) DO NOTHING
+            """)
+            cursor.execute("""
+                INSERT INTO inventory (id_cabang, sku, batch_number, stok_tersedia)
+                VALUES (1, 'RSV001', 'B1', 10)
+                ON CONFLICT (id_cabang, sku, batch_number) DO UPDATE SET stok_tersedia = 10
+            """)
+        conn.close()
+
+    def reserve(self, cart, jumlah, headers=None):
+        return self.client.put(f'/reservations/{cart}/RSV001/B1', json={'jumlah': jumlah},
+                               headers=headers or self.headers)
+
+    def stock(self):
+        items = self.client.get('/inventory?search=RSV001', headers=self.headers).json
+        return items[0]['stok_reservasi'], items[0]['stok_bebas']
+
+    def test_holds_cannot_oversubscribe(self):
+        first, second = str(uuid.uuid4()), str(uuid.uuid4())
+        self.assertEqual(self.reserve(first, 7).status_code, 200)
+        response = self.reserve(second, 4, self.other)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json['stok_bebas'], 3)
+        self.assertEqual(self.stock(), (7, 3))
+        # Changing the own hold only competes with the other carts
+        self.assertEqual(self.reserve(first, 10).status_code, 200)
+        self.assertEqual(self.stock(), (10, 0))
+
+    def test_sales_respect_other_carts_and_convert_their_own(self):
+        cart = str(uuid.uuid4())
+        self.reserve(cart, 8)
+        sale = {'items': [{'sku': 'RSV001', 'batch_number': 'B1', 'jumlah': 3}]}
+        self.assertEqual(self.client.post('/transactions', json=sale, headers=self.other).status_code, 400)
+        # Naming the cart does not hand its holds to another user
+        sale['id_keranjang'] = cart
+        self.assertEqual(self.client.post('/transactions', json=sale, headers=self.other).status_code, 404)
+
+        sale = {'id_keranjang': cart, 'items': [{'sku': 'RSV001', 'batch_number': 'B1', 'jumlah': 8}]}
+        self.assertEqual(self.client.post('/transactions', json=sale, headers=self.headers).status_code, 201)
+        self.assertEqual(self.client.get(f'/reservations/{cart}', headers=self.headers).json['items'], [])
+        self.assertEqual(self.stock(), (0, 2))
+
+    def test_expired_and_released_holds_free_stock(self):
+        cart = str(uuid.uuid4())
+        self.reserve(cart, 6)
+        conn = psycopg2.connect(TEST_DATABASE_URL)
+        with conn, conn.cursor() as cursor:
+            cursor.execute("UPDATE reservasi_stok SET kedaluwarsa = now() - interval '1 second'")
+        conn.close()
+        self.assertEqual(self.stock(), (0, 10))
+
+        self.reserve(cart, 6)
+        self.assertEqual(self.client.delete(f'/reservations/{cart}', headers=self.headers).json['released'], 1)
+        self.assertEqual(self.stock(), (0, 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
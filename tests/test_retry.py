@@ -0,0 +1,89 @@
+# ./tests/test_retry.py
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from sqlalchemy.exc import OperationalError
+
+import metrics
+from app import create_app
+from retry import retry_reason, retry_transaction
+
+
+class FakePgError(Exception):
+    def __init__(self, pgcode):
+        super().__init__(pgcode)
+        self.pgcode = pgcode
+
+
+def db_error(pgcode):
+    return OperationalError('SELECT 1', {}, FakePgError(pgcode))
+
+
+class RetryTestCase(unittest.TestCase):
+    def setUp(self):
+        """App with zero backoff; the routes never reach the database"""
+        self.app = create_app()
+        self.app.config.update(DB_RETRY_MAX_ATTEMPTS=3, DB_RETRY_BASE_DELAY_MS=0, METRICS_TOKEN='scrape-secret')
+        self.calls = 0
+
+        @self.app.route('/test/conflict-once')
+        @retry_transaction
+        def conflict_once():
+            self.calls += 1
+            if self.calls == 1:
+                raise db_error('40P01')
+            return {'calls': self.calls}
+
+        @self.app.route('/test/always-conflicts')
+        @retry_transaction
+        def always_conflicts():
+            self.calls += 1
+            raise db_error('40001')
+
+        @self.app.route('/test/other-error')
+        @retry_transaction
+        def other_error():
+            self.calls += 1
+            raise db_error('23505')
+
+        self.client = self.app.test_client()
+
+    def test_retry_reason(self):
+        self.assertEqual(retry_reason(db_error('40P01')), 'deadlock')
+        self.assertEqual(retry_reason(db_error('40001')), 'serialization_failure')
+        self.assertEqual(retry_reason(db_error('55P03')), 'lock_timeout')
+        self.assertIsNone(retry_reason(db_error('23505')))
+        self.assertIsNone(retry_reason(ValueError('x')))
+
+    def test_conflict_is_replayed(self):
+        response = self.client.get('/test/conflict-once')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['calls'], 2)
+        key = ('db_transaction_retries_total', (('endpoint', 'conflict_once'), ('reason', 'deadlock')))
+        self.assertGreaterEqual(metrics.snapshot().get(key, 0), 1)
+
+    def test_gives_up_after_max_attempts(self):
+        response = self.client.get('/test/always-conflicts')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertEqual(self.calls, 3)
+
+    def test_other_errors_are_not_retried(self):
+        self.app.config['PROPAGATE_EXCEPTIONS'] = True
+        with self.assertRaises(OperationalError):
+            self.client.get('/test/other-error')
+        self.assertEqual(self.calls, 1)
+
+    def test_metrics_endpoint(self):
+        self.client.get('/test/conflict-once')
+        body = self.client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'}).get_data(as_text=True)
+        self.assertIn('# TYPE db_transaction_retries_total counter', body)
+        self.assertIn('reason="deadlock"', body)
+
+
+if __name__ == '__main__':
+    unittest.main()
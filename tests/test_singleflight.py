@@ -0,0 +1,67 @@
+# ./tests/test_singleflight.py
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from singleflight import SingleFlight
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    def run_concurrently(self, flight, key, fn, count=10):
+        results = []
+        errors = []
+
+        def call():
+            try:
+                results.append(flight.do(key, fn))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_concurrent_calls_share_one_execution(self):
+        flight = SingleFlight()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.2)
+            return {'total': 42}
+
+        results, errors = self.run_concurrently(flight, 'summary', slow)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual({result['total'] for result, _ in results}, {42})
+        self.assertEqual(sum(1 for _, shared in results if not shared), 1)
+
+    def test_error_is_shared_and_not_cached(self):
+        flight = SingleFlight()
+
+        def failing():
+            time.sleep(0.2)
+            raise RuntimeError('boom')
+
+        results, errors = self.run_concurrently(flight, 'summary', failing)
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 10)
+
+        self.assertEqual(flight.do('summary', lambda: 'ok'), ('ok', False))
+
+    def test_different_keys_run_separately(self):
+        flight = SingleFlight()
+        self.assertEqual(flight.do(6, lambda: 'six'), ('six', False))
+        self.assertEqual(flight.do(12, lambda: 'twelve'), ('twelve', False))
+
+
+if __name__ == '__main__':
+    unittest.main()
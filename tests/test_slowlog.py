@@ -0,0 +1,91 @@
+# ./tests/test_slowlog.py
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from app import create_app
+import slowlog
+
+
+class LocalStats(slowlog.QueryStats):
+    """Keeps everything in memory: no background flush thread"""
+
+    def _ensure_thread(self):
+        pass
+
+
+class FingerprintTestCase(unittest.TestCase):
+    def test_literals_and_placeholders_collapse(self):
+        a = slowlog.normalize("SELECT * FROM inventory WHERE sku = 'SKU-1' AND stok_tersedia > 10 -- hot")
+        b = slowlog.normalize("SELECT  *\nFROM inventory WHERE sku = %(sku_1)s AND stok_tersedia > %(stok_1)s")
+        self.assertEqual(a, 'SELECT * FROM inventory WHERE sku = ? AND stok_tersedia > ?')
+        self.assertEqual(a, b)
+
+    def test_in_lists_and_rows_of_any_length_match(self):
+        short = slowlog.fingerprint('SELECT 1 FROM t WHERE id IN (%(id_1_1)s, %(id_1_2)s)')
+        long = slowlog.fingerprint('SELECT 1 FROM t WHERE id IN (%(id_1_1)s, %(id_1_2)s, %(id_1_3)s, %(id_1_4)s)')
+        self.assertEqual(short, long)
+        rows = slowlog.normalize('INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s), (%s, %s)')
+        self.assertEqual(rows, 'INSERT INTO t (a, b) VALUES (...), ...')
+
+    def test_identifiers_keep_their_digits(self):
+        self.assertEqual(slowlog.normalize('SELECT t1.x FROM transaksi_2024_01 t1'),
+                         'SELECT t1.x FROM transaksi_2024_01 t1')
+
+    def test_parameter_shape_has_no_values(self):
+        self.assertEqual(slowlog.parameter_shape({'sku': 'SECRET', 'n': 3}), {'n': 'int', 'sku': 'str'})
+        self.assertEqual(slowlog.parameter_shape([{'a': 1}, {'a': 2}], executemany=True),
+                         {'rows': 2, 'row': {'a': 'int'}})
+
+    def test_only_plain_selects_are_analyzed(self):
+        self.assertTrue(slowlog.read_only('SELECT * FROM inventory'))
+        self.assertFalse(slowlog.read_only('SELECT * FROM inventory FOR UPDATE'))
+        self.assertFalse(slowlog.read_only('WITH d AS (DELETE FROM t RETURNING *) SELECT * FROM d'))
+        self.assertFalse(slowlog.read_only('UPDATE inventory SET harga = 1'))
+
+
+class AggregationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app()
+        self.app.config.update(SLOW_QUERY_MS=100, SLOW_QUERY_EXPLAIN_WINDOW_MINUTES=60)
+        self.stats = LocalStats()
+        self.stats.app = self.app
+
+    def test_repeated_lookups_add_up_per_request(self):
+        lookup = 'SELECT nama_item FROM inventory WHERE sku = %(sku_1)s'
+        with self.app.test_request_context('/transactions'):
+            for sku in ('A', 'B', 'C'):
+                self.stats.record(lookup, {'sku_1': sku}, False, 2.0)
+            self.stats.request_finished()
+        with self.app.test_request_context('/transactions'):
+            self.stats.record(lookup, {'sku_1': 'D'}, False, 2.0)
+            self.stats.request_finished()
+
+        fp, _ = slowlog.fingerprint(lookup)
+        stats = self.stats._pending[fp]
+        self.assertEqual(stats['calls'], 4)
+        self.assertEqual(stats['total_ms'], 8.0)
+        self.assertEqual(stats['max_per_request'], 3)
+        self.assertEqual(stats['slow_calls'], 0)
+        self.assertEqual(self.stats._samples, [])
+
+    def test_slow_statement_is_sampled_and_explained_once(self):
+        statement = 'SELECT * FROM transaksi WHERE waktu_transaksi >= %(start)s'
+        with self.app.app_context():
+            self.stats.record(statement, {'start': 'x'}, False, 250.0)
+            self.stats.record(statement, {'start': 'y'}, False, 300.0)
+
+        fp, _ = slowlog.fingerprint(statement)
+        self.assertEqual(self.stats._pending[fp]['slow_calls'], 2)
+        self.assertEqual(self.stats._pending[fp]['max_ms'], 300.0)
+        self.assertEqual(len(self.stats._samples), 2)
+        self.assertEqual(self.stats._samples[0]['param_shape'], '{"start": "str"}')
+        # Only the first occurrence in the window is queued for EXPLAIN
+        self.assertEqual(self.stats._explain, {fp: (statement, {'start': 'x'})})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+# ./tests/test_stock_take.py
+"""Stock take sessions against a real database.
+
+Needs a disposable Postgres database, given as TEST_DATABASE_URL; its
+public schema is dropped and rebuilt from the migrations.
+"""
+
+import os
+import sys
+import time
+import unittest
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+from db_case import TEST_DATABASE_URL, DatabaseTestCase
+
+
+class StockTakeTestCase(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        conn = psycopg2.connect(TEST_DATABASE_URL)
+        with conn, conn.cursor() as cursor:
+            cursor.execute('DELETE FROM stok_opname')
+            cursor.execute("""
+                INSERT INTO produk (id_cabang, sku, nama_item, kategori, stok_minimum, harga)
+                SELECT 1, 'OPN' || g, 'Counted ' || g, 'Test', 1, 100 FROM generate_series(1, 3) AS g
+                ON CONFLICT (id_cabang, sku) DO NOTHING
+            """)
+            cursor.execute("""
+                INSERT INTO inventory (id_cabang, sku, batch_number, stok_tersedia)
+                SELECT 1, 'OPN' || g, 'B1', 10 FROM generate_series(1, 3) AS g
+                ON CONFLICT (id_cabang, sku, batch_number) DO UPDATE SET stok_tersedia = 10
+            """)
+        conn.close()
+
+    def open(self):
+        response = self.client.post('/stock-takes', json={}, headers=self.headers)
+        self.assertEqual(response.status_code, 201)
+        return response.json['stock_take']['id_opname']
+
+    def count(self, id_opname, *lines):
+        items = [{'sku': sku, 'batch_number': 'B1', 'jumlah': jumlah} for sku, jumlah in lines]
+        return self.client.post(f'/stock-takes/{id_opname}/counts', json={'items': items}, headers=self.headers)
+
+    def stock(self, sku):
+        return self.client.get(f'/inventory?search={sku}', headers=self.headers).json[0]['stok_tersedia']
+
+    def test_apply_keeps_sales_made_after_the_count(self):
+        id_opname = self.open()
+        response = self.count(id_opname, ('OPN1', 7), ('OPN2', 10), ('NOPE', 1))
+        self.assertEqual(response.json['recorded'], 2)
+        self.assertEqual(response.json['unknown'], [{'sku': 'NOPE', 'batch_number': 'B1'}])
+
+        sale = {'items': [{'sku': 'OPN1', 'batch_number': 'B1', 'jumlah': 2}]}
+        self.assertEqual(self.client.post('/transactions', json=sale, headers=self.headers).status_code, 201)
+
+        report = self.client.get(f'/stock-takes/{id_opname}?differences=1', headers=self.headers).json
+        self.assertEqual(report['summary']['counted'], 1)
+        # OPN3 at least; other tests stock outlet 1 as well
+        self.assertGreaterEqual(report['summary']['uncounted'], 1)
+        self.assertEqual(report['items'][0]['selisih'], -3)
+        self.assertEqual(report['items'][0]['stok_setelah'], 5)
+
+        response = self.client.post(f'/stock-takes/{id_opname}/apply', headers=self.headers)
+        self.assertEqual(response.json['adjusted'], 1)
+        self.assertEqual((self.stock('OPN1'), self.stock('OPN2')), (5, 10))
+        # Closed sessions take no more counts and cannot be applied twice
+        self.assertEqual(self.count(id_opname, ('OPN3', 0)).status_code, 409)
+        self.assertEqual(self.client.post(f'/stock-takes/{id_opname}/apply', headers=self.headers).status_code, 409)
+
+    def test_one_open_session_per_outlet_and_recounts_replace(self):
+        id_opname = self.open()
+        response = self.client.post('/stock-takes', json={}, headers=self.headers)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json['stock_take']['id_opname'], id_opname)
+
+        self.count(id_opname, ('OPN3', 4))
+        self.count(id_opname, ('OPN3', 12))
+        report = self.client.get(f'/stock-takes/{id_opname}', headers=self.headers).json
+        self.assertEqual([item['jumlah_hitung'] for item in report['items']], [12])
+
+        self.assertEqual(self.client.delete(f'/stock-takes/{id_opname}', headers=self.headers).status_code, 200)
+        self.assertEqual(self.stock('OPN3'), 10)
+        self.open()
+
+    def test_apply_audits_every_corrected_batch(self):
+        id_opname = self.open()
+        self.count(id_opname, ('OPN1', 12), ('OPN2', 10), ('OPN3', 4))
+        response = self.client.post(f'/stock-takes/{id_opname}/apply', headers=self.headers)
+        self.assertEqual(response.json['adjusted'], 2)
+
+        # The audit writer inserts behind the request
+        deadline = time.monotonic() + 5
+        while True:
+            rows = self.query("""
+                SELECT entity_key->>'sku', perubahan, user_id, id_cabang FROM audit_log
+                WHERE entity = 'inventory' AND action = 'updated' AND request_id = %s
+                ORDER BY entity_key->>'sku'
+            """, (response.headers['X-Request-ID'],))
+            if len(rows) == 2 or time.monotonic() > deadline:
+                break
+            time.sleep(0.05)
+        self.assertEqual(rows, [
+            ('OPN1', {'stok_tersedia': [10, 12]}, 1, 1),
+            ('OPN3', {'stok_tersedia': [10, 4]}, 1, 1)
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+# ./tests/test_sync.py
+"""Delta sync cursors and the change feed.
+
+The feed tests need a disposable Postgres database, given as
+TEST_DATABASE_URL; its public schema is dropped and rebuilt from the
+migrations.
+"""
+
+import os
+import sys
+import unittest
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+import app  # noqa: F401  (sync is imported through app's routes first)
+from sync import decode_cursor, encode_cursor
+
+from db_case import TEST_DATABASE_URL, DatabaseTestCase
+
+
+class SyncCursorTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        for xid, seq in [(0, 0), (1601, 0), (2 ** 40, 123456789)]:
+            self.assertEqual(decode_cursor(encode_cursor(xid, seq)), (xid, seq))
+
+    def test_cursor_is_opaque_and_url_safe(self):
+        cursor = encode_cursor(2 ** 40, 123456789)
+        self.assertNotIn(':', cursor)
+        self.assertNotIn('=', cursor)
+        self.assertRegex(cursor, r'^[A-Za-z0-9_-]+$')
+
+    def test_malformed_cursor(self):
+        for cursor in ['zzz', '', encode_cursor(1, 2)[:-2], 'bm90OmFu']:
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+
+class ChangeFeedTestCase(DatabaseTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.execute("INSERT INTO cabang (id_cabang, kode, nama) VALUES (2, 'CAB2', 'Outlet Dua')")
+        cls.outlet = cls.headers
+        cls.head_office = cls.auth(1)
+
+    def start(self):
+        return self.client.get('/sync/changes', headers=self.outlet).json['cursor']
+
+    def changes(self, cursor, limit=None, headers=None):
+        url = f'/sync/changes?cursor={cursor}' + (f'&limit={limit}' if limit else '')
+        response = self.client.get(url, headers=headers or self.outlet)
+        self.assertEqual(response.status_code, 200)
+        return response.json
+
+    def create(self, sku, batch_number, headers=None, **fields):
+        data = {'sku': sku, 'batch_number': batch_number, 'nama_item': sku, 'kategori': 'Sync',
+                'harga': 1000, 'stok_tersedia': 10}
+        data.update(fields)
+        response = self.client.post('/inventory', json=data, headers=headers or self.outlet)
+        self.assertEqual(response.status_code, 201)
+
+    def test_upserts_tombstones_and_outlet_filter(self):
+        cursor = self.start()
+        self.create('SYN001', 'B1')
+        self.create('SYN001', 'B2')
+        self.create('SYN002', 'B1', headers=self.head_office, id_cabang=2)
+        sale = self.client.post('/transactions', json={
+            'items': [{'sku': 'SYN001', 'batch_number': 'B1', 'jumlah': 1}]
+        }, headers=self.outlet).json['transaction_id']
+        self.client.delete('/inventory/SYN001/B2', headers=self.outlet)
+        self.client.delete(f'/transactions/{sale}', headers=self.outlet)
+
+        page = self.changes(cursor)
+        self.assertFalse(page['has_more'])
+        self.assertEqual([(i['sku'], i['batch_number']) for i in page['inventory']['upserts']], [('SYN001', 'B1')])
+        self.assertEqual(page['inventory']['upserts'][0]['stok_tersedia'], 10)
+        self.assertEqual(page['inventory']['deletes'], [{'id_cabang': 1, 'sku': 'SYN001', 'batch_number': 'B2'}])
+        self.assertEqual(page['transactions'], {'upserts': [], 'deletes': [{'id_transaksi': sale}]})
+
+        # Head office sees the other outlet too
+        keys = {(i['id_cabang'], i['sku']) for i in self.changes(cursor, headers=self.head_office)['inventory']['upserts']}
+        self.assertIn((2, 'SYN002'), keys)
+
+        # Nothing new past the returned cursor
+        page = self.changes(page['cursor'])
+        self.assertEqual(page['inventory'], {'upserts': [], 'deletes': []})
+
+    def test_pages_follow_commit_order(self):
+        cursor = self.start()
+        for batch_number in ('P1', 'P2', 'P3'):
+            self.create('SYN003', batch_number)
+
+        seen = []
+        while True:
+            page = self.changes(cursor, limit=1)
+            seen += [i['batch_number'] for i in page['inventory']['upserts'] if i['sku'] == 'SYN003']
+            cursor = page['cursor']
+            if not page['has_more']:
+                break
+        self.assertEqual(seen, ['P1', 'P2', 'P3'])
+
+    def test_changes_wait_for_older_transactions(self):
+        cursor = self.start()
+        pending = psycopg2.connect(TEST_DATABASE_URL)
+        try:
+            with pending.cursor() as c:
+                c.execute("INSERT INTO produk (id_cabang, sku, nama_item, kategori, harga) VALUES (1, 'SYN004', 'x', 'Sync', 1)")
+                c.execute("INSERT INTO inventory (id_cabang, sku, batch_number, stok_tersedia) VALUES (1, 'SYN004', 'OLD', 1)")
+            # Commits after the older transaction began, so it is held back
+            # until that one finishes and cannot be skipped by the cursor
+            self.create('SYN005', 'NEW')
+            page = self.changes(cursor)
+            self.assertEqual(page['inventory']['upserts'], [])
+            self.assertEqual(page['cursor'], cursor)
+            pending.commit()
+        finally:
+            pending.close()
+
+        skus = {i['sku'] for i in self.changes(cursor)['inventory']['upserts']}
+        self.assertEqual(skus, {'SYN004', 'SYN005'})
+
+    def test_cursor_expires_after_pruning(self):
+        cursor = self.start()
+        self.create('SYN006', 'B1')
+        self.assertEqual(self.client.get(f'/sync/changes?cursor={cursor}', headers=self.outlet).status_code, 200)
+        self.execute("UPDATE change_log SET waktu = waktu - INTERVAL '1 day'")
+        self.execute("SELECT prune_change_log(INTERVAL '1 hour')")
+        response = self.client.get(f'/sync/changes?cursor={cursor}', headers=self.outlet)
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(self.client.get('/sync/changes?cursor=zzz', headers=self.outlet).status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()